@@ -8,6 +8,8 @@ import threading
 import sys
 import serial
 import struct
+import bisect
+import hashlib
 
 # Pillow para texto UTF-8 con tildes/ñ en la interfaz
 from PIL import ImageFont, ImageDraw, Image
@@ -356,12 +358,26 @@ STREAM_FPS = 10
 FRAME_INTERVAL = 1.0 / STREAM_FPS
 CAMERA_INDEX = 0
 RESULT_DISPLAY_TIME = 2.0
+# Enrolamiento facial por ráfaga: recortes de la cara que el servidor filtra por calidad y diversidad
+ENROLL_BURST_FRAMES = 12
+ENROLL_BURST_INTERVAL = 0.25 # Segundos entre muestras (da tiempo a variar levemente la pose)
+ENROLL_BURST_CAPTURE_TIMEOUT = 10.0 # Segundos máximos para capturar la ráfaga (sin ninguna muestra = error; con algunas, se espera al servidor)
+ENROLL_BURST_RESPONSE_TIMEOUT = 20.0 # Segundos esperando la respuesta del servidor tras enviar la ráfaga (> ENROLL_BURST_TIMEOUT del servidor)
+ENROLL_CROP_MARGIN = 0.4 # Margen alrededor de la cara (fracción del lado), el servidor vuelve a detectar
+ENROLL_CROP_SIZE = 300 # Lado mayor del recorte enviado (px)
+ENROLL_JPEG_QUALITY = 90
+
+# Workers de reconocimiento: el RPi envía su stream directo al worker dueño (orden garantizado por el broker)
+WORKER_TIMEOUT = 6.0 # Segundos sin latido para dar por caído a un worker
+RING_REPLICAS = 64 # Nodos virtuales por worker: igual que HashRing en Servidor/hash_ring.py
 
 # --- Topics ---
 TOPIC_PUB_FACIAL_STREAM = f"acceso/request/facial/stream/{RPI_CLIENT_ID}"
 TOPIC_PUB_FACIAL_STOP = f"acceso/request/facial/stop/{RPI_CLIENT_ID}"
+TOPIC_WORKER_MEMBERS = "acceso/workers" # acceso/workers/<worker>: latido de un recognition_worker.py (vacío = salió)
+TOPIC_WORKER_BASE = "acceso/worker" # acceso/worker/<worker>/facial/{stream|stop}/<RPI_CLIENT_ID>
 TOPIC_PUB_FINGER_REQ = f"acceso/request/fingerprint/{RPI_CLIENT_ID}"
-TOPIC_PUB_FACIAL_ENROLL = f"acceso/enroll/facial/data/{RPI_CLIENT_ID}"
+TOPIC_PUB_FACIAL_ENROLL_BURST = f"acceso/enroll/facial/burst/{RPI_CLIENT_ID}"
 TOPIC_PUB_FINGER_ENROLL = f"acceso/enroll/fingerprint/data/{RPI_CLIENT_ID}"
 TOPIC_SUB_RESPONSE = f"acceso/response/{RPI_CLIENT_ID}"
 TOPIC_SUB_COMMAND = f"acceso/command/{RPI_CLIENT_ID}"
@@ -374,6 +390,9 @@ result_end_time = 0
 last_frame_sent_time = 0
 enroll_user_cedula = None
 enroll_user_nombres = None
+enroll_burst = None # Ráfaga en curso: session, sent, started, last, finished
+recognition_workers = {} # worker -> último latido recibido
+facial_stream_worker = None # Worker dueño de la sesión facial en curso (None = topics generales)
 
 # Variables de pantalla responsiva
 screen_width = 640
@@ -591,12 +610,12 @@ def mouse_callback(event, x, y, flags, param):
     # Estado ADMIN_ENROLL_PHOTO
     elif current_state == "ADMIN_ENROLL_PHOTO":
         if buttons['capturar'].is_clicked(x, y):
-            admin_enroll_capture_photo(param['current_frame'])
+            admin_enroll_start_burst()
         elif buttons['cancelar'].is_clicked(x, y):
             cancel_operation()
     
     # Otros estados con cancelar
-    elif current_state in ["VERIFYING_FACIAL", "VERIFYING_FINGER", "ADMIN_ENROLL_FINGER"]:
+    elif current_state in ["VERIFYING_FACIAL", "VERIFYING_FINGER", "ADMIN_ENROLL_BURST", "ADMIN_ENROLL_FINGER"]:
         if buttons['cancelar'].is_clicked(x, y):
             cancel_operation()
 
@@ -663,7 +682,7 @@ def draw_ui(frame, message, color=(255, 255, 255)):
         buttons['capturar'].visible = False
         buttons['salir'].visible = True
         
-    elif current_state == "VERIFYING_FACIAL":
+    elif current_state in ("VERIFYING_FACIAL", "ADMIN_ENROLL_BURST"):
         buttons['facial'].visible = False
         buttons['huella'].visible = False
         buttons['enrolar'].visible = False
@@ -785,7 +804,7 @@ def cancel_operation():
     if current_state == "VERIFYING_FACIAL":
         print("Stream cancelado.")
         try:
-            mqtt_client.publish(TOPIC_PUB_FACIAL_STOP, "{}")
+            mqtt_client.publish(facial_stream_topics()[1], "{}")
         except Exception as e:
             print(f"Error publicando STOP: {e}")
     
@@ -814,10 +833,35 @@ def set_show_result_state(message, status):
 #                      FUNCIONES DE LÓGICA DE ACCESO
 # ==============================================================================
 
+def _ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+def ring_owner(workers, key):
+    """Dueño de `key` con el mismo hashing consistente que Servidor/hash_ring.py (deben coincidir)."""
+    if not workers: return None
+    ring = sorted((_ring_hash(f"{worker}#{i}"), worker) for worker in workers for i in range(RING_REPLICAS))
+    i = bisect.bisect(ring, (_ring_hash(key), ""))
+    return ring[i % len(ring)][1]
+
+def facial_stream_topics():
+    """
+    (stream, stop) de la sesión facial en curso. El worker dueño se elige una vez
+    por sesión y se conserva mientras siga vivo (la sesión de parpadeo vive en él);
+    sin workers anunciados se usan los topics generales (app.py o suscripción compartida).
+    """
+    global facial_stream_worker
+    now = time.time()
+    workers = [worker for worker, seen in list(recognition_workers.items()) if now - seen <= WORKER_TIMEOUT]
+    if facial_stream_worker not in workers: facial_stream_worker = ring_owner(workers, RPI_CLIENT_ID)
+    if facial_stream_worker is None: return TOPIC_PUB_FACIAL_STREAM, TOPIC_PUB_FACIAL_STOP
+    base = f"{TOPIC_WORKER_BASE}/{facial_stream_worker}/facial"
+    return f"{base}/stream/{RPI_CLIENT_ID}", f"{base}/stop/{RPI_CLIENT_ID}"
+
 def start_facial_verification():
     """Iniciar verificación facial"""
-    global current_state, display_message, display_color, last_frame_sent_time
+    global current_state, display_message, display_color, last_frame_sent_time, facial_stream_worker
     current_state = "VERIFYING_FACIAL"
+    facial_stream_worker = None # Nueva sesión: se elige el dueño con los workers vivos
     display_message = "Iniciando reconocimiento facial..."
     display_color = (0, 255, 255)
     last_frame_sent_time = 0
@@ -872,7 +916,7 @@ def stream_facial_frames(frame):
         image_bytes = buffer.tobytes()
         
         try:
-            mqtt_client.publish(TOPIC_PUB_FACIAL_STREAM, image_bytes, qos=0)
+            mqtt_client.publish(facial_stream_topics()[0], image_bytes, qos=0)
             if not display_message.startswith("Parpadee"):
                 display_message = "Analizando... Mire a la cámara"
                 display_color = (0, 255, 0)
@@ -946,25 +990,77 @@ def start_admin_enrollment(cedula, nombres):
     display_message = f"Enrolamiento: {nombres[:25]}"
     display_color = (0, 255, 255)
 
-def admin_enroll_capture_photo(frame):
-    """Capturar foto para enrolamiento"""
-    global current_state, display_message
-    
-    if frame is None:
-        set_show_result_state("Error: Frame inválido", "denied_error")
+def admin_enroll_start_burst():
+    """Iniciar la ráfaga de enrolamiento facial (se envía desde el loop principal)"""
+    global current_state, display_message, display_color, enroll_burst
+    now = time.time()
+    enroll_burst = {"session": f"{RPI_CLIENT_ID}-{int(now * 1000)}", "sent": 0, "started": now, "last": 0.0, "finished": None}
+    current_state = "ADMIN_ENROLL_BURST"
+    display_message = "Mire a la cámara y mueva levemente la cabeza"
+    display_color = (0, 255, 255)
+    print(f"Ráfaga de enrolamiento {enroll_burst['session']} para {enroll_user_cedula}...")
+
+def enroll_burst_send(frame):
+    """Enviar un recorte de la cara cada ENROLL_BURST_INTERVAL hasta completar la ráfaga"""
+    global display_message, display_color
+    burst = enroll_burst
+    if burst is None or current_state != "ADMIN_ENROLL_BURST":
         return
-    
-    print(f"Capturando foto para {enroll_user_cedula}...")
-    _, buffer = cv2.imencode('.jpg', frame)
-    image_b64 = base64.b64encode(buffer).decode('utf-8')
-    payload = {"cedula": enroll_user_cedula, "image_b64": image_b64}
-    
+    now = time.time()
+
+    # Ráfaga completa: solo esperar la respuesta del servidor
+    if burst["finished"] is not None:
+        if now - burst["finished"] > ENROLL_BURST_RESPONSE_TIMEOUT:
+            set_show_result_state("Error Enrol (sin respuesta)", "denied_error")
+        return
+    if now - burst["started"] > ENROLL_BURST_CAPTURE_TIMEOUT:
+        if burst["sent"] == 0:
+            set_show_result_state("Error Enrol (no se detectó rostro)", "denied_error")
+            return
+        # Ráfaga parcial: el servidor la procesa igual al vencer su espera y responde ok/fail
+        print(f"Ráfaga {burst['session']} incompleta ({burst['sent']}/{ENROLL_BURST_FRAMES}); esperando al servidor.")
+        burst["finished"] = now
+        display_message = "Procesando muestras..."
+        return
+    if not HAAR_OK or now - burst["last"] < ENROLL_BURST_INTERVAL:
+        return
+
+    # Misma detección que el stream facial (resolución reducida)
+    scale = 0.5
+    gray = cv2.cvtColor(cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR), cv2.COLOR_BGR2GRAY)
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=3, minSize=(50, 50))
+    if len(faces) == 0:
+        display_message = "Buscando rostro..."
+        return
+    x, y, w, h = [int(v / scale) for v in max(faces, key=lambda f: f[2] * f[3])]
+
+    # Recorte con margen (el servidor vuelve a detectar y alinear dentro de él)
+    margin_x, margin_y = int(w * ENROLL_CROP_MARGIN), int(h * ENROLL_CROP_MARGIN)
+    x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+    x1, y1 = min(frame.shape[1], x + w + margin_x), min(frame.shape[0], y + h + margin_y)
+    crop = frame[y0:y1, x0:x1]
+    ratio = ENROLL_CROP_SIZE / max(crop.shape[:2])
+    if ratio < 1.0:
+        crop = cv2.resize(crop, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, ENROLL_JPEG_QUALITY])
+
+    payload = {"session": burst["session"], "cedula": enroll_user_cedula, "seq": burst["sent"],
+               "total": ENROLL_BURST_FRAMES, "image_b64": base64.b64encode(buffer).decode('utf-8')}
     try:
-        mqtt_client.publish(TOPIC_PUB_FACIAL_ENROLL, json.dumps(payload))
-        display_message = "Foto enviada, esperando confirmación..."
+        mqtt_client.publish(TOPIC_PUB_FACIAL_ENROLL_BURST, json.dumps(payload), qos=1)
     except Exception as e:
-        print(f"Error publicando enrol facial: {e}")
+        print(f"Error publicando ráfaga de enrolamiento: {e}")
         set_show_result_state("Error de red MQTT", "denied_error")
+        return
+
+    burst["sent"] += 1
+    burst["last"] = now
+    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 255), 2)
+    if burst["sent"] >= ENROLL_BURST_FRAMES:
+        burst["finished"] = now
+        display_message = "Procesando muestras..."
+    else:
+        display_message = f"Capturando muestras {burst['sent']}/{ENROLL_BURST_FRAMES}..."
 
 def admin_enroll_fingerprint():
     """Enrolar huella dactilar"""
@@ -1057,7 +1153,8 @@ def on_connect(client, userdata, flags, rc):
         print(f"Conectado Broker MQTT: {MQTT_BROKER_IP}")
         client.subscribe(TOPIC_SUB_RESPONSE)
         client.subscribe(TOPIC_SUB_COMMAND)
-        print(f"Suscrito a {TOPIC_SUB_RESPONSE} y {TOPIC_SUB_COMMAND}")
+        client.subscribe(f"{TOPIC_WORKER_MEMBERS}/+")
+        print(f"Suscrito a {TOPIC_SUB_RESPONSE}, {TOPIC_SUB_COMMAND} y {TOPIC_WORKER_MEMBERS}/+")
     else:
         print(f"Falló conexión MQTT: {rc}")
 
@@ -1066,6 +1163,12 @@ def on_message(client, userdata, msg):
     global current_state, display_message, display_color, result_end_time
     global enroll_user_cedula, enroll_user_nombres
     
+    if msg.topic.startswith(f"{TOPIC_WORKER_MEMBERS}/"): # Latido de un worker (sin log: llega cada pocos segundos)
+        worker = msg.topic.split('/')[-1]
+        if msg.payload: recognition_workers[worker] = time.time()
+        else: recognition_workers.pop(worker, None)
+        return
+    
     print(f"MSG Recibido: {msg.topic}")
     try:
         payload = json.loads(msg.payload.decode('utf-8'))
@@ -1077,11 +1180,11 @@ def on_message(client, userdata, msg):
             if status.startswith("verifying"):
                 if current_state == "VERIFYING_FACIAL":
                     display_message = nombres
-                    display_color = (0, 255, 255)
+                    display_color = (0, 165, 255) if status == "verifying_quality" else (0, 255, 255) # Naranja: acomodarse
                 return
             
             elif status == "enroll_facial_ok":
-                if current_state == "ADMIN_ENROLL_PHOTO":
+                if current_state in ("ADMIN_ENROLL_PHOTO", "ADMIN_ENROLL_BURST"):
                     print("OK foto. Iniciando enrol huella.")
                     current_state = "ADMIN_ENROLL_FINGER"
                     admin_enroll_fingerprint()
@@ -1267,6 +1370,12 @@ def main():
             if frame is None:
                 current_state = "IDLE"
         
+        elif current_state == "ADMIN_ENROLL_BURST":
+            if frame is None:
+                current_state = "IDLE"
+            else:
+                enroll_burst_send(active_frame)
+        
         elif current_state == "ADMIN_ENROLL_FINGER":
             active_frame = np.zeros((screen_height, screen_width, 3), dtype=np.uint8)
         
@@ -0,0 +1,75 @@
+import itertools
+import threading
+from collections import deque
+
+
+class Subscription:
+    """Buffer acotado de un suscriptor (una pestaña del dashboard)."""
+
+    def __init__(self, feed, buffer_size):
+        self.feed = feed
+        self.events = deque(maxlen=buffer_size) # Lleno: se pierde el evento más viejo
+        self.lost = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def _push(self, event):
+        with self._cond:
+            if len(self.events) == self.events.maxlen: self.lost += 1
+            self.events.append(event); self._cond.notify()
+
+    def get(self, timeout):
+        """Eventos pendientes [(id, data), ...]; lista vacía si pasó `timeout` sin novedades (latido)."""
+        with self._cond:
+            if not self.events and not self.closed: self._cond.wait(timeout)
+            events = list(self.events); self.events.clear()
+            return events
+
+    def close(self):
+        with self._cond: self.closed = True; self._cond.notify()
+        self.feed.unsubscribe(self)
+
+
+class AccessFeed:
+    """
+    Difusión en proceso de las decisiones de acceso (pub/sub).
+
+    `publish(data)` asigna un id creciente, guarda el evento en un historial
+    corto (`history`) y lo copia al buffer de cada suscriptor. Los buffers son
+    acotados (`buffer_size`): un suscriptor lento pierde los eventos más viejos
+    en vez de hacer crecer la memoria o frenar al publicador.
+
+    `subscribe(last_id)` reanuda desde el historial: entrega primero los
+    eventos con id > last_id que aún estén en memoria (p. ej. tras una
+    reconexión de EventSource con Last-Event-ID).
+    """
+
+    def __init__(self, history=500, buffer_size=100):
+        self.buffer_size = buffer_size
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, data):
+        with self._lock:
+            event = (next(self._ids), data)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers: subscription._push(event)
+        return event[0]
+
+    def subscribe(self, last_id=None):
+        subscription = Subscription(self, self.buffer_size)
+        with self._lock:
+            if last_id is not None:
+                for event in self._history:
+                    if event[0] > last_id: subscription._push(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock: self._subscribers.discard(subscription)
+
+    def subscribers(self):
+        with self._lock: return len(self._subscribers)
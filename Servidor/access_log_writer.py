@@ -0,0 +1,95 @@
+import time
+import queue
+import datetime
+import threading
+import traceback
+
+
+class AccessLogWriter:
+    """
+    Registro de accesos con escritura diferida (write-behind).
+
+    `log(...)` solo encola el registro (con su timestamp tomado AL ENCOLAR) y
+    retorna; un hilo de fondo los inserta en lotes con UNA transacción cada
+    `batch_size` registros o cada `flush_interval` segundos, lo que ocurra
+    primero. La respuesta a la puerta nunca espera al disco.
+
+    Contrapresión: si la cola llega a `max_queue`, `log` espera hasta
+    `put_timeout` segundos a que el escritor libere espacio; si sigue llena el
+    registro se descarta y se cuenta en `dropped`. `close()` (registrado con
+    atexit por la app) vacía la cola antes de salir.
+
+    `write_batch(records)` recibe una lista de dicts con las columnas de
+    AccessLog y debe escribirlos en una transacción.
+    """
+
+    def __init__(self, write_batch, batch_size=50, flush_interval=0.2, max_queue=10000, put_timeout=1.0):
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.on_batch = None # Callback opcional (cantidad, segundos) para métricas
+        self.on_log = None # Callback opcional (registro) tras encolarlo, p. ej. el feed en vivo del dashboard
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def log(self, user_cedula, user_nombres, access_type, status):
+        self._ensure_started()
+        record = {"timestamp": datetime.datetime.utcnow(), "user_cedula": user_cedula,
+                  "user_nombres": user_nombres, "access_type": access_type, "status": status}
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += 1
+            print(f"[AccessLogWriter] Cola llena ({self._queue.maxsize}); registro descartado: {status} {user_cedula}")
+            return # Descartado: tampoco se difunde (el feed solo muestra lo que se va a escribir)
+        if self.on_log:
+            try: self.on_log(record)
+            except Exception: print(f"[AccessLogWriter] Error en on_log\n{traceback.format_exc()}")
+
+    def _ensure_started(self):
+        if self._thread is not None: return
+        with self._start_lock:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while not (self._stop.is_set() and self._queue.empty() and not batch):
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+                if deadline is None: deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline or self._stop.is_set()):
+                self._flush(batch)
+                batch, deadline = [], None
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self.write_batch(batch)
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            print(f"[AccessLogWriter] Error escribiendo {len(batch)} registros\n{traceback.format_exc()}")
+        if self.on_batch: self.on_batch(len(batch), time.perf_counter() - start)
+
+    def close(self, timeout=10.0):
+        """Vacía la cola (escribe lo pendiente) y detiene el hilo."""
+        if self._thread is None: return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive(): print(f"[AccessLogWriter] Quedaron {self.pending()} registros sin escribir al salir.")
+        else: print(f"[AccessLogWriter] Cerrado: {self.written} registros escritos, {self.dropped} descartados, {self.failed} con error.")
@@ -0,0 +1,165 @@
+import threading
+import numpy as np
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """
+    K-means (Lloyd) en NumPy puro. Retorna (centroides (k, D), asignaciones (N,)).
+    Los clusters vacíos se re-siembran con los puntos peor representados.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    norms_sq = np.einsum('ij,ij->i', vectors, vectors)
+
+    for _ in range(iterations):
+        dist_sq = norms_sq[:, None] - 2.0 * (vectors @ centroids.T) + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+        assign = np.argmin(dist_sq, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids, dtype=np.float64)
+        np.add.at(sums, assign, vectors)
+        empty = counts == 0
+        centroids[~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+        if empty.any():
+            worst = np.argsort(dist_sq[np.arange(len(vectors)), assign])[::-1][:int(empty.sum())]
+            centroids[empty] = vectors[worst]
+
+    dist_sq = norms_sq[:, None] - 2.0 * (vectors @ centroids.T) + np.einsum('ij,ij->i', centroids, centroids)[None, :]
+    return centroids, np.argmin(dist_sq, axis=1)
+
+
+class IVFIndex:
+    """
+    Índice aproximado IVF (listas invertidas sobre centroides k-means),
+    opcionalmente con los residuos comprimidos por Product Quantization (PQ).
+
+    No guarda los vectores originales: solo los ids de fila de la matriz
+    exacta (EmbeddingIndex) y, con PQ, un código de `pq_subvectors` bytes
+    por vector. `search` devuelve ids candidatos; el re-ranking exacto lo
+    hace el dueño de la matriz.
+
+    En NumPy puro el PQ ahorra memoria (16 bytes en vez de 512 por vector)
+    pero no latencia: IVF-flat con re-ranking exacto suele ser más rápido.
+    Ver benchmarks/bench_ann.py.
+
+    Cada lista invertida es una tupla (ids, códigos) que se REEMPLAZA al
+    agregar (copy-on-write), así las búsquedas concurrentes no necesitan lock.
+    """
+
+    def __init__(self, dim=128, nlist=256, pq_subvectors=0, pq_centroids=256):
+        if pq_subvectors and dim % pq_subvectors != 0:
+            raise ValueError(f"dim={dim} no es divisible por pq_subvectors={pq_subvectors}")
+        self.dim = dim
+        self.nlist = nlist
+        self.pq_subvectors = pq_subvectors
+        self.pq_centroids = pq_centroids
+        self.coarse_centroids = None
+        self.codebooks = None # (m, ksub, dsub) si hay PQ
+        self._lists = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_trained(self):
+        return self.coarse_centroids is not None
+
+    def __len__(self):
+        return sum(len(ids) for ids, _ in self._lists)
+
+    def train(self, vectors, iterations=20, seed=0, max_train=20000):
+        """Entrena centroides (y codebooks PQ) sobre una muestra de hasta `max_train` vectores."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > max_train:
+            vectors = vectors[np.random.default_rng(seed).choice(len(vectors), max_train, replace=False)]
+        self.coarse_centroids, assign = kmeans(vectors, self.nlist, iterations, seed)
+        self.nlist = len(self.coarse_centroids)
+        if self.pq_subvectors:
+            residuals = vectors - self.coarse_centroids[assign]
+            m = self.pq_subvectors; dsub = self.dim // m
+            ksub = min(self.pq_centroids, len(vectors))
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * dsub:(j + 1) * dsub], ksub, iterations, seed + j)[0]
+                for j in range(m)
+            ])
+        self._lists = [(np.zeros(0, dtype=np.int64), self._empty_codes()) for _ in range(self.nlist)]
+
+    def _empty_codes(self):
+        return np.zeros((0, self.pq_subvectors), dtype=np.uint8) if self.pq_subvectors else None
+
+    def _assign(self, vectors):
+        c = self.coarse_centroids
+        dist_sq = -2.0 * (vectors @ c.T) + np.einsum('ij,ij->i', c, c)[None, :]
+        return np.argmin(dist_sq, axis=1)
+
+    def _encode(self, residuals):
+        m, ksub, dsub = self.codebooks.shape
+        codes = np.empty((len(residuals), m), dtype=np.uint8)
+        for j in range(m):
+            sub = residuals[:, j * dsub:(j + 1) * dsub]
+            cb = self.codebooks[j]
+            dist_sq = -2.0 * (sub @ cb.T) + np.einsum('ij,ij->i', cb, cb)[None, :]
+            codes[:, j] = np.argmin(dist_sq, axis=1)
+        return codes
+
+    def add(self, ids, vectors):
+        """Agrega vectores (con sus ids de fila) a sus listas. Incremental: no re-entrena."""
+        if not self.is_trained or len(ids) == 0: return
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        chunk = 4096 # Limita la matriz temporal de distancias (chunk x nlist)
+        for start in range(0, len(ids), chunk):
+            self._add_chunk(ids[start:start + chunk], vectors[start:start + chunk])
+
+    def _add_chunk(self, ids, vectors):
+        assign = self._assign(vectors)
+        codes = self._encode(vectors - self.coarse_centroids[assign]) if self.pq_subvectors else None
+        with self._lock:
+            for l in np.unique(assign):
+                mask = assign == l
+                old_ids, old_codes = self._lists[l]
+                new_codes = np.concatenate([old_codes, codes[mask]]) if codes is not None else None
+                self._lists[l] = (np.concatenate([old_ids, ids[mask]]), new_codes)
+
+    def remapped(self, new_ids):
+        """
+        Copia del índice con los ids renumerados según `new_ids` (id viejo -> id
+        nuevo, -1 = eliminado). Comparte centroides y codebooks; no re-entrena.
+        """
+        clone = IVFIndex(self.dim, self.nlist, self.pq_subvectors, self.pq_centroids)
+        clone.coarse_centroids, clone.codebooks = self.coarse_centroids, self.codebooks
+        with self._lock:
+            for ids, codes in self._lists:
+                mapped = new_ids[ids] if len(ids) else ids
+                alive = mapped >= 0
+                clone._lists.append((mapped[alive], codes[alive] if codes is not None else None))
+        return clone
+
+    def search(self, probe, nprobe=8, max_candidates=64):
+        """
+        Retorna ids candidatos de las `nprobe` listas más cercanas.
+        Con PQ se ordenan por distancia aproximada (ADC) y se devuelven como
+        máximo `max_candidates`; sin PQ se devuelven todos los ids de esas listas.
+        """
+        if not self.is_trained: return np.zeros(0, dtype=np.int64)
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        c = self.coarse_centroids
+        coarse_dist_sq = np.einsum('ij,ij->i', c, c) - 2.0 * (c @ probe)
+        nprobe = min(nprobe, self.nlist)
+        probed = np.argpartition(coarse_dist_sq, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        lists = self._lists
+
+        if not self.pq_subvectors:
+            return np.concatenate([lists[l][0] for l in probed])
+
+        m, ksub, dsub = self.codebooks.shape
+        probed = [l for l in probed if len(lists[l][0]) > 0]
+        if not probed: return np.zeros(0, dtype=np.int64)
+        # Tablas ADC de todas las listas sondeadas en una operación: (nprobe, m, ksub)
+        residuals = (probe[None, :] - c[probed]).reshape(len(probed), m, 1, dsub)
+        tables = np.sum((self.codebooks[None] - residuals) ** 2, axis=3)
+        sub_idx = np.arange(m)
+        ids = np.concatenate([lists[l][0] for l in probed])
+        dist = np.concatenate([tables[i][sub_idx, lists[l][1]].sum(axis=1) for i, l in enumerate(probed)])
+        if len(ids) > max_candidates:
+            ids = ids[np.argpartition(dist, max_candidates - 1)[:max_candidates]]
+        return ids
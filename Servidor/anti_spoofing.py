@@ -11,6 +11,13 @@ FACIAL_LANDMARKS_IDXS = {
 # --- Fin de obtención de índices ---\
 
 class BlinkDetector:
+    # Estado del último frame (atributo `state`): el texto que retorna check_liveness es para
+    # la pantalla del RPi; la lógica del servidor decide sobre estos valores
+    STATE_EYES_OPEN = "eyes_open" # Ojos abiertos, esperando parpadeo
+    STATE_CLOSING = "closing"     # Ojos cerrándose / cerrados
+    STATE_BLINK = "blink"         # Parpadeo completo detectado ("VIVO")
+    STATE_ERROR = "error"
+
     # ==================================================================
     # AJUSTE DE SENSIBILIDAD
     # ==================================================================
@@ -19,6 +26,7 @@ class BlinkDetector:
         self.EAR_THRESHOLD = ear_thresh
         self.EAR_CONSEC_FRAMES = ear_consec_frames
         self.frame_counter = 0
+        self.state = None
         
         # --- Eliminados contadores de estado (blink_counter, liveness_confirmed) ---
 
@@ -36,6 +44,7 @@ class BlinkDetector:
     def reset(self):
         """ Resetea el contador de frames. app.py se encarga de la lógica de sesión."""
         self.frame_counter = 0
+        self.state = None
 
     # ==================================================================
     # LÓGICA DE DETECCIÓN MODIFICADA (STATELESS)
@@ -45,7 +54,7 @@ class BlinkDetector:
         """
         Comprueba UN parpadeo. Es "stateless".
         Retorna "VIVO" si detecta un parpadeo, y se resetea internamente.
-        Retorna un mensaje de estado si no.
+        Retorna un mensaje de estado si no. El estado queda en `self.state`.
         """
         try:
             points = np.array([(p.x, p.y) for p in landmarks.parts()], dtype="int")
@@ -58,18 +67,22 @@ class BlinkDetector:
             # Comprobar si el ojo está cerrándose
             if ear < self.EAR_THRESHOLD:
                 self.frame_counter += 1
+                self.state = self.STATE_CLOSING
                 return f"Cerrando ojos..." # Feedback útil
             else:
                 # Comprobar si el ojo *acaba* de abrirse tras un parpadeo
                 if self.frame_counter >= self.EAR_CONSEC_FRAMES:
                     self.frame_counter = 0 # <-- Auto-reseteo
+                    self.state = self.STATE_BLINK
                     return "VIVO" # <-- ¡Parpadeo detectado!
                 
                 # Ojos abiertos, sin parpadeo detectado
                 self.frame_counter = 0
+                self.state = self.STATE_EYES_OPEN
                 return "Mire al frente..." # Estado por defecto
 
         except Exception as e:
             print(f"[ERROR BlinkDetector] {e}")
             self.frame_counter = 0
+            self.state = self.STATE_ERROR
             return "Error Liveness"
\ No newline at end of file
@@ -2,8 +2,6 @@ import os
 import datetime
 import pytz
 import cv2
-import face_recognition
-import dlib
 import pickle
 import time 
 import shutil
@@ -15,40 +13,68 @@ import base64
 from PIL import Image
 import traceback # Para imprimir errores detallados
 import random 
-
-# --- IMPORTAR TU SCRIPT DE ANTI-SPOOFING ---
-try:
-    # Importará la nueva versión con ear_thresh=0.25
-    from anti_spoofing import BlinkDetector
-    print("Módulo Anti-Spoofing (BlinkDetector) cargado.")
-except ImportError:
-    print("ERROR: No se encontró el archivo 'anti_spoofing.py'.")
-    BlinkDetector = None
-
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import atexit
+
+from embedding_index import EmbeddingIndex
+from embedding_store import apply_journal, JOURNAL_OP_ADD, JOURNAL_OP_REMOVE
+from training import list_dataset_images, all_image_paths, encode_dataset
+from embedding_cache import EmbeddingCache, sha256_bytes
+import frame_quality
+from metrics import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE
+from access_log_writer import AccessLogWriter
+from access_feed import AccessFeed
+from auth_cache import AuthCache, AuthEntry
+from retrain_scheduler import RetrainScheduler, RetrainCancelled
+from burst_enrollment import BurstCollector, select_templates
+# Pipeline del stream facial (solo lectura del almacén); compartido con recognition_worker.py
+import recognition
+from recognition import (BlinkDetector, BASE_DIR, EMBEDDINGS_DIR, DATABASE_PATH, FACE_ENGINE, EMBEDDING_MODEL, EMBEDDING_DIM,
+                         DLIB_PREDICTOR_PATH, QUALITY_MIN_SHARPNESS, QUALITY_MIN_FACE_SIZE, MATCH_TOLERANCE,
+                         MQTT_BROKER_IP, MQTT_PORT, TOPIC_REQ_FACIAL_STREAM, TOPIC_REQ_FACIAL_STOP, TOPIC_RESPONSE_BASE, TOPIC_LOG_FACIAL, TOPIC_AUTH_INVALIDATE,
+                         STAGE_SECONDS, FRAMES_RECEIVED, DECISIONS, encoding_lock, embedding_store, liveness_sessions, frame_dispatcher)
+
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import or_
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 
 # --- Configuración ---
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DATASET_PATH = os.path.join(BASE_DIR, "dataset")
-ENCODINGS_PATH = os.path.join(BASE_DIR, "encodings.pickle")
-DLIB_PREDICTOR_PATH = os.path.join(BASE_DIR, "shape_predictor_68_face_landmarks.dat")
+ENCODINGS_PATH = os.path.join(BASE_DIR, "encodings.pickle") # Formato antiguo (solo para migrar)
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, "embedding_cache.db") # Caché por hash de imagen
+JOURNAL_COMPACT_EVERY = 200 # Registros en el journal de enrolamiento antes de compactar el almacén
+RETRAIN_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Procesos del pool de re-entrenamiento
 ECUADOR_TZ = pytz.timezone('America/Guayaquil')
-
-# ==================================================================
-# AJUSTE #5: Reto de 2 parpadeos y Timeout de 12s
-# ==================================================================
-LIVENESS_TIMEOUT = 12.0 # <-- Aumentado a 12s para dar tiempo a 2 parpadeos
+# Con 'forkserver'/'spawn' los procesos del pool de re-entrenamiento re-ejecutan este script como
+# '__mp_main__'; solo necesitan training.encode_image_file: no se carga el motor, el almacén ni la caché
+SERVER_PROCESS = __name__ != '__mp_main__'
+
+# 0 = el stream facial lo atienden procesos recognition_worker.py (configuración del pipeline: recognition.py)
+FACIAL_STREAM_IN_PROCESS = os.environ.get("FACIAL_STREAM_IN_PROCESS", "1") != "0"
+# Registro de accesos con escritura diferida (write-behind)
+ACCESS_LOG_BATCH_SIZE = 50 # Registros por transacción
+ACCESS_LOG_FLUSH_INTERVAL = 0.2 # Segundos máximos que un registro espera en memoria
+ACCESS_LOG_MAX_QUEUE = 10000 # Con la cola llena, log() espera hasta 1 s y luego descarta
+DASHBOARD_PAGE_SIZE = 50 # Registros por página del historial (paginación por cursor)
+# Feed en vivo del dashboard (Server-Sent Events)
+ACCESS_FEED_HISTORY = 500 # Eventos recientes en memoria para reanudar con Last-Event-ID
+ACCESS_FEED_BUFFER = 100 # Eventos pendientes por pestaña; si no los consume, se pierden los más viejos
+ACCESS_FEED_HEARTBEAT = 15.0 # Segundos entre latidos (mantiene viva la conexión a través de proxies)
+AUTH_CACHE_TTL = 60.0 # Segundos máximos que un dato de usuario cacheado puede quedar viejo (respaldo de las invalidaciones)
+# Enrolamiento facial por ráfaga: el RPi envía N recortes de cara y el servidor elige los mejores
+ENROLL_BURST_TIMEOUT = 15.0 # Segundos para recibir la ráfaga completa; al vencer se procesa lo recibido
+ENROLL_BURST_MAX_FRAMES = 30 # Frames máximos aceptados por ráfaga
+ENROLL_BURST_MIN_SAMPLES = 3 # Muestras útiles (cara + calidad + embedding) mínimas para aceptar el enrolamiento
+ENROLL_BURST_KEEP = 5 # Plantillas que se guardan por ráfaga (calidad + diversidad)
 
 app = Flask(__name__)
 
-# --- Lock para Encodings ---
-encoding_lock = threading.Lock() 
+# --- Métricas (formato Prometheus en /metrics) ---
+RETRAIN_SECONDS = Histogram("retrain_duration_seconds", "Duración del re-entrenamiento completo", buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
 
 app.config['SECRET_KEY'] = 'una-clave-secreta-muy-segura-cambiar-en-prod'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASE_DIR, 'database.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DATABASE_PATH
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
@@ -58,34 +84,28 @@ login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, inicie sesión para acceder.'
 login_manager.login_message_category = 'info'
 
-# --- Cargar Modelos Pesados (Dlib) ---
-try:
-    face_detector_dlib = dlib.get_frontal_face_detector()
-    landmark_predictor_dlib = dlib.shape_predictor(DLIB_PREDICTOR_PATH)
-    print("Modelos de Dlib (detector y predictor) cargados.")
-except Exception as e:
-    print(f"Error al cargar modelos de Dlib: {e}")
-    face_detector_dlib = None
-    landmark_predictor_dlib = None
+# --- Cargar Encodings Faciales ---
+# El índice 1:N (recognition.face_index) y el almacén son de recognition.py; este proceso es el único que ESCRIBE el almacén
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, model=EMBEDDING_MODEL) if SERVER_PROCESS else None
 
-# --- GESTOR DE ESTADO DE ANTI-SPOOFING ---
-# { 'detector': <BlinkDetector>, 'start_time': <float>, 'blinks_required': <int>, 'blinks_detected': <int> }
-client_liveness_info = {} 
+def migrate_pickle_encodings():
+    """Convierte un 'encodings.pickle' antiguo al almacén binario (una sola vez)."""
+    try:
+        with open(ENCODINGS_PATH, 'rb') as f: data = pickle.load(f)
+        index = EmbeddingIndex.from_data(data.get("encodings", []), data.get("names", []), dim=EMBEDDING_DIM)
+        embedding_store.save(*index.export())
+        print(f"Migrados {len(index)} encodings de '{ENCODINGS_PATH}' a '{EMBEDDINGS_DIR}'.")
+    except Exception as e: print(f"Error migrando {ENCODINGS_PATH}: {e}")
 
-# --- Cargar Encodings Faciales ---
-known_encodings_data = {"encodings": [], "names": []}
 def load_encodings():
-    global known_encodings_data
-    known_encodings_data = {"encodings": [], "names": []} # Resetear antes de cargar
-    if os.path.exists(ENCODINGS_PATH):
-        try:
-            with encoding_lock:
-                with open(ENCODINGS_PATH, 'rb') as f: known_encodings_data = pickle.load(f)
-            print(f"Encodings cargados desde '{ENCODINGS_PATH}' ({len(known_encodings_data.get('encodings',[]))} rostros).")
-        except Exception as e: print(f"Error al cargar encodings: {e}")
-    else: print(f"Advertencia: No se encontró '{ENCODINGS_PATH}'. ¡Necesita re-entrenar!")
+    """Migra un 'encodings.pickle' antiguo si hace falta y recarga recognition.face_index desde el almacén."""
+    with encoding_lock:
+        if not embedding_store.exists() and os.path.exists(ENCODINGS_PATH): migrate_pickle_encodings()
+        recognition.load_encodings()
 
-load_encodings()
+if SERVER_PROCESS:
+    recognition.load_face_engine()
+    load_encodings()
 
 # --- Modelos de BBDD ---
 class User(db.Model, UserMixin):
@@ -110,173 +130,172 @@ class AccessLog(db.Model):
     user_nombres = db.Column(db.String(100), nullable=True)
     access_type = db.Column(db.String(20), nullable=False, default='desconocido')
     status = db.Column(db.String(50), nullable=False) # Incluirá denied_spoofing
+    # Índices para la paginación por cursor del dashboard: (timestamp, id) para el historial completo
+    # y (user_cedula, timestamp, id) para el filtro por cédula
+    __table_args__ = (db.Index('ix_access_log_timestamp_id', 'timestamp', 'id'),
+                      db.Index('ix_access_log_cedula_timestamp_id', 'user_cedula', 'timestamp', 'id'))
+
+def ensure_access_log_indexes():
+    """Crea los índices de AccessLog en BBDD creadas antes de que existieran (create_all no toca tablas existentes)."""
+    with app.app_context():
+        for index in AccessLog.__table__.indexes: index.create(bind=db.engine, checkfirst=True)
+
+def write_access_logs(records):
+    """Escritor de fondo: inserta un lote de registros en UNA transacción."""
+    with app.app_context():
+        try:
+            db.session.add_all([AccessLog(**record) for record in records]); db.session.commit()
+        except Exception:
+            db.session.rollback(); raise
+
+access_log_writer = AccessLogWriter(write_access_logs, batch_size=ACCESS_LOG_BATCH_SIZE,
+                                    flush_interval=ACCESS_LOG_FLUSH_INTERVAL, max_queue=ACCESS_LOG_MAX_QUEUE)
+access_log_writer.on_batch = lambda count, seconds: STAGE_SECONDS.observe(seconds, stage="db_log")
+if SERVER_PROCESS: atexit.register(access_log_writer.close) # Vaciar la cola al apagar el servidor
+Gauge("access_log_queue_depth", "Registros de acceso esperando al escritor de fondo", fn=lambda: access_log_writer.pending())
+
+# Cada decisión registrada se difunde también a los dashboards abiertos (mismo camino que AccessLog)
+access_feed = AccessFeed(history=ACCESS_FEED_HISTORY, buffer_size=ACCESS_FEED_BUFFER)
+access_log_writer.on_log = lambda record: access_feed.publish({**record, "timestamp": to_ecuador_time(record["timestamp"])})
+Gauge("access_feed_subscribers", "Pestañas del dashboard conectadas al feed en vivo", fn=lambda: access_feed.subscribers())
 
 @login_manager.user_loader
 def load_user(user_id): return db.session.get(User, int(user_id))
 
-def to_ecuador_time(utc_dt):
-    if utc_dt: return utc_dt.replace(tzinfo=pytz.utc).astimezone(ECUADOR_TZ).strftime('%Y-%m-%d %H:%M:%S')
-    return 'N/A'
+# --- Caché de autorización (cédula / huella -> nombres, tipo de acceso) ---
+def _auth_entry(user): return AuthEntry(user.cedula, user.nombres, user.access_type) if user else None
 
-# --- Lógica de Procesamiento Pesado ---
-def process_facial_liveness_and_recognition(image_bytes, rpi_client_id):
-    global client_liveness_info, landmark_predictor_dlib, known_encodings_data
-    
-    current_time = time.time()
-    info = client_liveness_info.get(rpi_client_id)
+def load_auth_by_cedula(cedula):
+    with app.app_context(): return _auth_entry(User.query.filter_by(cedula=cedula).first())
 
-    # 1. --- INICIALIZAR ESTADO (SI ES NUEVO) ---
-    if info is None:
-        if BlinkDetector is None: return "denied_error", "AntiSpoofing no cargado", None
-        
-        info = {}
-        info['detector'] = BlinkDetector() # <-- Crea nueva instancia (con ear_thresh=0.25)
-        info['start_time'] = current_time
-        # ==========================================================
-        # AJUSTE: Reto fijo de 2 parpadeos (SEGURO y USABLE)
-        info['blinks_required'] = 2
-        # ==========================================================
-        info['blinks_detected'] = 0
-        client_liveness_info[rpi_client_id] = info
-        
-        print(f"Nueva prueba de vida para {rpi_client_id}: Se requieren {info['blinks_required']} parpadeos.")
+def load_auth_by_fingerprint(fingerprint_id):
+    with app.app_context(): return _auth_entry(User.query.filter_by(fingerprint_id=fingerprint_id).first())
 
-    # 2. --- OBTENER ESTADO ACTUAL ---
-    blink_detector = info['detector']
-    start_time = info['start_time']
-    blinks_required = info['blinks_required']
-    blinks_detected = info['blinks_detected']
+auth_cache = AuthCache(load_auth_by_cedula, load_auth_by_fingerprint, ttl=AUTH_CACHE_TTL)
+Counter("auth_cache_misses_total", "Consultas de autorización que fueron a la BBDD", fn=lambda: auth_cache.misses)
 
-    try:
-        # 3. --- PROCESAR IMAGEN ---
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None: return "denied_error", "Error decodificando frame", None
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Corrección del typo de la versión anterior
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) 
-        
-        if not face_detector_dlib or not landmark_predictor_dlib: return "denied_error", "Modelos Dlib no cargados", None
-        
-        faces_dlib = face_detector_dlib(gray)
-        if len(faces_dlib) == 0:
-            if blink_detector: blink_detector.reset() # Resetear contador de frames si se pierde cara
-            return "verifying_no_face", "Buscando cara...", None
+def warm_auth_cache():
+    with app.app_context():
+        count = auth_cache.warm((u.cedula, u.nombres, u.access_type, u.fingerprint_id) for u in User.query.all())
+    print(f"Caché de autorización: {count} usuarios precargados.")
 
-        face = faces_dlib[0]
-        landmarks = landmark_predictor_dlib(gray, face)
-        
-        # 4. --- COMPROBAR ESTADO DE LIVENESS ---
-        liveness_status = blink_detector.check_liveness(gray, landmarks)
-        elapsed_time = current_time - start_time
-        
-        # 5. --- MANEJAR TIMEOUT ---
-        if elapsed_time > LIVENESS_TIMEOUT:
-            print(f"Timeout Liveness para {rpi_client_id} ({blinks_detected}/{blinks_required} parpadeos)")
-            if rpi_client_id in client_liveness_info: del client_liveness_info[rpi_client_id]
-            return "denied_spoofing", "Timeout Parpadeo", None
-
-        # 6. --- MANEJAR PARPADEO DETECTADO ("VIVO") ---
-        if liveness_status == "VIVO":
-            blinks_detected += 1
-            info['blinks_detected'] = blinks_detected
-            print(f"Parpadeo {blinks_detected}/{blinks_required} detectado para {rpi_client_id}!")
-            
-            # Comprobar si ya se cumplió
-            if blinks_detected >= blinks_required:
-                 # --- ¡ÉXITO! ---
-                print(f"Liveness VIVO ({blinks_required} parpadeos) confirmado!")
-                if rpi_client_id in client_liveness_info: del client_liveness_info[rpi_client_id]
-                # --- AHORA, CONTINUAR CON RECONOCIMIENTO ---
-                pass
-            
-            else:
-                # --- Aún faltan parpadeos ---
-                msg = f"Parpadee 1 vez más..."
-                return "verifying_liveness", msg, None
-
-        # 7. --- MANEJAR "AÚN VERIFICANDO" (No-VIVO, No-Timeout, No-Exito) ---
-        elif blinks_detected < blinks_required:
-            # El detector aún no dice "VIVO"
-            msg = liveness_status # (ej: "Mire al frente...")
-            if blinks_detected == 0:
-                 msg = f"Parpadee {blinks_required} veces..."
-            elif blinks_detected > 0:
-                 msg = f"Parpadee 1 vez más..."
-            
-            return "verifying_liveness", msg, None
-        
-        # 8. --- SI SE LLEGA AQUÍ, SIGNIFICA QUE blinks_detected >= blinks_required ---
-        # (El código de reconocimiento facial va aquí)
+def invalidate_auth(cedulas=(), fingerprint_ids=()):
+    """Invalida la caché local y la de los recognition_worker.py (TOPIC_AUTH_INVALIDATE)."""
+    cedulas = [c for c in cedulas if c is not None]; fingerprint_ids = [f for f in fingerprint_ids if f is not None]
+    auth_cache.invalidate(cedulas=cedulas, fingerprint_ids=fingerprint_ids)
+    try: mqtt_client.publish(TOPIC_AUTH_INVALIDATE, json.dumps({"cedulas": cedulas, "fingerprint_ids": fingerprint_ids}), qos=1)
+    except Exception as e: print(f"Error publicando invalidación de autorización: {e}") # Los workers caen al TTL
 
-        with encoding_lock:
-            encodings_list = list(known_encodings_data.get("encodings", []))
-            names_list = list(known_encodings_data.get("names", []))
-        
-        if not encodings_list:
-             print("ERROR CRÍTICO: Modelo no entrenado o vacío. ¡Re-entrene!")
-             return "denied_error", "Modelo no entrenado", None
-
-        (x, y, w, h) = (face.left(), face.top(), face.width(), face.height())
-        face_locations = [(y, x + w, y + h, x)]
-        encodings = face_recognition.face_encodings(rgb, face_locations)
-        print(f"Procesando reconocimiento. Encodings detectados: {len(encodings)}")
-
-        if len(encodings) > 0:
-            encoding = encodings[0]
-            matches = face_recognition.compare_faces(encodings_list, encoding, tolerance=0.6)
-            face_distances = face_recognition.face_distance(encodings_list, encoding)
-            name, cedula = "Desconocido", None
-            
-            if True in matches:
-                 matched_indices = [i for i, match in enumerate(matches) if match]
-                 if matched_indices:
-                     face_distances_matched = face_distances[matched_indices]
-                     best_match_local_index = np.argmin(face_distances_matched)
-                     best_match_index = matched_indices[best_match_local_index]
-                     name = names_list[best_match_index]
-                     cedula = name
-                     print(f"Match: {cedula} (Dist: {face_distances[best_match_index]:.4f})")
-                 else: print("Error lógico: True in matches pero no indices.")
-            else:
-                if len(face_distances) > 0:
-                    min_distance_index = np.argmin(face_distances)
-                    min_distance = face_distances[min_distance_index]
-                    closest_cedula = names_list[min_distance_index]
-                    print(f"No match (Tolerancia 0.6). Más cercano: {closest_cedula} (Dist: {min_distance:.4f})")
-                else: print("No match y no encodings conocidos.")
-            
-            if cedula != "Desconocido" and cedula is not None:
-                user = User.query.filter_by(cedula=cedula).first()
-                if user and (user.access_type == 'facial' or user.access_type == 'ambos'): return "authenticated", user.nombres, user.cedula
-                else: return "denied_no_access", "Acceso Facial No Permitido", cedula
-            else: return "denied_unknown", "Usuario Desconocido", None
-        else: return "denied_unknown", "Cara no reconocida (sin encoding)", None
-    
-    except Exception as e:
-        print(f"[Error Procesamiento Facial]\n{traceback.format_exc()}")
-        if rpi_client_id in client_liveness_info:
-            del client_liveness_info[rpi_client_id]
-        return "denied_error", "Error del Servidor", None
+def to_ecuador_time(utc_dt):
+    if utc_dt: return utc_dt.replace(tzinfo=pytz.utc).astimezone(ECUADOR_TZ).strftime('%Y-%m-%d %H:%M:%S')
+    return 'N/A'
 
+# --- Lógica de Procesamiento Pesado ---
 def process_fingerprint_recognition(fingerprint_id):
     try:
         if fingerprint_id is None: return "denied_error", "ID de huella nulo", None
-        user = User.query.filter_by(fingerprint_id=fingerprint_id).first()
+        user = auth_cache.by_fingerprint(fingerprint_id)
         if user:
             if user.access_type == 'huella' or user.access_type == 'ambos': return "authenticated", user.nombres, user.cedula
             else: return "denied_no_access", "Acceso por Huella No Permitido", user.cedula
         else: return "denied_unknown", "Huella Desconocida", None
     except Exception as e: print(f"[Error Procesamiento Huella] {e}"); return "denied_error", "Error del Servidor", None
 
+# --- Historial paginado (cursor sobre (timestamp, id)) ---
+DASHBOARD_FILTERS = ('desde', 'hasta', 'cedula', 'status', 'access_type')
+ACCESS_STATUS_CHOICES = [('authenticated', 'Autenticado'), ('denied_unknown', 'Denegado (Desconocido)'),
+                         ('denied_spoofing', 'Denegado (Spoofing)'), ('denied_no_access', 'Acceso No Permitido'),
+                         ('denied_error', 'Error')]
+ACCESS_TYPE_CHOICES = [('facial', 'Facial'), ('huella', 'Huella')]
+
+def ecuador_date_to_utc(value, next_day=False):
+    """'AAAA-MM-DD' (día local de Ecuador) -> inicio de ese día (o del siguiente) en UTC sin tzinfo, como se guarda."""
+    day = datetime.datetime.strptime(value, '%Y-%m-%d')
+    if next_day: day += datetime.timedelta(days=1)
+    return ECUADOR_TZ.localize(day).astimezone(pytz.utc).replace(tzinfo=None)
+
+def log_cursor(log): return f"{log.timestamp.isoformat()}_{log.id}"
+
+def parse_log_cursor(value):
+    """'<timestamp ISO>_<id>' -> (datetime, id); None si falta o es inválido."""
+    if not value: return None
+    try:
+        timestamp, log_id = value.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError:
+        return None
+
+def access_log_page(query, before=None, after=None, page_size=None):
+    """
+    Una página del historial, de más reciente a más antiguo, con paginación por cursor:
+    `before` = registros más antiguos que ese (timestamp, id), `after` = más recientes.
+    La condición es un rango sobre el índice (timestamp, id), así que el costo no
+    depende de cuántas páginas haya detrás (a diferencia de OFFSET).
+    Retorna (registros, hay_más_antiguos, hay_más_recientes).
+    """
+    page_size = page_size or DASHBOARD_PAGE_SIZE
+    if after is not None:
+        ts, log_id = after
+        query = query.filter(AccessLog.timestamp >= ts, or_(AccessLog.timestamp > ts, AccessLog.id > log_id))
+        rows = query.order_by(AccessLog.timestamp.asc(), AccessLog.id.asc()).limit(page_size + 1).all()
+        has_newer = len(rows) > page_size
+        return list(reversed(rows[:page_size])), True, has_newer
+    if before is not None:
+        ts, log_id = before
+        query = query.filter(AccessLog.timestamp <= ts, or_(AccessLog.timestamp < ts, AccessLog.id < log_id))
+    rows = query.order_by(AccessLog.timestamp.desc(), AccessLog.id.desc()).limit(page_size + 1).all()
+    return rows[:page_size], len(rows) > page_size, before is not None
+
 # --- Rutas Web (Flask) ---
 @app.route('/')
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    logs = AccessLog.query.order_by(AccessLog.timestamp.desc()).all()
-    return render_template('dashboard.html', title='Dashboard', logs=logs, to_ecuador_time=to_ecuador_time)
+    filters = {key: request.args.get(key, '').strip() for key in DASHBOARD_FILTERS}
+    filters = {key: value for key, value in filters.items() if value}
+    query = AccessLog.query
+    try:
+        if 'desde' in filters: query = query.filter(AccessLog.timestamp >= ecuador_date_to_utc(filters['desde']))
+        if 'hasta' in filters: query = query.filter(AccessLog.timestamp < ecuador_date_to_utc(filters['hasta'], next_day=True))
+    except ValueError:
+        flash('Fecha inválida (use AAAA-MM-DD).', 'warning'); filters.pop('desde', None); filters.pop('hasta', None)
+        query = AccessLog.query
+    if 'cedula' in filters: query = query.filter(AccessLog.user_cedula == filters['cedula'])
+    if 'status' in filters: query = query.filter(AccessLog.status == filters['status'])
+    if 'access_type' in filters: query = query.filter(AccessLog.access_type == filters['access_type'])
+
+    before, after = parse_log_cursor(request.args.get('before')), parse_log_cursor(request.args.get('after'))
+    logs, has_older, has_newer = access_log_page(query, before=before, after=after)
+    if after is not None and not has_newer: # Se llegó a lo más reciente: mostrar la primera página completa
+        logs, has_older, has_newer = access_log_page(query)
+    older_url = url_for('dashboard', before=log_cursor(logs[-1]), **filters) if has_older else None
+    newer_url = url_for('dashboard', after=log_cursor(logs[0]), **filters) if has_newer else None
+    return render_template('dashboard.html', title='Dashboard', logs=logs, to_ecuador_time=to_ecuador_time,
+                           filters=filters, older_url=older_url, newer_url=newer_url,
+                           status_choices=ACCESS_STATUS_CHOICES, access_type_choices=ACCESS_TYPE_CHOICES,
+                           live_feed=before is None and after is None and 'hasta' not in filters,
+                           retrain=retrain_scheduler.status())
+
+@app.route('/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """Server-Sent Events con cada decisión de acceso nueva; reanuda con Last-Event-ID (o ?last_id=)."""
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try: last_id = int(last_id) if last_id else None
+    except ValueError: last_id = None
+    subscription = access_feed.subscribe(last_id)
+
+    def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                batch = subscription.get(ACCESS_FEED_HEARTBEAT)
+                if not batch: yield ": ping\n\n"; continue
+                for event_id, data in batch: yield f"id: {event_id}\nevent: access\ndata: {json.dumps(data)}\n\n"
+        finally:
+            subscription.close() # Pestaña cerrada: el servidor falla al escribir y cierra el generador
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -319,6 +338,7 @@ def register():
             flash('La cédula ya existe.', 'danger'); return redirect(url_for('register'))
         new_user = User(cedula=cedula, nombres=nombres, role=role, access_type=access_type, first_login=True)
         new_user.set_password(cedula); db.session.add(new_user); db.session.commit()
+        invalidate_auth(cedulas=[cedula])
         command_payload = {"command": "start_admin_enroll", "user_cedula": cedula, "user_nombres": nombres}
         topic = f"acceso/command/{RPI_CLIENT_ID}"
         try:
@@ -345,6 +365,7 @@ def update_user(user_id):
     if not user or user.cedula == 'admin': return redirect(url_for('user_management'))
     
     old_access_type = user.access_type; fingerprint_id_to_delete = user.fingerprint_id
+    old_cedula = user.cedula # Los embeddings están indexados por la cédula anterior
     
     user.nombres = request.form['nombres']; user.cedula = request.form['cedula']
     user.role = request.form['role']; user.access_type = request.form['access_type']
@@ -353,7 +374,8 @@ def update_user(user_id):
         user.set_password(user.cedula); user.first_login = True
         flash(f'Contraseña de {user.nombres} reseteada.', 'warning')
     
-    trigger_retrain = False 
+    facial_before = old_access_type in ('facial', 'ambos')
+    facial_after = user.access_type in ('facial', 'ambos')
     
     if (old_access_type == 'huella' or old_access_type == 'ambos') and \
        (user.access_type == 'ninguno' or user.access_type == 'facial') and \
@@ -366,16 +388,15 @@ def update_user(user_id):
             flash(f'Huella de {user.nombres} eliminada del sensor.', 'info')
         except Exception as e: print(f"Error publicando comando borrado: {e}")
         
-    if (old_access_type == 'facial' or old_access_type == 'ambos') and \
-       (user.access_type == 'ninguno' or user.access_type == 'huella'):
-        print(f"Acceso facial revocado para {user.nombres}. Se requiere re-entrenamiento.")
-        trigger_retrain = True
-        
     db.session.commit(); flash(f'Usuario {user.nombres} actualizado.', 'success')
+    invalidate_auth(cedulas=[old_cedula, user.cedula], fingerprint_ids=[fingerprint_id_to_delete])
     
-    if trigger_retrain:
-        print("Iniciando re-entrenamiento completo por revocación de acceso...")
-        thread = threading.Thread(target=train_encodings_task); thread.start()
+    if facial_before and not facial_after:
+        print(f"Acceso facial revocado para {user.nombres}. Eliminando sus embeddings del índice...")
+        remove_user_embeddings(old_cedula)
+    elif facial_after and not facial_before:
+        print(f"Acceso facial restaurado para {user.nombres}. Re-agregando sus embeddings...")
+        thread = threading.Thread(target=add_user_embeddings, args=(user.cedula,)); thread.start()
         
     return redirect(url_for('user_management'))
 
@@ -386,12 +407,13 @@ def delete_user(user_id):
     user = db.session.get(User, user_id)
     if not user or user.cedula == 'admin': return redirect(url_for('user_management'))
     
-    fingerprint_id_to_delete = user.fingerprint_id
+    fingerprint_id_to_delete = user.fingerprint_id; cedula = user.cedula
     user_folder = os.path.join(DATASET_PATH, user.cedula)
     user_had_facial = user.has_facial 
     
     if os.path.exists(user_folder): shutil.rmtree(user_folder)
     db.session.delete(user); db.session.commit()
+    invalidate_auth(cedulas=[cedula], fingerprint_ids=[fingerprint_id_to_delete])
     
     if fingerprint_id_to_delete is not None:
         cmd = {"command": "delete_finger", "fingerprint_id": fingerprint_id_to_delete}
@@ -402,90 +424,168 @@ def delete_user(user_id):
     flash(f'Usuario {user.nombres} eliminado.', 'success')
     
     if user_had_facial:
-        print("Usuario eliminado tenía datos faciales. Iniciando re-entrenamiento completo...")
-        thread = threading.Thread(target=train_encodings_task); thread.start()
+        print("Usuario eliminado tenía datos faciales. Eliminando sus embeddings del índice...")
+        remove_user_embeddings(cedula)
 
     return redirect(url_for('user_management'))
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas en formato de texto Prometheus (sin login, para el scraper; exponer solo en la red interna)."""
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
 @app.route('/retrain')
 @login_required
 def retrain_encodings():
     if current_user.role not in ['admin', 'administrador']: return redirect(url_for('dashboard'))
-    flash('Iniciando re-entrenamiento (Sincronización Manual)...', 'info') 
-    thread = threading.Thread(target=train_encodings_task); thread.start()
+    job, coalesced = retrain_scheduler.request(f"manual ({current_user.cedula})")
+    if coalesced: flash(f'Ya hay un re-entrenamiento pendiente (#{job.id}); se atenderá este pedido en esa misma corrida.', 'info')
+    else: flash(f'Re-entrenamiento #{job.id} programado (Sincronización Manual).', 'info')
     return redirect(url_for('dashboard'))
 
-def train_encodings_task():
-    print("Iniciando tarea de (re)entrenamiento COMPLETO...") 
-    known_encodings = []; known_names = []
+@app.route('/retrain/status')
+@login_required
+def retrain_status():
+    """Estado del planificador: corrida en curso (fase, imágenes, ETA), pedido pendiente y última corrida."""
+    return jsonify(retrain_scheduler.status())
+
+@app.route('/retrain/cancel', methods=['POST'])
+@login_required
+def retrain_cancel():
+    if current_user.role not in ['admin', 'administrador']: return redirect(url_for('dashboard'))
+    if retrain_scheduler.cancel(): flash('Re-entrenamiento cancelado. Se conserva el modelo actual.', 'warning')
+    else: flash('No hay re-entrenamiento en curso.', 'info')
+    return redirect(url_for('dashboard'))
+
+def train_encodings_task(job):
+    """
+    Re-entrenamiento COMPLETO en paralelo: las imágenes se reparten en un pool
+    de RETRAIN_WORKERS procesos, los embeddings llegan en streaming al índice
+    nuevo y 'has_facial' se sincroniza en UN solo commit al final.
+    Corre en el hilo de retrain_scheduler: revisa la cancelación por imagen
+    (antes de reemplazar el almacén) y reporta el avance en `job`.
+    """
+    global retrain_journal_start
+    print(f"Iniciando tarea de (re)entrenamiento COMPLETO (#{job.id}: {', '.join(job.reasons)})...")
+    # Posición del journal al empezar: lo que se agregue después (enrolamientos, revocaciones) no está
+    # en el dataset que se lee, y se re-aplica sobre el índice nuevo antes de reemplazar el almacén.
+    # Mientras tanto, los enrolamientos no compactan el almacén (la generación no cambia).
+    with encoding_lock:
+        header = embedding_store.read_header() if embedding_store.exists() else {}
+        retrain_journal_start = (header.get('generation'), embedding_store.journal_count())
+    try: return _train_encodings(job)
+    finally: retrain_journal_start = None
+
+def _train_encodings(job):
+    start_time = time.time()
+    index = EmbeddingIndex(dim=EMBEDDING_DIM)
+    img_counts = {}
     with app.app_context():
-        if not os.path.exists(DATASET_PATH): print(f"ERROR: Directorio '{DATASET_PATH}' no existe."); return
-        
-        users_in_db_with_facial = {u.cedula for u in User.query.filter(User.access_type.in_(['facial', 'ambos'])).all()}
+        if not os.path.exists(DATASET_PATH):
+            print(f"ERROR: Directorio '{DATASET_PATH}' no existe."); job.message = "No existe el directorio del dataset"; return False
         
-        for cedula_dir in os.listdir(DATASET_PATH):
-            user_folder = os.path.join(DATASET_PATH, cedula_dir)
-            if os.path.isdir(user_folder):
-                
-                if cedula_dir not in users_in_db_with_facial:
-                    print(f"Omitiendo {cedula_dir} (Usuario no existe o no tiene acceso facial)...");
-                    continue
-
-                print(f"Procesando fotos para {cedula_dir}...")
-                img_count = 0
-                for filename in os.listdir(user_folder):
-                    if filename.lower().endswith(('.jpg', '.png', '.jpeg')):
-                        img_path = os.path.join(user_folder, filename)
-                        try:
-                            image = face_recognition.load_image_file(img_path)
-                            boxes = face_recognition.face_locations(image, model='hog')
-                            if len(boxes) > 0:
-                                encoding = face_recognition.face_encodings(image, boxes)[0]
-                                known_encodings.append(encoding); known_names.append(cedula_dir); img_count += 1
-                                print(f"  + {filename}")
-                            else: print(f"  - Sin cara: {filename}")
-                        except Exception as e: print(f"  ! Error {filename}: {e}")
-                
-                # Sincronizar 'has_facial' en la BBDD
-                user = User.query.filter_by(cedula=cedula_dir).first()
-                if user:
-                    if img_count > 0 and not user.has_facial:
-                        user.has_facial = True;
-                        print(f"  -> {img_count} fotos ok. (Actualizando BBDD)")
-                    elif img_count == 0 and user.has_facial:
-                        user.has_facial = False;
-                        print(f"  -> 0 fotos ok. (Actualizando BBDD)")
-                    elif img_count > 0:
-                        print(f"  -> {img_count} fotos ok. (BBDD ya correcta)")
-                    else:
-                        print(f"  -> 0 fotos ok. (BBDD ya correcta)")
-        
-        db.session.commit() # Commit de todos los cambios de 'has_facial'
+        users_with_facial = {u.cedula: u for u in User.query.filter(User.access_type.in_(['facial', 'ambos'])).all()}
+        tasks, skipped = list_dataset_images(DATASET_PATH, users_with_facial)
+        for cedula_dir in skipped: print(f"Omitiendo {cedula_dir} (Usuario no existe o no tiene acceso facial)...")
+        job.phase = "cache"; job.progress(0, len(tasks))
+
+        def add_result(cedula_dir, img_path, encoding):
+            img_counts.setdefault(cedula_dir, 0)
+            if encoding is not None:
+                index.add(encoding, cedula_dir); img_counts[cedula_dir] += 1
+            else: print(f"  - Sin cara: {img_path}")
+
+        # 1. Caché por contenido: solo las imágenes nuevas o modificadas van al motor facial
+        digests, misses = {}, []
+        for cedula_dir, img_path in tasks:
+            job.check_cancelled()
+            try:
+                digests[img_path] = embedding_cache.file_hash(img_path)
+                found, encoding = embedding_cache.get(digests[img_path])
+            except Exception as e:
+                print(f"  ! Error caché {img_path}: {e}"); found = False
+            if found: add_result(cedula_dir, img_path, encoding)
+            else: misses.append((cedula_dir, img_path))
+        print(f"Procesando {len(tasks)} fotos: {len(tasks) - len(misses)} desde caché, {len(misses)} con {RETRAIN_WORKERS} procesos...")
+
+        # 2. Embeddings nuevos en paralelo (y se guardan en la caché)
+        cached = len(tasks) - len(misses)
+        job.phase = "encode"; job.progress(cached, len(tasks))
+        try:
+            progress = lambda done, total, eta: job.progress(cached + done, len(tasks), eta)
+            for cedula_dir, img_path, encoding, error in encode_dataset(misses, RETRAIN_WORKERS, FACE_ENGINE, BASE_DIR, progress=progress):
+                job.check_cancelled() # Al salir del for se cierra el pool (espera solo las imágenes en vuelo)
+                if error:
+                    img_counts.setdefault(cedula_dir, 0)
+                    print(f"  ! Error {img_path}: {error}"); continue
+                if img_path in digests: embedding_cache.put(digests[img_path], encoding)
+                add_result(cedula_dir, img_path, encoding)
+        except RetrainCancelled:
+            raise
+        except Exception as e:
+            print(f"[Error en el pool de re-entrenamiento] {e}. Se conserva el modelo actual.")
+            job.message = f"Error en el pool: {e}"; return False
 
-    if not known_encodings: 
-        print("ADVERTENCIA: No se generaron encodings. El archivo .pickle será vaciado.");
-        data = {"encodings": [], "names": []}
-    else:
-        data = {"encodings": known_encodings, "names": known_names}
+        job.check_cancelled() # Último punto de cancelación: desde aquí se escribe BBDD y almacén
+        job.phase = "store"
+
+        # 3. Podar la caché: imágenes borradas del dataset
+        try:
+            evicted = embedding_cache.evict_missing(all_image_paths(DATASET_PATH))
+            if evicted: print(f"  Caché: {evicted} embeddings de imágenes borradas eliminados.")
+        except Exception as e: print(f"  ! Error podando caché: {e}")
+
+        print(f"  -> {len(index)} fotos ok de {len(img_counts)} usuarios.")
 
     try:
         with encoding_lock:
-            with open(ENCODINGS_PATH, "wb") as f: pickle.dump(data, f)
-        
-        print(f"Entrenamiento finalizado. '{ENCODINGS_PATH}' actualizado ({len(known_encodings)} encodings)."); 
+            # Cambios incrementales hechos durante el re-entrenamiento: el journal es la fuente de verdad
+            generation, journal_start = retrain_journal_start
+            header = embedding_store.read_header() if embedding_store.exists() else {}
+            if header.get('generation') != generation:
+                print("ERROR: El almacén cambió de generación durante el re-entrenamiento. Se conserva el modelo actual.")
+                job.message = "El almacén cambió de generación durante el re-entrenamiento"; return False
+            if header:
+                journal_ops, journal_cedulas, journal_vectors = embedding_store.read_journal(header, start=journal_start)
+                apply_journal(index, journal_ops, journal_cedulas, journal_vectors)
+                if journal_ops: print(f"  {len(journal_ops)} registros del journal posteriores al inicio re-aplicados.")
+            if len(index) == 0: print("ADVERTENCIA: No se generaron encodings. El almacén será vaciado.")
+            header = embedding_store.compact(*index.export())
+            # Reabrir la nueva generación con mmap y reemplazar el índice en memoria SIN soltar el lock:
+            # un enrolamiento o revocación entre compactar y reemplazar se perdería en memoria
+            load_encodings()
         
-        # Recargar los encodings en memoria (ya está protegido por el lock)
-        load_encodings()
+        RETRAIN_SECONDS.observe(time.time() - start_time)
+        print(f"Entrenamiento finalizado en {time.time() - start_time:.1f}s. '{EMBEDDINGS_DIR}' actualizado (generación {header['generation']}, {len(index)} encodings)."); 
+        job.message = f"{len(index)} encodings de {len(img_counts)} usuarios"
         
-    except Exception as e: print(f"Error al guardar {ENCODINGS_PATH}: {e}")
-
+    except Exception as e:
+        print(f"Error al guardar {EMBEDDINGS_DIR}: {e}"); job.message = f"Error al guardar el almacén: {e}"; return False
 
-def update_model_with_image(cedula, image_bytes):
+    # Sincronizar 'has_facial' con el índice FINAL (incluye el journal re-aplicado), en un solo commit
+    _, labels, names = index.export()
+    rows = dict(zip(names, np.bincount(labels, minlength=len(names)).tolist()))
+    with app.app_context():
+        changed = 0
+        for user in User.query.filter(User.access_type.in_(['facial', 'ambos'])).all():
+            count = rows.get(user.cedula, 0)
+            if count == 0 and not os.path.isdir(os.path.join(DATASET_PATH, user.cedula)): continue
+            if (count > 0) != bool(user.has_facial):
+                user.has_facial = count > 0; changed += 1
+        db.session.commit()
+    print(f"  'has_facial' actualizado en {changed} usuarios.")
+
+retrain_journal_start = None # (generación, registros en el journal) al empezar el re-entrenamiento en curso
+retrain_scheduler = RetrainScheduler(train_encodings_task)
+Gauge("retrain_running", "1 si hay un re-entrenamiento completo en curso", fn=lambda: int(retrain_scheduler.running is not None))
+
+def update_model_with_image(cedula, image_bytes, img_path=None):
     """
-    Procesa UNA imagen y la añade de forma incremental al archivo de encodings.
+    Procesa UNA imagen y la añade de forma incremental: un registro en el
+    journal del almacén (O(1) en disco) y una fila nueva en recognition.face_index.
+    `img_path` es la foto ya guardada en dataset/ con esos bytes (para la caché).
     Es 'thread-safe' usando encoding_lock.
     """
-    global known_encodings_data
     print(f"Actualización incremental: Procesando imagen para {cedula}...")
     
     try:
@@ -496,51 +596,145 @@ def update_model_with_image(cedula, image_bytes):
             print("Error: No se pudo decodificar la imagen para el encoding.")
             return False
             
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        boxes = face_recognition.face_locations(rgb_image, model='hog')
+        if recognition.face_engine is None:
+            print("Error: Motor facial no cargado.")
+            return False
+        new_encoding = recognition.face_engine.embed_image(image)
         
-        if len(boxes) == 0:
+        if new_encoding is None:
             print("Advertencia: No se detectó cara en la imagen de enrolamiento.")
             return False 
 
-        new_encoding = face_recognition.face_encodings(rgb_image, boxes)[0]
+        try: embedding_cache.put(sha256_bytes(image_bytes), new_encoding, img_path) # La foto guardada en dataset/ tiene los mismos bytes
+        except Exception as e: print(f"Advertencia: no se pudo guardar en la caché de embeddings: {e}")
 
-        # 2. Actualizar el archivo y la variable global (con bloqueo)
+        # 2. Registrar en el journal (1 registro + fsync) y agregar al índice en memoria.
+        #    El lock solo serializa enrolamientos/compactación; el reconocimiento no lo usa.
         with encoding_lock:
-            print("Lock adquirido. Actualizando encodings...")
-            
-            # Cargar los datos FRESCOS del disco, por si acaso
-            current_data = {"encodings": [], "names": []}
-            if os.path.exists(ENCODINGS_PATH):
-                try:
-                    with open(ENCODINGS_PATH, 'rb') as f:
-                        current_data = pickle.load(f)
-                except Exception as e:
-                    print(f"Error cargando pickle para actualizar: {e}. Se creará uno nuevo.")
-
-            # 3. Añadir nuevo encoding
-            current_data["encodings"].append(new_encoding)
-            current_data["names"].append(cedula)
-
-            # 4. Guardar de nuevo en el disco
             try:
-                with open(ENCODINGS_PATH, "wb") as f:
-                    pickle.dump(current_data, f)
-                
-                # 5. Actualizar la variable global
-                known_encodings_data = current_data
-                print(f"Encoding para {cedula} añadido. Total: {len(known_encodings_data['encodings'])}")
-                return True
-                
+                journal_count = embedding_store.append(cedula, new_encoding)
             except Exception as e:
-                print(f"Error CRÍTICO guardando {ENCODINGS_PATH} actualizado: {e}")
+                print(f"Error CRÍTICO escribiendo el journal de {EMBEDDINGS_DIR}: {e}")
                 return False
+            recognition.face_index.add(new_encoding, cedula)
+            print(f"Encoding para {cedula} añadido. Total: {len(recognition.face_index)}")
+
+            # 3. Compactación periódica del journal en una generación nueva
+            if journal_count >= JOURNAL_COMPACT_EVERY and retrain_journal_start is None: # Durante un re-entrenamiento compacta él
+                try:
+                    header = embedding_store.compact(*recognition.face_index.export())
+                    print(f"Journal compactado en la generación {header['generation']} ({header['count']} encodings).")
+                except Exception as e: print(f"Error compactando {EMBEDDINGS_DIR}: {e}")
+        return True
         
     except Exception as e:
         print(f"[Error en update_model_with_image]\n{traceback.format_exc()}")
         return False
 
 
+def remove_user_embeddings(cedula):
+    """
+    Revocación/borrado en milisegundos: tombstone en el journal + eliminación
+    de las filas de esa cédula en recognition.face_index, sin tocar a los demás usuarios.
+    """
+    start = time.time()
+    with encoding_lock:
+        try: embedding_store.append_remove(cedula)
+        except Exception as e: print(f"Error escribiendo tombstone de {cedula} en el journal: {e}")
+        removed = recognition.face_index.remove_label(cedula)
+    print(f"Embeddings de {cedula} eliminados del índice: {removed} filas en {(time.time() - start) * 1000:.1f} ms.")
+    return removed
+
+def add_user_embeddings(cedula):
+    """
+    Re-agrega los embeddings de UN usuario desde dataset/<cedula>/ (usando la
+    caché por contenido; solo las fotos sin caché pasan por el motor facial).
+    """
+    user_folder = os.path.join(DATASET_PATH, cedula)
+    if not os.path.isdir(user_folder): print(f"No hay fotos de {cedula} en el dataset."); return 0
+    tasks, _ = list_dataset_images(DATASET_PATH, {cedula})
+    encodings = []
+    for _, img_path in tasks:
+        try:
+            digest = embedding_cache.file_hash(img_path)
+            found, encoding = embedding_cache.get(digest)
+            if not found:
+                image = cv2.imread(img_path, cv2.IMREAD_COLOR)
+                if image is None or recognition.face_engine is None: print(f"  ! Error {img_path}: imagen o motor no disponible"); continue
+                encoding = recognition.face_engine.embed_image(image)
+                embedding_cache.put(digest, encoding)
+            if encoding is not None: encodings.append(encoding)
+        except Exception as e: print(f"  ! Error {img_path}: {e}")
+
+    with encoding_lock:
+        recognition.face_index.remove_label(cedula) # Evitar duplicados si ya tenía filas
+        records = [(JOURNAL_OP_REMOVE, cedula, None)] + [(JOURNAL_OP_ADD, cedula, e) for e in encodings]
+        try: embedding_store.append_records(records)
+        except Exception as e: print(f"Error escribiendo el journal para {cedula}: {e}")
+        recognition.face_index.add_many(encodings, [cedula] * len(encodings))
+    print(f"{len(encodings)} embeddings de {cedula} agregados al índice. Total: {len(recognition.face_index)}")
+    return len(encodings)
+
+def enroll_face_burst(cedula, frames):
+    """
+    Enrolamiento por ráfaga: de los `frames` (JPEG de recortes de cara)
+    se quedan los ENROLL_BURST_KEEP mejores por calidad y diversidad.
+      1. Detección + control de calidad (exposición, tamaño, nitidez) por frame.
+      2. Embeddings de las caras buenas en UNA llamada a embed_batch.
+      3. select_templates: fuera muestras lejanas al centroide de la ráfaga,
+         luego farthest-point ponderado por calidad.
+      4. Fotos elegidas a dataset/ (+ caché), UN append al journal y UN commit.
+    El índice mantiene el centroide del usuario con estas plantillas.
+    Retorna (ok, mensaje).
+    """
+    if recognition.face_engine is None: return False, "Motor facial no cargado"
+    start = time.time()
+    candidates = [] # (jpeg, bgr, box, puntaje)
+    for data in frames:
+        bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None: continue
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        if not frame_quality.check_exposure(gray).ok: continue
+        boxes = recognition.face_engine.detect(bgr, gray)
+        if not boxes: continue
+        box = max(boxes, key=lambda b: b.w * b.h)
+        quality = frame_quality.check_face(gray, box, QUALITY_MIN_SHARPNESS, QUALITY_MIN_FACE_SIZE)
+        if quality.ok: candidates.append((data, bgr, box, quality.score))
+
+    encodings = recognition.face_engine.embed_batch([(bgr, box) for _, bgr, box, _ in candidates]) if candidates else []
+    usable = [(candidate, encoding) for candidate, encoding in zip(candidates, encodings) if encoding is not None]
+    if len(usable) < ENROLL_BURST_MIN_SAMPLES:
+        return False, f"{len(usable)} muestras útiles de {len(frames)} (mínimo {ENROLL_BURST_MIN_SAMPLES})"
+    chosen = select_templates([e for _, e in usable], [c[3] for c, _ in usable], ENROLL_BURST_KEEP,
+                              max_distance=MATCH_TOLERANCE, min_distance=0.1 * MATCH_TOLERANCE)
+    selected = [usable[i] for i in chosen]
+
+    user_folder = os.path.join(DATASET_PATH, cedula)
+    os.makedirs(user_folder, exist_ok=True)
+    existing_files = len([name for name in os.listdir(user_folder) if os.path.isfile(os.path.join(user_folder, name))])
+    for i, ((data, _, _, _), encoding) in enumerate(selected):
+        img_path = os.path.join(user_folder, f"enroll_{existing_files + i + 1}.jpg")
+        with open(img_path, 'wb') as f: f.write(data)
+        try: embedding_cache.put(sha256_bytes(data), encoding, img_path)
+        except Exception as e: print(f"Advertencia: no se pudo guardar en la caché de embeddings: {e}")
+
+    new_encodings = [encoding for _, encoding in selected]
+    with encoding_lock:
+        journal_count = embedding_store.append_records([(JOURNAL_OP_ADD, cedula, e) for e in new_encodings])
+        recognition.face_index.add_many(new_encodings, [cedula] * len(new_encodings))
+        if journal_count >= JOURNAL_COMPACT_EVERY and retrain_journal_start is None:
+            try:
+                header = embedding_store.compact(*recognition.face_index.export())
+                print(f"Journal compactado en la generación {header['generation']} ({header['count']} encodings).")
+            except Exception as e: print(f"Error compactando {EMBEDDINGS_DIR}: {e}")
+
+    user = User.query.filter_by(cedula=cedula).first()
+    if user and not user.has_facial: user.has_facial = True; db.session.commit()
+    message = f"{len(selected)} plantillas de {len(usable)} muestras útiles ({len(frames)} frames) en {time.time() - start:.2f}s"
+    print(f"Enrolamiento por ráfaga de {cedula}: {message}. Total índice: {len(recognition.face_index)}")
+    return True, message
+
+
 @app.cli.command('init-db')
 def init_db_command():
     """
@@ -588,10 +782,10 @@ def init_db_command():
         print("---------------------------------------------------------")
 
 # --- LÓGICA DE MQTT ---
-MQTT_BROKER_IP = "127.0.0.1"; MQTT_PORT = 1883; RPI_CLIENT_ID = "rpi_device_01"
-TOPIC_REQ_FACIAL_STREAM = "acceso/request/facial/stream"; TOPIC_REQ_FACIAL_STOP = "acceso/request/facial/stop"
+RPI_CLIENT_ID = "rpi_device_01" # Broker y topics del stream facial: recognition.py
 TOPIC_REQ_FINGER = "acceso/request/fingerprint"; TOPIC_ENROLL_FACIAL = "acceso/enroll/facial/data"
-TOPIC_ENROLL_FINGER = "acceso/enroll/fingerprint/data"; TOPIC_RESPONSE_BASE = "acceso/response"
+TOPIC_ENROLL_FACIAL_BURST = "acceso/enroll/facial/burst" # Un mensaje por frame: {session, cedula, seq, total, image_b64}
+TOPIC_ENROLL_FINGER = "acceso/enroll/fingerprint/data"
 TOPIC_COMMAND_BASE = "acceso/command"
 
 # ==========================================================
@@ -600,45 +794,65 @@ TOPIC_COMMAND_BASE = "acceso/command"
 def on_connect(client, userdata, flags, reason_code, properties): # <-- 5 argumentos
     if reason_code == 0: # <-- Comprobar reason_code
         print(f"Conectado al Broker MQTT en {MQTT_BROKER_IP}!")
-        client.subscribe(f"{TOPIC_REQ_FACIAL_STREAM}/#"); client.subscribe(f"{TOPIC_REQ_FACIAL_STOP}/#")
-        client.subscribe(f"{TOPIC_REQ_FINGER}/#"); client.subscribe(f"{TOPIC_ENROLL_FACIAL}/#")
+        if FACIAL_STREAM_IN_PROCESS: client.subscribe(f"{TOPIC_REQ_FACIAL_STREAM}/#"); client.subscribe(f"{TOPIC_REQ_FACIAL_STOP}/#")
+        else:
+            client.subscribe(TOPIC_LOG_FACIAL, qos=1) # Decisiones de los workers
+            print("Stream facial delegado a recognition_worker.py (FACIAL_STREAM_IN_PROCESS=0).")
+        client.subscribe(f"{TOPIC_REQ_FINGER}/#"); client.subscribe(f"{TOPIC_ENROLL_FACIAL}/#"); client.subscribe(f"{TOPIC_ENROLL_FACIAL_BURST}/#")
         client.subscribe(f"{TOPIC_ENROLL_FINGER}/#"); print(f"Suscrito a topics.")
     else: print(f"Fallo al conectar a MQTT, código {reason_code}")
 
+def handle_enroll_burst(rpi_client_id, burst):
+    """Ráfaga completa (o vencida): se procesa en un hilo aparte y se responde UNA vez al dispositivo."""
+    def task():
+        with app.app_context():
+            try:
+                if not User.query.filter_by(cedula=burst.cedula).first(): ok, message = False, "Usuario no existe"
+                else: ok, message = enroll_face_burst(burst.cedula, [burst.frames[seq] for seq in sorted(burst.frames)])
+            except Exception:
+                print(f"[Error enrolamiento por ráfaga]\n{traceback.format_exc()}"); ok, message = False, "Error del servidor"
+        if not ok: print(f"Enrolamiento por ráfaga de {burst.cedula} rechazado: {message}")
+        mqtt_client.publish(f"{TOPIC_RESPONSE_BASE}/{rpi_client_id}", json.dumps({"status": "enroll_facial_ok" if ok else "enroll_facial_fail"}))
+    threading.Thread(target=task, name=f"enroll-burst-{rpi_client_id}", daemon=True).start()
+
+enroll_bursts = BurstCollector(handle_enroll_burst, timeout=ENROLL_BURST_TIMEOUT, max_frames=ENROLL_BURST_MAX_FRAMES)
+
 def on_message(client, userdata, msg): # <-- Esta firma (3 args) es correcta para V2
-    global client_liveness_info
     with app.app_context():
         try:
             topic_parts = msg.topic.split('/'); rpi_client_id = topic_parts[-1]
             response_topic = f"{TOPIC_RESPONSE_BASE}/{rpi_client_id}"
 
             if msg.topic.startswith(TOPIC_REQ_FACIAL_STREAM):
-                image_bytes = msg.payload
-                status, nombres, cedula = process_facial_liveness_and_recognition(image_bytes, rpi_client_id)
-                response_payload = {"status": status, "nombres": nombres}
-                if status.startswith("verifying"): client.publish(response_topic, json.dumps(response_payload))
-                else:
-                    client.publish(response_topic, json.dumps(response_payload))
-                    if rpi_client_id in client_liveness_info: del client_liveness_info[rpi_client_id]
-                    if status != "denied_error":
-                        log = AccessLog(user_cedula=cedula, user_nombres=nombres, access_type='facial', status=status)
-                        db.session.add(log); db.session.commit()
-                    print(f"Respuesta facial enviada: {response_payload}")
+                # Solo encolar: el procesamiento pesado corre en el pool (handle_facial_frame)
+                FRAMES_RECEIVED.inc(device=rpi_client_id)
+                frame_dispatcher.submit(rpi_client_id, msg.payload)
 
             elif msg.topic.startswith(TOPIC_REQ_FACIAL_STOP):
                 print(f"RPi {rpi_client_id} detuvo stream.");
-                if rpi_client_id in client_liveness_info: del client_liveness_info[rpi_client_id]
+                frame_dispatcher.discard(rpi_client_id)
+                liveness_sessions.pop(rpi_client_id)
+
+            elif msg.topic == TOPIC_LOG_FACIAL:
+                # Decisión de un recognition_worker.py: la BBDD y el feed del dashboard los escribe solo este proceso
+                data = json.loads(msg.payload.decode('utf-8'))
+                if data.get('status'): access_log_writer.log(data.get('cedula'), data.get('nombres'), 'facial', data['status'])
 
             elif msg.topic.startswith(TOPIC_REQ_FINGER):
                 data = json.loads(msg.payload.decode('utf-8')); fingerprint_id = data.get('fingerprint_id')
                 status, nombres, cedula = process_fingerprint_recognition(fingerprint_id)
                 response_payload = {"status": status, "nombres": nombres}
                 client.publish(response_topic, json.dumps(response_payload))
-                if status != "denied_error":
-                    log = AccessLog(user_cedula=cedula, user_nombres=nombres, access_type='huella', status=status)
-                    db.session.add(log); db.session.commit()
+                DECISIONS.inc(method="huella", status=status)
+                if status != "denied_error": access_log_writer.log(cedula, nombres, 'huella', status)
                 print(f"Respuesta huella enviada: {response_payload}")
 
+            elif msg.topic.startswith(TOPIC_ENROLL_FACIAL_BURST):
+                data = json.loads(msg.payload.decode('utf-8'))
+                if not enroll_bursts.add(rpi_client_id, data.get('session'), data.get('cedula'), int(data.get('seq', -1)),
+                                         int(data.get('total', 0)), base64.b64decode(data.get('image_b64', ''))):
+                    print(f"Frame de ráfaga inválido de {rpi_client_id}: seq={data.get('seq')} total={data.get('total')}")
+
             elif msg.topic.startswith(TOPIC_ENROLL_FACIAL):
                 data = json.loads(msg.payload.decode('utf-8')); cedula = data.get('cedula'); image_b64 = data.get('image_b64')
                 user = User.query.filter_by(cedula=cedula).first();
@@ -658,7 +872,7 @@ def on_message(client, userdata, msg): # <-- Esta firma (3 args) es correcta par
                     # --- 2. Actualizar el modelo (NUEVA LÓGICA) ---
                     # Usar un thread para no bloquear el listener MQTT
                     img_bytes_copy = bytes(image_bytes) # Copiar bytes
-                    thread = threading.Thread(target=update_model_with_image, args=(cedula, img_bytes_copy))
+                    thread = threading.Thread(target=update_model_with_image, args=(cedula, img_bytes_copy, img_path))
                     thread.start()
                     
                     # --- 3. Actualizar BBDD y responder (como antes) ---
@@ -683,7 +897,9 @@ def on_message(client, userdata, msg): # <-- Esta firma (3 args) es correcta par
                     existing_user_with_id = User.query.filter_by(fingerprint_id=fingerprint_id).first()
                     if existing_user_with_id and existing_user_with_id.id != user.id:
                          raise Exception(f"ID huella {fingerprint_id} ya en uso por {existing_user_with_id.cedula}")
+                    previous_fingerprint_id = user.fingerprint_id
                     user.fingerprint_id = fingerprint_id; user.has_fingerprint = True; db.session.commit()
+                    invalidate_auth(cedulas=[cedula], fingerprint_ids=[fingerprint_id, previous_fingerprint_id])
                     print(f"ID huella {fingerprint_id} para {cedula} guardado."); client.publish(response_topic, json.dumps({"status": "enroll_finger_ok"}))
                 except Exception as e:
                     print(f"Error BBDD guardando ID huella: {e}"); db.session.rollback()
@@ -700,6 +916,8 @@ def start_mqtt_listener():
     # Corregido para V2
     mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="servidor_flask_app") 
     mqtt_client.on_connect = on_connect; mqtt_client.on_message = on_message
+    if FACIAL_STREAM_IN_PROCESS:
+        recognition.start_pipeline(mqtt_client, auth_cache, lambda cedula, nombres, status: access_log_writer.log(cedula, nombres, 'facial', status))
     try:
         mqtt_client.connect(MQTT_BROKER_IP, MQTT_PORT, 60); mqtt_client.loop_start()
     except Exception as e: print(f"No se pudo conectar al broker MQTT: {e}")
@@ -708,5 +926,7 @@ if __name__ == '__main__':
     if not os.path.exists(DLIB_PREDICTOR_PATH) or BlinkDetector is None:
         print(f"ERROR: No se encuentra '{DLIB_PREDICTOR_PATH}' o 'anti_spoofing.py'")
     else:
+        ensure_access_log_indexes()
+        warm_auth_cache()
         start_mqtt_listener()
         app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
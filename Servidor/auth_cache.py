@@ -0,0 +1,87 @@
+import time
+import threading
+from collections import namedtuple
+
+AuthEntry = namedtuple("AuthEntry", ["cedula", "nombres", "access_type"])
+
+
+class AuthCache:
+    """
+    Caché en memoria (read-through) de los datos que decide el acceso:
+    cédula -> AuthEntry(cedula, nombres, access_type) y fingerprint_id -> cédula.
+
+    Se precarga con `warm(...)` al arrancar; un fallo de caché consulta la BBDD
+    con `load_cedula(cedula)` / `load_fingerprint(fingerprint_id)` (que retornan
+    AuthEntry o None) y guarda también los "no existe", así un desconocido
+    insistente no genera una consulta por intento.
+
+    Las rutas que modifican usuarios llaman a `invalidate(...)`. Cada
+    invalidación incrementa una versión: una carga que empezó antes de la
+    invalidación no guarda su resultado (podría ser el dato viejo).
+
+    `ttl` (segundos, None = sin vencimiento) acota cuánto puede quedar viejo el
+    dato si se pierde una invalidación (recognition_worker.py las recibe por MQTT).
+    """
+
+    def __init__(self, load_cedula, load_fingerprint, ttl=None):
+        self.load_cedula = load_cedula
+        self.load_fingerprint = load_fingerprint
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_cedula = {} # cedula -> (AuthEntry | None, cargado_en)
+        self._by_fingerprint = {} # fingerprint_id -> (cedula | None, cargado_en)
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock: return len(self._by_cedula)
+
+    def warm(self, users):
+        """`users`: iterable de (cedula, nombres, access_type, fingerprint_id). Reemplaza todo el contenido."""
+        now = time.monotonic()
+        by_cedula, by_fingerprint = {}, {}
+        for cedula, nombres, access_type, fingerprint_id in users:
+            by_cedula[cedula] = (AuthEntry(cedula, nombres, access_type), now)
+            if fingerprint_id is not None: by_fingerprint[fingerprint_id] = (cedula, now)
+        with self._lock:
+            self._by_cedula, self._by_fingerprint = by_cedula, by_fingerprint
+            self._version += 1
+        return len(by_cedula)
+
+    def _fresh(self, cached):
+        return cached is not None and (self.ttl is None or time.monotonic() - cached[1] < self.ttl)
+
+    def user(self, cedula):
+        """AuthEntry de la cédula, o None si no existe."""
+        with self._lock:
+            cached = self._by_cedula.get(cedula); version = self._version
+        if self._fresh(cached):
+            self.hits += 1; return cached[0]
+        self.misses += 1
+        entry = self.load_cedula(cedula)
+        with self._lock:
+            if self._version == version: self._by_cedula[cedula] = (entry, time.monotonic())
+        return entry
+
+    def by_fingerprint(self, fingerprint_id):
+        """AuthEntry del dueño de la huella, o None si ningún usuario la tiene."""
+        with self._lock:
+            cached = self._by_fingerprint.get(fingerprint_id); version = self._version
+        if self._fresh(cached):
+            return self.user(cached[0]) if cached[0] is not None else None
+        self.misses += 1
+        entry = self.load_fingerprint(fingerprint_id)
+        with self._lock:
+            if self._version == version:
+                now = time.monotonic()
+                self._by_fingerprint[fingerprint_id] = (entry.cedula if entry else None, now)
+                if entry: self._by_cedula[entry.cedula] = (entry, now)
+        return entry
+
+    def invalidate(self, cedulas=(), fingerprint_ids=()):
+        """Olvida esas cédulas / huellas (se releen de la BBDD en la próxima consulta)."""
+        with self._lock:
+            for cedula in cedulas: self._by_cedula.pop(cedula, None)
+            for fingerprint_id in fingerprint_ids: self._by_fingerprint.pop(fingerprint_id, None)
+            self._version += 1
@@ -0,0 +1,73 @@
+"""
+Benchmark de recall vs latencia: índice aproximado IVF/PQ contra el escaneo exacto.
+
+Genera una galería sintética (usuarios x fotos, con ruido alrededor de un
+centroide por usuario, parecida a embeddings dlib de 128-d) y mide, para
+varios valores de nprobe, el recall@1 respecto a la búsqueda exacta y la
+latencia media por consulta.
+
+Uso:
+    python benchmarks/bench_ann.py --users 20000 --photos 3 --queries 500
+    python benchmarks/bench_ann.py --pq 16   # con residuos comprimidos por PQ
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from embedding_index import EmbeddingIndex
+
+
+def synthetic_gallery(users, photos, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=0.08, size=(users, dim)).astype(np.float32)
+    vectors = np.repeat(centers, photos, axis=0) + rng.normal(scale=0.03, size=(users * photos, dim)).astype(np.float32)
+    names = [str(i // photos) for i in range(users * photos)]
+    return centers, vectors, names
+
+
+def time_queries(fn, probes):
+    results = []
+    start = time.perf_counter()
+    for p in probes: results.append(fn(p))
+    return results, (time.perf_counter() - start) / len(probes) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--photos', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--nlist', type=int, default=None, help='Listas IVF (por defecto ~4*sqrt(N))')
+    parser.add_argument('--pq', type=int, default=0, help='Subvectores PQ (0 = IVF-flat)')
+    parser.add_argument('--rerank', type=int, default=64, help='Candidatos re-ordenados en exacto (solo PQ)')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    centers, vectors, names = synthetic_gallery(args.users, args.photos)
+    index = EmbeddingIndex.from_data(vectors, names)
+    print(f"Galería: {len(index)} embeddings ({args.users} usuarios x {args.photos} fotos)")
+
+    rng = np.random.default_rng(1)
+    users = rng.integers(args.users, size=args.queries)
+    probes = centers[users] + rng.normal(scale=0.03, size=(args.queries, 128)).astype(np.float32)
+
+    exact, exact_ms = time_queries(lambda p: index.search(p, k=1), probes)
+    exact_ids = [r[2][0][0] for r in exact]
+    print(f"Exacto: {exact_ms:.3f} ms/consulta")
+
+    start = time.perf_counter()
+    index.build_ann(nlist=args.nlist, pq_subvectors=args.pq)
+    print(f"Construcción IVF: {time.perf_counter() - start:.2f} s")
+
+    print(f"{'nprobe':>7} {'recall@1':>9} {'ms/consulta':>12} {'speedup':>8}")
+    for nprobe in args.nprobe:
+        approx, ms = time_queries(lambda p: index.search_ann(p, k=1, nprobe=nprobe, rerank=args.rerank), probes)
+        hits = sum(1 for r, e in zip(approx, exact_ids) if r[2] and r[2][0][0] == e)
+        print(f"{nprobe:>7} {hits / len(probes):>9.3f} {ms:>12.3f} {exact_ms / ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Micro-benchmark por etapas del pipeline facial (sin MQTT ni Flask).
+
+Mide por separado cada etapa de process_facial_liveness_and_recognition:
+  decode      cv2.imdecode del JPEG
+  color       BGR -> gris
+  detect      detección en el frame completo (motor FACE_ENGINE)
+  detect_roi  detección en la región de la cara anterior (FaceTracker)
+  landmarks   68 puntos de dlib
+  liveness    BlinkDetector.check_liveness
+  quality     frame_quality (exposición + nitidez de la cara)
+  embed       embedding de una cara / embed_batch de 8 caras
+  match_*     identificación contra galerías sintéticas (exacta, centroides,
+              IVF y lote de 8 sondas con GEMM) de 1k/10k/100k embeddings
+
+Las imágenes de prueba salen de --images (carpeta con fotos de caras; por
+defecto el dataset/ del servidor). Las etapas de galería solo necesitan NumPy.
+
+El resultado (JSON) incluye el commit y el entorno, para comparar entre commits:
+    python benchmarks/bench_pipeline.py --out base.json
+    git checkout otra-rama && python benchmarks/bench_pipeline.py --out nuevo.json
+    python benchmarks/bench_pipeline.py --compare base.json nuevo.json --threshold 10
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import subprocess
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BASE_DIR)
+from embedding_index import EmbeddingIndex
+from bench_ann import synthetic_gallery
+
+
+def measure(fn, repeat, warmup=3):
+    """Ejecuta fn `warmup` + `repeat` veces y retorna estadísticas en ms."""
+    for _ in range(warmup): fn()
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter(); fn(); times[i] = (time.perf_counter() - start) * 1000.0
+    return {"n": repeat, "mean_ms": round(float(times.mean()), 4), "p50_ms": round(float(np.percentile(times, 50)), 4),
+            "p95_ms": round(float(np.percentile(times, 95)), 4)}
+
+
+def cycle(items):
+    """Función que devuelve el siguiente elemento de `items` en cada llamada."""
+    state = {"i": 0}
+    def next_item():
+        item = items[state["i"] % len(items)]; state["i"] += 1
+        return item
+    return next_item
+
+
+def bench_image_stages(images_dir, engine_name, repeat, max_images):
+    import cv2
+    from face_engine import create_engine
+    from face_tracker import FaceTracker
+    from anti_spoofing import BlinkDetector
+    import frame_quality
+
+    paths = []
+    for root, _, files in os.walk(images_dir):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    paths = sorted(paths)[:max_images]
+    if not paths: raise SystemExit(f"No hay imágenes en '{images_dir}' (use --images o --stages match)")
+
+    engine = create_engine(engine_name, BASE_DIR)
+    # Mismo formato que envía el RPi: 320x240, JPEG calidad 60
+    jpegs = [cv2.imencode('.jpg', cv2.resize(cv2.imread(p), (320, 240)), [cv2.IMWRITE_JPEG_QUALITY, 60])[1].tobytes() for p in paths]
+    frames = [cv2.imdecode(np.frombuffer(j, np.uint8), cv2.IMREAD_COLOR) for j in jpegs]
+    grays = [cv2.cvtColor(f, cv2.COLOR_BGR2GRAY) for f in frames]
+    faces = []
+    for frame, gray in zip(frames, grays):
+        boxes = engine.detect(frame, gray)
+        if boxes: faces.append((frame, gray, boxes[0]))
+    print(f"Imágenes: {len(paths)} ({len(faces)} con cara), motor '{engine_name}'")
+
+    stages = {}
+    next_jpeg, next_frame = cycle(jpegs), cycle(frames)
+    stages["decode"] = measure(lambda: cv2.imdecode(np.frombuffer(next_jpeg(), np.uint8), cv2.IMREAD_COLOR), repeat)
+    stages["color"] = measure(lambda: cv2.cvtColor(next_frame(), cv2.COLOR_BGR2GRAY), repeat)
+    pairs = cycle(list(zip(frames, grays)))
+    stages["detect"] = measure(lambda: engine.detect(*pairs()), repeat)
+    if not faces: return stages
+
+    next_face = cycle(faces)
+    def detect_roi():
+        frame, gray, box = next_face()
+        tracker = FaceTracker(engine); tracker.box = box
+        tracker.locate(frame, gray)
+    stages["detect_roi"] = measure(detect_roi, repeat)
+    shapes = [(gray, engine.landmarks(gray, box)) for _, gray, box in faces]
+    stages["landmarks"] = measure(lambda: engine.landmarks(*next_face()[1:]), repeat)
+    detector, next_shape = BlinkDetector(), cycle(shapes)
+    stages["liveness"] = measure(lambda: detector.check_liveness(*next_shape()), repeat)
+    def quality():
+        _, gray, box = next_face()
+        frame_quality.check_exposure(gray); frame_quality.check_face(gray, box)
+    stages["quality"] = measure(quality, repeat)
+    stages["embed"] = measure(lambda: engine.embed(*next_face()[::2]), repeat)
+    batch = [(frame, box) for frame, _, box in (faces * 8)[:8]]
+    stages["embed_batch8"] = measure(lambda: engine.embed_batch(batch), max(3, repeat // 8))
+    return stages
+
+
+def bench_match_stages(sizes, photos, repeat, tolerance=0.6):
+    stages = {}
+    rng = np.random.default_rng(1)
+    for size in sizes:
+        users = max(1, size // photos)
+        centers, vectors, names = synthetic_gallery(users, photos)
+        index = EmbeddingIndex.from_data(vectors, names)
+        probes = centers[rng.integers(users, size=256)] + rng.normal(scale=0.03, size=(256, 128)).astype(np.float32)
+        next_probe = cycle(list(probes))
+        label = f"{size // 1000}k" if size >= 1000 else str(size)
+        stages[f"match_exact_{label}"] = measure(lambda: index.search(next_probe(), k=5, tolerance=tolerance), repeat)
+        stages[f"match_centroid_{label}"] = measure(lambda: index.search_two_stage(next_probe(), k=5, tolerance=tolerance), repeat)
+        batches = cycle([probes[i:i + 8] for i in range(0, len(probes), 8)])
+        stages[f"match_exact_batch8_{label}"] = measure(lambda: index.search_many(batches(), k=5, tolerance=tolerance), max(3, repeat // 8))
+        index.build_ann()
+        stages[f"match_ivf_{label}"] = measure(lambda: index.search_ann(next_probe(), k=5, tolerance=tolerance), repeat)
+        print(f"Galería {len(index)} embeddings: listo")
+    return stages
+
+
+def environment():
+    try: commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError): commit = None
+    return {"commit": commit, "date": datetime.datetime.utcnow().isoformat() + "Z", "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(base_path, new_path, threshold):
+    """Tabla de p50 base vs nuevo; retorna True si alguna etapa empeoró más de `threshold` %."""
+    with open(base_path) as f: base = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    print(f"base: {base['env'].get('commit')}  nuevo: {new['env'].get('commit')}")
+    print(f"{'etapa':<28} {'base p50':>10} {'nuevo p50':>10} {'cambio':>8}")
+    regressed = False
+    for stage in sorted(set(base["stages"]) | set(new["stages"])):
+        a, b = base["stages"].get(stage), new["stages"].get(stage)
+        if a is None or b is None:
+            print(f"{stage:<28} {'-' if a is None else a['p50_ms']:>10} {'-' if b is None else b['p50_ms']:>10}"); continue
+        change = (b["p50_ms"] - a["p50_ms"]) / max(a["p50_ms"], 1e-9) * 100.0
+        flag = " <-- regresión" if change > threshold else ""
+        regressed |= change > threshold
+        print(f"{stage:<28} {a['p50_ms']:>10.3f} {b['p50_ms']:>10.3f} {change:>+7.1f}%{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', choices=['all', 'image', 'match'], default='all')
+    parser.add_argument('--images', default=os.path.join(BASE_DIR, 'dataset'), help='Carpeta con fotos de caras')
+    parser.add_argument('--max-images', type=int, default=50)
+    parser.add_argument('--engine', default=os.environ.get("FACE_ENGINE", "dlib"))
+    parser.add_argument('--gallery', type=int, nargs='+', default=[1000, 10000, 100000], help='Tamaños de galería')
+    parser.add_argument('--photos', type=int, default=3, help='Fotos por usuario en la galería sintética')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--out', help='Guardar resultados (JSON)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NUEVO'), help='Comparar dos resultados y salir')
+    parser.add_argument('--threshold', type=float, default=10.0, help='%% de empeoramiento del p50 que cuenta como regresión')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    stages = {}
+    if args.stages in ('all', 'image'): stages.update(bench_image_stages(args.images, args.engine, args.repeat, args.max_images))
+    if args.stages in ('all', 'match'): stages.update(bench_match_stages(args.gallery, args.photos, args.repeat))
+
+    print(f"{'etapa':<28} {'media ms':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for stage, s in stages.items(): print(f"{stage:<28} {s['mean_ms']:>10.3f} {s['p50_ms']:>10.3f} {s['p95_ms']:>10.3f}")
+    result = {"env": {**environment(), "engine": args.engine if args.stages != 'match' else None}, "stages": stages}
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f: json.dump(result, f, indent=2)
+        print(f"Resultados guardados en '{args.out}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+Generador de carga: simula N dispositivos client_rpi.py contra el broker.
+
+Cada dispositivo virtual publica frames JPEG en
+acceso/request/facial/stream/<id> a `--fps` y espera la decisión final en
+acceso/response/<id>, igual que el RPi: al recibir un status que no empieza
+con "verifying" registra el tiempo hasta la decisión, pausa `--pause`
+segundos (pantalla de resultado) y empieza un intento nuevo.
+
+Fuentes de frames:
+  --frames DIR   secuencia grabada (JPEG ordenados por nombre; se repite en bucle).
+                 Se puede grabar con --record DIR desde una webcam.
+  --image FOTO   secuencia sintética a partir de una foto: frames con leve
+                 movimiento y, si dlib está disponible, parpadeos simulados
+                 (se pintan los ojos cerrados sobre los 68 landmarks).
+  (nada)         ruido: mide el costo por frame sin cara (verifying_no_face).
+
+Reporta p50/p95/p99 del tiempo hasta la decisión, frames sin respuesta
+(descartados por el servidor), throughput y CPU de los procesos del
+servidor (--server-pid, leído de /proc).
+
+Uso:
+    python benchmarks/load_generator.py --devices 20 --fps 10 --duration 60 --image dataset/0102030405/enroll_1.jpg --server-pid 1234
+    python benchmarks/load_generator.py --record grabacion/ --seconds 5
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import cv2
+import paho.mqtt.client as mqtt
+
+FRAME_SIZE = (320, 240) # Lo que envía client_rpi.py
+JPEG_QUALITY = 60
+TOPIC_STREAM = "acceso/request/facial/stream"
+TOPIC_STOP = "acceso/request/facial/stop"
+TOPIC_RESPONSE = "acceso/response"
+
+
+# --- Fuentes de frames ---
+def encode_jpeg(frame):
+    frame = cv2.resize(frame, FRAME_SIZE, interpolation=cv2.INTER_LINEAR)
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+
+
+def load_recorded_frames(directory):
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    frames = [encode_jpeg(cv2.imread(os.path.join(directory, n))) for n in names]
+    if not frames: raise SystemExit(f"No hay imágenes en '{directory}'")
+    return frames
+
+
+def _close_eyes(image, landmarks):
+    """Pinta los ojos cerrados: rellena cada ojo con el color de la piel bajo él y dibuja el párpado."""
+    closed = image.copy()
+    for start, end in ((36, 42), (42, 48)):
+        eye = np.array([(landmarks.part(i).x, landmarks.part(i).y) for i in range(start, end)], dtype=np.int32)
+        x, y, w, h = cv2.boundingRect(eye)
+        skin = image[min(image.shape[0] - 1, y + h + max(2, h)), x + w // 2].tolist()
+        cv2.fillPoly(closed, [cv2.convexHull(eye)], skin)
+        cv2.ellipse(closed, (x + w // 2, y + h // 2), (w // 2 + 2, max(1, h // 3)), 0, 0, 360, skin, -1)
+        cv2.line(closed, tuple(eye[0]), tuple(eye[3]), (40, 40, 40), 1)
+    return closed
+
+
+def synthetic_frames(image_path, predictor_path, open_frames=8, closed_frames=3, blinks=3, seed=0):
+    """Secuencia con jitter de posición/brillo y `blinks` parpadeos de `closed_frames` frames."""
+    image = cv2.imread(image_path)
+    if image is None: raise SystemExit(f"No se pudo leer '{image_path}'")
+    closed = None
+    try:
+        import dlib
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        rects = dlib.get_frontal_face_detector()(gray, 1)
+        if rects: closed = _close_eyes(image, dlib.shape_predictor(predictor_path)(gray, rects[0]))
+        else: print("Aviso: no se detectó cara en la foto; secuencia sin parpadeos.")
+    except (ImportError, RuntimeError) as e:
+        print(f"Aviso: dlib/predictor no disponible ({e}); secuencia sin parpadeos.")
+
+    rng = np.random.default_rng(seed)
+    h, w = image.shape[:2]
+    pattern = ([False] * open_frames + [True] * closed_frames) * blinks + [False] * open_frames
+    frames = []
+    for is_closed in pattern:
+        base = closed if (is_closed and closed is not None) else image
+        dx, dy = rng.integers(-3, 4, size=2)
+        shifted = cv2.warpAffine(base, np.float32([[1, 0, dx], [0, 1, dy]]), (w, h), borderMode=cv2.BORDER_REPLICATE)
+        frames.append(encode_jpeg(cv2.convertScaleAbs(shifted, alpha=1.0, beta=float(rng.normal(0, 4)))))
+    return frames
+
+
+def noise_frames(count=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return [encode_jpeg(rng.integers(60, 200, size=(FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)) for _ in range(count)]
+
+
+def record_frames(directory, seconds, camera=0, fps=10):
+    os.makedirs(directory, exist_ok=True)
+    cap = cv2.VideoCapture(camera)
+    print(f"Grabando {seconds}s a {fps} fps en '{directory}' (parpadee un par de veces)...")
+    end, i = time.time() + seconds, 0
+    while time.time() < end:
+        ok, frame = cap.read()
+        if ok:
+            cv2.imwrite(os.path.join(directory, f"frame_{i:05d}.jpg"), cv2.resize(frame, FRAME_SIZE)); i += 1
+        time.sleep(1.0 / fps)
+    cap.release()
+    print(f"{i} frames guardados.")
+
+
+# --- CPU del servidor (/proc) ---
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f: fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK') # utime + stime
+
+
+# --- Dispositivos virtuales ---
+class VirtualDevice:
+    def __init__(self, device_id, frames, offset):
+        self.device_id = device_id
+        self.frames = frames
+        self.position = offset % len(frames) # Cada dispositivo arranca en un punto distinto de la secuencia
+        self.attempt_start = None
+        self.resume_at = 0.0
+        self.sent = 0
+        self.responses = 0
+
+    def next_frame(self):
+        frame = self.frames[self.position]
+        self.position = (self.position + 1) % len(self.frames)
+        return frame
+
+
+class LoadGenerator:
+    def __init__(self, args, frames):
+        self.args = args
+        self.devices = {f"{args.prefix}{i:03d}": VirtualDevice(f"{args.prefix}{i:03d}", frames, i * 7) for i in range(args.devices)}
+        self.decisions = [] # (status, segundos hasta la decisión)
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"load_generator_{os.getpid()}")
+        self.client.on_message = self.on_message
+
+    def on_message(self, client, userdata, msg):
+        device = self.devices.get(msg.topic.rsplit('/', 1)[-1])
+        if device is None: return
+        status = json.loads(msg.payload.decode('utf-8')).get("status", "")
+        now = time.perf_counter()
+        with self._lock:
+            device.responses += 1
+            if status.startswith("verifying") or device.attempt_start is None: return
+            self.decisions.append((status, now - device.attempt_start))
+            device.attempt_start = None
+            device.resume_at = now + self.args.pause
+
+    def run(self):
+        args = self.args
+        self.client.connect(args.broker, args.port, 60)
+        self.client.subscribe(f"{TOPIC_RESPONSE}/+")
+        self.client.loop_start()
+        cpu_start = {pid: process_cpu_seconds(pid) for pid in args.server_pid}
+        interval = 1.0 / args.fps
+        start = time.perf_counter()
+        next_send = {device_id: start + i * interval / len(self.devices) for i, device_id in enumerate(self.devices)}
+        while time.perf_counter() - start < args.duration:
+            now = time.perf_counter()
+            for device_id, device in self.devices.items():
+                if now < next_send[device_id]: continue
+                next_send[device_id] += interval
+                with self._lock:
+                    if now < device.resume_at: continue
+                    if device.attempt_start is None: device.attempt_start = now
+                    elif now - device.attempt_start > args.attempt_timeout:
+                        self.timeouts += 1; device.attempt_start = None; device.resume_at = now + args.pause
+                        self.client.publish(f"{TOPIC_STOP}/{device_id}", "{}"); continue
+                    device.sent += 1
+                self.client.publish(f"{TOPIC_STREAM}/{device_id}", device.next_frame(), qos=0)
+            time.sleep(max(0.0, min(next_send.values()) - time.perf_counter()))
+        for device_id in self.devices: self.client.publish(f"{TOPIC_STOP}/{device_id}", "{}")
+        time.sleep(args.drain) # Respuestas en vuelo
+        elapsed = time.perf_counter() - start
+        cpu = {pid: process_cpu_seconds(pid) - cpu_start[pid] for pid in args.server_pid}
+        self.client.loop_stop(); self.client.disconnect()
+        return self.report(elapsed, cpu)
+
+    def report(self, elapsed, cpu):
+        latencies = np.array([t for _, t in self.decisions]) * 1000.0
+        sent = sum(d.sent for d in self.devices.values())
+        responses = sum(d.responses for d in self.devices.values())
+        statuses = {}
+        for status, _ in self.decisions: statuses[status] = statuses.get(status, 0) + 1
+        result = {
+            "devices": self.args.devices, "fps": self.args.fps, "seconds": round(elapsed, 2),
+            "frames_sent": sent, "responses": responses, "frames_dropped": max(0, sent - responses),
+            "decisions": len(self.decisions), "attempts_without_decision": self.timeouts, "statuses": statuses,
+            "decision_ms": {f"p{q}": round(float(np.percentile(latencies, q)), 1) for q in (50, 95, 99)} if len(latencies) else {},
+            "throughput": {"frames_per_s": round(responses / elapsed, 1), "decisions_per_s": round(len(self.decisions) / elapsed, 2)},
+            "server_cpu_percent": {str(pid): round(100.0 * s / elapsed, 1) for pid, s in cpu.items()},
+        }
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--fps', type=float, default=10.0, help='Frames por segundo por dispositivo (client_rpi.py usa 10)')
+    parser.add_argument('--duration', type=float, default=60.0, help='Segundos de carga')
+    parser.add_argument('--frames', help='Carpeta con una secuencia grabada')
+    parser.add_argument('--image', help='Foto para generar una secuencia sintética con parpadeos')
+    parser.add_argument('--predictor', default=os.path.join(os.path.dirname(__file__), '..', 'shape_predictor_68_face_landmarks.dat'))
+    parser.add_argument('--broker', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--prefix', default="loadgen_", help='Prefijo de los rpi_client_id simulados')
+    parser.add_argument('--pause', type=float, default=2.0, help='Pausa tras cada decisión (pantalla de resultado)')
+    parser.add_argument('--attempt-timeout', type=float, default=20.0, help='Intento abandonado sin decisión tras estos segundos')
+    parser.add_argument('--drain', type=float, default=2.0, help='Espera final de respuestas en vuelo')
+    parser.add_argument('--server-pid', type=int, nargs='*', default=[], help='PIDs del servidor/workers para medir CPU')
+    parser.add_argument('--json', help='Guardar el reporte en este archivo')
+    parser.add_argument('--record', help='Grabar una secuencia desde la webcam en esta carpeta y salir')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Duración de la grabación (--record)')
+    args = parser.parse_args()
+
+    if args.record:
+        record_frames(args.record, args.seconds); return
+    if args.frames: frames = load_recorded_frames(args.frames)
+    elif args.image: frames = synthetic_frames(args.image, args.predictor)
+    else: frames = noise_frames()
+    print(f"{args.devices} dispositivos x {args.fps} fps durante {args.duration}s ({len(frames)} frames por secuencia)...")
+
+    result = LoadGenerator(args, frames).run()
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import time
+import threading
+import numpy as np
+
+
+class BurstSession:
+    """Ráfaga de enrolamiento de UN dispositivo: frames JPEG por número de secuencia."""
+
+    def __init__(self, session_id, cedula, total):
+        self.session_id = session_id
+        self.cedula = cedula
+        self.total = total
+        self.frames = {} # seq -> bytes JPEG
+        self.started = time.time()
+        self.timer = None
+
+    def complete(self):
+        return len(self.frames) >= self.total
+
+
+class BurstCollector:
+    """
+    Reúne las ráfagas de enrolamiento facial que llegan por MQTT, un mensaje
+    por frame (session, seq, total).
+
+    Cuando llegan los `total` frames de una sesión se llama UNA vez a
+    `on_complete(device_id, session)`. Si la ráfaga no se completa en
+    `timeout` segundos (un mensaje perdido, el RPi se desconectó), se entrega
+    igual con lo recibido: quien procesa decide si alcanza. Una sesión nueva
+    del mismo dispositivo reemplaza a la anterior.
+    """
+
+    def __init__(self, on_complete, timeout=15.0, max_frames=30):
+        self.on_complete = on_complete
+        self.timeout = timeout
+        self.max_frames = max_frames
+        self._sessions = {} # device_id -> BurstSession
+        self._lock = threading.Lock()
+
+    def add(self, device_id, session_id, cedula, seq, total, data):
+        """Agrega un frame; retorna False si el mensaje no es válido."""
+        if not (0 < total <= self.max_frames and 0 <= seq < total) or not cedula: return False
+        done = None
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is None or session.session_id != session_id:
+                if session is not None: session.timer.cancel() # Ráfaga abandonada: la reemplaza la nueva
+                session = BurstSession(session_id, cedula, total)
+                session.timer = threading.Timer(self.timeout, self._expire, args=(device_id, session_id))
+                session.timer.daemon = True; session.timer.start()
+                self._sessions[device_id] = session
+            session.frames[seq] = data
+            if session.complete():
+                session.timer.cancel(); done = self._sessions.pop(device_id)
+        if done is not None: self.on_complete(device_id, done)
+        return True
+
+    def _expire(self, device_id, session_id):
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is None or session.session_id != session_id: return
+            del self._sessions[device_id]
+        print(f"[Enrolamiento] Ráfaga {session_id} de {device_id} incompleta ({len(session.frames)}/{session.total}); se procesa lo recibido.")
+        self.on_complete(device_id, session)
+
+    def __len__(self):
+        with self._lock: return len(self._sessions)
+
+
+def select_templates(encodings, scores, k, max_distance=None, min_distance=0.0):
+    """
+    Elige hasta `k` muestras de una ráfaga por calidad y diversidad; retorna sus índices.
+
+    1. Descarta las muestras a más de `max_distance` del centroide de la
+       ráfaga (otra persona que entró al cuadro, detección fallida).
+    2. Empieza por la de mejor puntaje de calidad.
+    3. Agrega por "farthest point" voraz: la muestra más lejana a las ya
+       elegidas, ponderada por su calidad relativa. Se detiene antes si la
+       mejor candidata está a menos de `min_distance` (casi duplicada).
+    """
+    vectors = np.asarray(encodings, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(vectors) == 0 or k <= 0: return []
+    candidates = np.arange(len(vectors))
+    if max_distance is not None and len(vectors) > 2:
+        distance = np.linalg.norm(vectors - vectors.mean(axis=0), axis=1)
+        inliers = candidates[distance <= max_distance]
+        if len(inliers): candidates = inliers
+    vectors, scores = vectors[candidates], scores[candidates]
+    quality = scores / max(scores.max(), 1e-12)
+
+    chosen = [int(np.argmax(scores))]
+    min_dist = np.linalg.norm(vectors - vectors[chosen[0]], axis=1)
+    while len(chosen) < min(k, len(vectors)):
+        gain = min_dist * (0.5 + 0.5 * quality)
+        gain[chosen] = -1.0
+        best = int(np.argmax(gain))
+        if min_dist[best] < min_distance: break
+        chosen.append(best)
+        min_dist = np.minimum(min_dist, np.linalg.norm(vectors - vectors[best], axis=1))
+    return [int(candidates[i]) for i in chosen]
@@ -0,0 +1,83 @@
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+
+
+class EmbedBatcher:
+    """
+    Micro-batching del embedder entre dispositivos.
+
+    Las sesiones que necesitan un embedding (final del reto o cálculo
+    especulativo) encolan (frame, caja, índice) y esperan su Future. Cada hilo
+    del batcher toma el primer pedido, junta los que lleguen en los siguientes
+    `window` segundos (hasta `max_batch`) y hace:
+      1. UN forward por lotes del modelo: `embed_batch([(bgr, box), ...])`.
+      2. UNA búsqueda matriz-matriz por índice: `identify_many(index, encodings)`.
+    Cada Future recibe (encoding, index, (cedula, distancia, top_k)), o None si
+    no se pudo calcular el embedding.
+    """
+
+    def __init__(self, embed_batch, identify_many, window=0.008, max_batch=8, workers=1):
+        self.embed_batch = embed_batch
+        self.identify_many = identify_many
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.workers = max(1, workers)
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    @property
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    def _ensure_started(self):
+        if self._threads: return
+        with self._start_lock:
+            if self._threads: return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"embed-batcher-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, bgr, box, index):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((bgr, box, index, future))
+        return future
+
+    def match(self, bgr, box, index, timeout=None):
+        """Embedding + identificación de UNA cara, agrupada con las de otros dispositivos."""
+        return self.submit(bgr, box, index).result(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try: batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty: break
+            self._process(batch)
+
+    def _process(self, batch):
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch: return
+        self.batches += 1; self.items += len(batch)
+        try:
+            encodings = self.embed_batch([(bgr, box) for bgr, box, _, _ in batch])
+            results = [None] * len(batch)
+            groups = {} # Un re-entrenamiento puede dejar pedidos contra índices distintos en el mismo lote
+            for i, (_, _, index, _) in enumerate(batch):
+                if encodings[i] is not None: groups.setdefault(id(index), (index, []))[1].append(i)
+            for index, positions in groups.values():
+                matches = self.identify_many(index, np.stack([encodings[i] for i in positions]))
+                for i, match in zip(positions, matches): results[i] = (encodings[i], index, match)
+            for item, result in zip(batch, results): item[3].set_result(result)
+        except Exception as e:
+            for item in batch: item[3].set_exception(e)
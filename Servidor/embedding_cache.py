@@ -0,0 +1,88 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Caché persistente (SQLite) de embeddings por contenido de imagen.
+
+    Clave: (sha256 del archivo, versión del modelo de embeddings). Guarda el
+    vector calculado o el veredicto "sin cara", así un re-entrenamiento solo
+    llama a dlib/face_recognition para imágenes nuevas o modificadas.
+
+    Para no re-leer cada archivo, la tabla `files` recuerda el hash de cada
+    ruta junto con su tamaño y mtime; si no cambiaron se reutiliza el hash.
+    """
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL)""")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                sha256 TEXT NOT NULL, model TEXT NOT NULL, has_face INTEGER NOT NULL, vector BLOB,
+                PRIMARY KEY (sha256, model))""")
+
+    def file_hash(self, img_path):
+        """sha256 del archivo; reutiliza el guardado si tamaño y mtime no cambiaron."""
+        st = os.stat(img_path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (img_path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns: return row[2]
+        with open(img_path, 'rb') as f: digest = sha256_bytes(f.read())
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                               (img_path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def get(self, digest):
+        """
+        Retorna (encontrado, encoding | None). encontrado=True con encoding None
+        significa que la imagen ya se procesó y no tiene cara.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT has_face, vector FROM embeddings WHERE sha256 = ? AND model = ?",
+                                     (digest, self.model)).fetchone()
+        if row is None: return False, None
+        if not row[0]: return True, None
+        return True, np.frombuffer(row[1], dtype=np.float32).copy()
+
+    def put(self, digest, encoding, img_path=None):
+        """
+        Guarda el embedding (o None = "sin cara") para este hash y modelo.
+        `img_path`: archivo del dataset ya escrito con esos bytes (enrolamiento);
+        se registra en `files` para que `evict_missing` no pode la entrada.
+        """
+        blob = np.asarray(encoding, dtype=np.float32).tobytes() if encoding is not None else None
+        st = os.stat(img_path) if img_path is not None else None
+        with self._lock, self._conn:
+            if st is not None:
+                self._conn.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                                   (img_path, st.st_size, st.st_mtime_ns, digest))
+            self._conn.execute("INSERT OR REPLACE INTO embeddings (sha256, model, has_face, vector) VALUES (?, ?, ?, ?)",
+                               (digest, self.model, int(encoding is not None), blob))
+
+    def evict_missing(self, existing_paths):
+        """
+        Elimina las rutas que ya no existen en el dataset y los embeddings
+        (de cualquier modelo) que ninguna ruta referencia. Retorna cuántos
+        embeddings se eliminaron.
+        """
+        existing_paths = set(existing_paths)
+        with self._lock, self._conn:
+            known = [row[0] for row in self._conn.execute("SELECT path FROM files")]
+            stale = [(p,) for p in known if p not in existing_paths]
+            self._conn.executemany("DELETE FROM files WHERE path = ?", stale)
+            cursor = self._conn.execute("DELETE FROM embeddings WHERE sha256 NOT IN (SELECT sha256 FROM files)")
+            return cursor.rowcount
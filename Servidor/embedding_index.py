@@ -0,0 +1,366 @@
+import threading
+import numpy as np
+
+from ann_index import IVFIndex
+
+
+class EmbeddingIndex:
+    """
+    Índice 1:N de embeddings faciales en memoria.
+
+    Guarda todos los vectores en UNA matriz (N, D) float32 contigua y
+    preasignada, junto con sus normas al cuadrado (cacheadas) y un arreglo
+    de etiquetas enteras que apunta a la lista de cédulas. Una consulta
+    calcula todas las distancias euclidianas en una sola pasada vectorizada:
+
+        ||x - p||^2 = ||x||^2 - 2 x·p + ||p||^2
+
+    Además mantiene un centroide por usuario (media de sus plantillas) para
+    la identificación en dos etapas: primero se compara la sonda contra un
+    centroide por cédula y luego se re-ordenan solo las plantillas de los
+    mejores candidatos.
+
+    Opcionalmente puede tener un índice aproximado IVF/PQ (`build_ann`) que
+    se mantiene al día con cada `add`; sus candidatos se re-ordenan con
+    distancias exactas sobre la matriz.
+
+    Las lecturas no toman el lock: trabajan sobre una "foto" (snapshot) de
+    los arreglos. Las escrituras solo agregan filas después de `size` o
+    reemplazan los arreglos completos (centroides y filas por etiqueta se
+    copian al escribir), así que una foto nunca cambia.
+    """
+
+    def __init__(self, dim=128, capacity=1024):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((max(1, capacity), dim), dtype=np.float32)
+        self._norms_sq = np.zeros(max(1, capacity), dtype=np.float32)
+        self._labels = np.zeros(max(1, capacity), dtype=np.int32)
+        self._size = 0
+        self._names = []       # etiqueta (int) -> cédula
+        self._label_ids = {}   # cédula -> etiqueta (int)
+        self._label_rows = []  # etiqueta (int) -> lista de filas de la matriz
+        # Centroides por etiqueta (suma acumulada y conteo para actualizar en O(D))
+        self._centroid_sums = np.zeros((16, dim), dtype=np.float64)
+        self._centroids = np.zeros((16, dim), dtype=np.float32)
+        self._centroid_norms_sq = np.zeros(16, dtype=np.float32)
+        self._counts = np.zeros(16, dtype=np.int64)
+        self._ann = None # IVFIndex opcional
+
+    # --- Construcción ---
+    @classmethod
+    def from_data(cls, encodings, names, dim=128):
+        """Construye el índice desde el formato clásico {'encodings': [...], 'names': [...]}."""
+        index = cls(dim=dim, capacity=max(1024, len(encodings)))
+        index.add_many(encodings, names)
+        return index
+
+    @classmethod
+    def from_arrays(cls, vectors, labels, names, norms_sq=None):
+        """
+        Construye el índice SIN copiar la matriz: `vectors` puede ser un
+        memmap de solo lectura (EmbeddingStore). El primer `add` que exceda
+        la capacidad copia los datos a memoria propia (copy-on-grow).
+        """
+        vectors = np.asarray(vectors)
+        index = cls(dim=vectors.shape[1] if vectors.ndim == 2 else 128, capacity=1)
+        n = len(vectors)
+        if n == 0: return index
+        labels = np.asarray(labels)
+        index._matrix = vectors
+        index._norms_sq = np.asarray(norms_sq) if norms_sq is not None else np.einsum('ij,ij->i', vectors, vectors).astype(np.float32)
+        index._labels = labels
+        index._size = n
+        index._names = list(names)
+        index._label_ids = {cedula: label for label, cedula in enumerate(index._names)}
+
+        num_labels = len(index._names)
+        index._label_rows = cls._rows_by_label(labels, num_labels)
+        index._reserve_labels(num_labels)
+        index._update_centroids(vectors, labels)
+        return index
+
+    @staticmethod
+    def _rows_by_label(labels, num_labels):
+        """Filas por etiqueta en O(N log N) vectorizado (sin bucle Python por fila)."""
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(num_labels + 1))
+        return [order[bounds[l]:bounds[l + 1]].tolist() for l in range(num_labels)]
+
+    def export(self):
+        """
+        Retorna (vectors, labels, names) del contenido actual (para persistir).
+        Las cédulas sin filas (eliminadas) no se exportan y las etiquetas se renumeran.
+        """
+        matrix, _, labels, names = self._snapshot()
+        used, new_labels = np.unique(labels, return_inverse=True)
+        return matrix, new_labels.astype(np.int32), [names[l] for l in used]
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def num_labels(self):
+        return len(self._names)
+
+    def _label_for(self, cedula):
+        label = self._label_ids.get(cedula)
+        if label is None:
+            label = len(self._names)
+            self._names.append(cedula)
+            self._label_ids[cedula] = label
+            self._label_rows.append([])
+            self._reserve_labels(label + 1)
+        return label
+
+    def _reserve_labels(self, needed):
+        capacity = self._centroids.shape[0]
+        if needed <= capacity: return
+        new_capacity = max(needed, capacity * 2)
+        def grow(array):
+            grown = np.zeros((new_capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:capacity] = array
+            return grown
+        self._centroid_sums = grow(self._centroid_sums)
+        self._centroids = grow(self._centroids)
+        self._centroid_norms_sq = grow(self._centroid_norms_sq)
+        self._counts = grow(self._counts)
+
+    def _reserve(self, needed):
+        """Asegura capacidad para `needed` filas (crece x2, copiando a arreglos NUEVOS)."""
+        capacity = self._matrix.shape[0]
+        if needed <= capacity: return
+        new_capacity = max(needed, capacity * 2)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        norms_sq = np.zeros(new_capacity, dtype=np.float32)
+        labels = np.zeros(new_capacity, dtype=np.int32)
+        matrix[:self._size] = self._matrix[:self._size]
+        norms_sq[:self._size] = self._norms_sq[:self._size]
+        labels[:self._size] = self._labels[:self._size]
+        self._matrix, self._norms_sq, self._labels = matrix, norms_sq, labels
+
+    def add(self, encoding, cedula):
+        self.add_many([encoding], [cedula])
+
+    def add_many(self, encodings, names):
+        if len(encodings) == 0: return
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            label_rows = self._label_rows = list(self._label_rows) # Copia: las fotos en curso conservan la anterior
+            labels = np.fromiter((self._label_for(n) for n in names), dtype=np.int32, count=len(names))
+            start = self._size; end = start + len(vectors)
+            self._reserve(end)
+            self._matrix[start:end] = vectors
+            self._norms_sq[start:end] = np.einsum('ij,ij->i', vectors, vectors)
+            self._labels[start:end] = labels
+            added = {}
+            for row, label in enumerate(labels.tolist(), start): added.setdefault(label, []).append(row)
+            for label, rows in added.items(): label_rows[label] = label_rows[label] + rows
+            self._size = end
+            self._update_centroids(vectors, labels)
+            if self._ann is not None: self._ann.add(np.arange(start, end), vectors)
+
+    def _update_centroids(self, vectors, labels):
+        # Suma por etiqueta con sort + reduceat (mucho más rápido que np.add.at).
+        # Se escribe en copias y se reemplazan los arreglos: una consulta en dos etapas
+        # en curso nunca ve centroides de un `add` a medias
+        order = np.argsort(labels, kind='stable')
+        touched, starts = np.unique(labels[order], return_index=True)
+        centroid_sums, counts = self._centroid_sums.copy(), self._counts.copy()
+        centroids, centroid_norms_sq = self._centroids.copy(), self._centroid_norms_sq.copy()
+        centroid_sums[touched] += np.add.reduceat(vectors[order], starts, axis=0, dtype=np.float64)
+        counts[touched] += np.diff(np.append(starts, len(labels)))
+        touched_centroids = (centroid_sums[touched] / counts[touched, None]).astype(np.float32)
+        centroids[touched] = touched_centroids
+        centroid_norms_sq[touched] = np.einsum('ij,ij->i', touched_centroids, touched_centroids)
+        self._centroid_sums, self._counts = centroid_sums, counts
+        self._centroids, self._centroid_norms_sq = centroids, centroid_norms_sq
+
+    def remove_label(self, cedula):
+        """
+        Elimina TODAS las filas de una cédula sin tocar las de otros usuarios.
+        Compacta la matriz en arreglos NUEVOS (las consultas en curso siguen con
+        los anteriores) y renumera las filas del IVF. Retorna filas eliminadas.
+        La etiqueta se conserva: un `add` posterior de la misma cédula la reutiliza.
+        """
+        with self._lock:
+            label = self._label_ids.get(cedula)
+            if label is None or not self._label_rows[label]: return 0
+            n = self._size
+            keep = self._labels[:n] != label
+            kept = int(keep.sum())
+            capacity = max(self._matrix.shape[0], 1)
+            matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            norms_sq = np.zeros(capacity, dtype=np.float32)
+            labels = np.zeros(capacity, dtype=np.int32)
+            matrix[:kept] = self._matrix[:n][keep]
+            norms_sq[:kept] = self._norms_sq[:n][keep]
+            labels[:kept] = self._labels[:n][keep]
+
+            new_rows = np.cumsum(keep) - 1
+            new_rows[~keep] = -1
+            centroid_sums = self._centroid_sums.copy(); counts = self._counts.copy()
+            centroids = self._centroids.copy(); centroid_norms_sq = self._centroid_norms_sq.copy()
+            centroid_sums[label] = 0; counts[label] = 0; centroids[label] = 0; centroid_norms_sq[label] = 0
+
+            self._matrix, self._norms_sq, self._labels, self._size = matrix, norms_sq, labels, kept
+            self._label_rows = self._rows_by_label(labels[:kept], len(self._names))
+            self._centroid_sums, self._counts = centroid_sums, counts
+            self._centroids, self._centroid_norms_sq = centroids, centroid_norms_sq
+            if self._ann is not None: self._ann = self._ann.remapped(new_rows)
+            return n - kept
+
+    def _snapshot(self):
+        with self._lock:
+            n = self._size
+            return self._matrix[:n], self._norms_sq[:n], self._labels[:n], self._names
+
+    def _centroid_snapshot(self):
+        # Matriz y filas por etiqueta en la MISMA toma del lock: remove_label renumera filas
+        with self._lock:
+            n, n_labels = self._size, len(self._names)
+            return (self._matrix[:n], self._norms_sq[:n], self._labels[:n], self._names,
+                    self._centroids[:n_labels], self._centroid_norms_sq[:n_labels],
+                    self._counts[:n_labels], self._label_rows)
+
+    def _ann_snapshot(self):
+        with self._lock:
+            n = self._size
+            return self._matrix[:n], self._norms_sq[:n], self._labels[:n], self._names, self._ann
+
+    # --- Índice aproximado (IVF / PQ) ---
+    @property
+    def has_ann(self):
+        return self._ann is not None
+
+    def build_ann(self, nlist=None, pq_subvectors=0, iterations=20):
+        """
+        Entrena un IVFIndex sobre los vectores actuales y lo adjunta al índice.
+        nlist por defecto ~ 4*sqrt(N). Los `add` posteriores lo actualizan.
+        """
+        matrix, _, _, _ = self._snapshot()
+        if len(matrix) == 0: return
+        if nlist is None: nlist = max(1, int(4 * np.sqrt(len(matrix))))
+        ann = IVFIndex(dim=self.dim, nlist=nlist, pq_subvectors=pq_subvectors)
+        ann.train(matrix, iterations=iterations)
+        with self._lock:
+            # Vectores agregados mientras se entrenaba también entran al IVF
+            ann.add(np.arange(self._size), self._matrix[:self._size])
+            self._ann = ann
+        print(f"[EmbeddingIndex] IVF construido: {ann.nlist} listas, PQ={'m=' + str(pq_subvectors) if pq_subvectors else 'no'}, {len(ann)} vectores.")
+
+    # --- Consultas ---
+    @staticmethod
+    def _distances(matrix, norms_sq, probe):
+        dist_sq = norms_sq - 2.0 * (matrix @ probe) + np.dot(probe, probe)
+        return np.maximum(dist_sq, 0.0, out=dist_sq)
+
+    @staticmethod
+    def _smallest(dist_sq, k):
+        """Índices de las k distancias menores, ordenados."""
+        k = min(k, len(dist_sq))
+        top = np.argpartition(dist_sq, k - 1)[:k] if k < len(dist_sq) else np.arange(len(dist_sq))
+        return top[np.argsort(dist_sq[top])]
+
+    @staticmethod
+    def _result(rows, dist_sq, labels, names, tolerance):
+        top_k = [(names[labels[i]], float(np.sqrt(d))) for i, d in zip(rows, dist_sq)]
+        best_cedula, best_distance = top_k[0]
+        if best_distance > tolerance: best_cedula = None
+        return best_cedula, best_distance, top_k
+
+    def search(self, probe, k=5, tolerance=0.6):
+        """
+        Busca el vector más cercano y los k mejores en una sola pasada.
+
+        Retorna (cedula, distancia, top_k) donde:
+          - cedula es None si la mejor distancia supera `tolerance`
+            (mismo criterio que face_recognition.compare_faces: dist <= tolerance),
+          - top_k es una lista [(cedula, distancia), ...] ordenada de menor a mayor.
+        Si el índice está vacío retorna (None, None, []).
+        """
+        matrix, norms_sq, labels, names = self._snapshot()
+        if len(matrix) == 0: return None, None, []
+
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        dist_sq = self._distances(matrix, norms_sq, probe)
+        top = self._smallest(dist_sq, k)
+        return self._result(top, dist_sq[top], labels, names, tolerance)
+
+    def search_two_stage(self, probe, k=5, tolerance=0.6, candidates=5):
+        """
+        Identificación en dos etapas:
+          1. Distancia de la sonda contra UN centroide por usuario.
+          2. Re-ordenamiento exacto contra las plantillas individuales de los
+             `candidates` usuarios más cercanos.
+        Retorna lo mismo que `search`.
+        """
+        matrix, norms_sq, labels, names, centroids, centroid_norms_sq, counts, label_rows = self._centroid_snapshot()
+        if len(matrix) == 0: return None, None, []
+
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        centroid_dist_sq = self._distances(centroids, centroid_norms_sq, probe)
+        centroid_dist_sq[counts == 0] = np.inf # Etiquetas sin plantillas
+        candidate_labels = self._smallest(centroid_dist_sq, candidates)
+
+        n = len(matrix)
+        rows = np.fromiter((r for label in candidate_labels for r in label_rows[label] if r < n), dtype=np.int64)
+        if len(rows) == 0: return None, None, []
+        dist_sq = self._distances(matrix[rows], norms_sq[rows], probe)
+        top = self._smallest(dist_sq, k)
+        return self._result(rows[top], dist_sq[top], labels, names, tolerance)
+
+    def search_ann(self, probe, k=5, tolerance=0.6, nprobe=8, rerank=64):
+        """
+        Búsqueda aproximada: candidatos de las `nprobe` listas IVF más cercanas
+        (hasta `rerank` si hay PQ) y re-ranking EXACTO sobre la matriz.
+        Sin IVF construido equivale a `search`. Retorna lo mismo que `search`.
+        """
+        matrix, norms_sq, labels, names, ann = self._ann_snapshot()
+        if ann is None: return self.search(probe, k=k, tolerance=tolerance)
+        if len(matrix) == 0: return None, None, []
+
+        probe = np.asarray(probe, dtype=np.float32).reshape(self.dim)
+        rows = ann.search(probe, nprobe=nprobe, max_candidates=rerank)
+        rows = rows[rows < len(matrix)]
+        if len(rows) == 0: return None, None, []
+        dist_sq = self._distances(matrix[rows], norms_sq[rows], probe)
+        top = self._smallest(dist_sq, k)
+        return self._result(rows[top], dist_sq[top], labels, names, tolerance)
+
+    # --- Búsqueda por lotes (varias sondas a la vez) ---
+    @staticmethod
+    def _distances_many(matrix, norms_sq, probes):
+        """(B, N) distancias al cuadrado con UNA multiplicación matriz-matriz (GEMM)."""
+        dist_sq = norms_sq[None, :] - 2.0 * (probes @ matrix.T) + np.einsum('ij,ij->i', probes, probes)[:, None]
+        return np.maximum(dist_sq, 0.0, out=dist_sq)
+
+    def search_many(self, probes, k=5, tolerance=0.6):
+        """Como `search` para B sondas (B, D) en una sola pasada sobre la matriz. Retorna una lista de resultados."""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        matrix, norms_sq, labels, names = self._snapshot()
+        if len(matrix) == 0: return [(None, None, []) for _ in probes]
+        dist_sq = self._distances_many(matrix, norms_sq, probes)
+        results = []
+        for row in dist_sq:
+            top = self._smallest(row, k)
+            results.append(self._result(top, row[top], labels, names, tolerance))
+        return results
+
+    def search_two_stage_many(self, probes, k=5, tolerance=0.6, candidates=5):
+        """Como `search_two_stage` para B sondas: el prefiltro de centroides es una sola GEMM."""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        matrix, norms_sq, labels, names, centroids, centroid_norms_sq, counts, label_rows = self._centroid_snapshot()
+        if len(matrix) == 0: return [(None, None, []) for _ in probes]
+        centroid_dist_sq = self._distances_many(centroids, centroid_norms_sq, probes)
+        centroid_dist_sq[:, counts == 0] = np.inf
+        n = len(matrix)
+        results = []
+        for probe, row in zip(probes, centroid_dist_sq):
+            candidate_labels = self._smallest(row, candidates)
+            rows = np.fromiter((r for label in candidate_labels for r in label_rows[label] if r < n), dtype=np.int64)
+            if len(rows) == 0: results.append((None, None, [])); continue
+            dist_sq = self._distances(matrix[rows], norms_sq[rows], probe)
+            top = self._smallest(dist_sq, k)
+            results.append(self._result(rows[top], dist_sq[top], labels, names, tolerance))
+        return results
@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import zlib
+import struct
+import datetime
+import threading
+import numpy as np
+
+STORE_VERSION = 1
+HEADER_NAME = "header.json"
+
+# --- Diario (journal) append-only ---
+# Registro de tamaño fijo: operación (1 byte), cédula (16 bytes, UTF-8 con
+# relleno), vector float32 (dim x 4 bytes) y CRC32 de todo lo anterior.
+JOURNAL_OP_ADD = 1
+JOURNAL_OP_REMOVE = 2 # Tombstone: elimina todas las filas de la cédula (vector en ceros)
+CEDULA_BYTES = 16
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError:
+        pass # Algunos sistemas (Windows) no permiten fsync de directorios
+
+
+def _write_atomic(path, write_fn):
+    """Escribe a '<path>.tmp', hace fsync y lo renombra sobre `path` (atómico)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        write_fn(f)
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class EmbeddingStore:
+    """
+    Almacén binario versionado de embeddings (reemplaza encodings.pickle).
+
+    Estructura del directorio:
+        header.json          -> versión, modelo, dimensión, conteo y generación actual
+        vectors-<gen>.npy    -> matriz (N, D) float32 (se abre con mmap, sin copiar)
+        norms-<gen>.npy      -> normas al cuadrado (N,) float32
+        labels-<gen>.npy     -> etiqueta entera por fila (N,) int32
+        names-<gen>.json     -> etiqueta -> cédula
+        journal-<gen>.log    -> embeddings agregados después de la generación
+
+    Entre generaciones, cada enrolamiento se agrega a journal-<gen>.log como
+    UN registro de tamaño fijo con fsync (O(1) en disco). `compact` (o
+    cualquier `save`) vuelca todo a una generación nueva y arranca un journal
+    vacío.
+
+    Cada `save` escribe una generación nueva y luego reemplaza header.json con
+    un rename atómico: un lector (de este u otro proceso) ve la generación
+    vieja completa o la nueva completa, nunca una mezcla. Varios procesos que
+    abren la misma generación comparten el page cache del sistema operativo.
+    """
+
+    def __init__(self, directory, model, dim=128):
+        self.directory = directory
+        self.model = model
+        self.dim = dim
+        self.header_path = os.path.join(directory, HEADER_NAME)
+        self._record = struct.Struct(f"<B{CEDULA_BYTES}s{dim}f")
+        self.record_size = self._record.size + 4 # + CRC32
+        self._journal_lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.header_path)
+
+    def read_header(self):
+        with open(self.header_path, 'r', encoding='utf-8') as f: return json.load(f)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        """
+        Abre la generación actual con memory-mapping (solo lectura).
+        Retorna (vectors, norms_sq, labels, names, header) o None si no existe
+        o fue generada con otro modelo/dimensión. Los registros del journal
+        de esa generación se leen aparte con `read_journal(header)`.
+        """
+        if not self.exists(): return None
+        for attempt in range(3):
+            header = self.read_header()
+            if header.get("version") != STORE_VERSION or header.get("model") != self.model or header.get("dim") != self.dim:
+                print(f"[EmbeddingStore] Almacén incompatible (versión {header.get('version')}, modelo {header.get('model')}, "
+                      f"dim {header.get('dim')}); se esperaba modelo {self.model}, dim {self.dim}. ¡Necesita re-entrenar!")
+                return None
+            try:
+                vectors = np.load(self._path(header["vectors"]), mmap_mode='r')
+                norms_sq = np.load(self._path(header["norms"]), mmap_mode='r')
+                labels = np.load(self._path(header["labels"]), mmap_mode='r')
+                with open(self._path(header["names"]), 'r', encoding='utf-8') as f: names = json.load(f)
+                return vectors, norms_sq, labels, names, header
+            except FileNotFoundError:
+                # Otro proceso publicó una generación nueva y borró la anterior entre
+                # la lectura del header y la apertura de los archivos: reintentar.
+                time.sleep(0.05)
+        raise RuntimeError(f"No se pudo abrir una generación consistente en '{self.directory}'")
+
+    def save(self, vectors, labels, names):
+        """Escribe una generación nueva y la publica de forma atómica. Retorna el header."""
+        os.makedirs(self.directory, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels = np.ascontiguousarray(labels, dtype=np.int32)
+        norms_sq = np.einsum('ij,ij->i', vectors, vectors).astype(np.float32)
+
+        previous = self.read_header() if self.exists() else None
+        generation = (previous.get("generation", 0) + 1) if previous else 1
+        files = {key: f"{key}-{generation:06d}.{ext}"
+                 for key, ext in (("vectors", "npy"), ("norms", "npy"), ("labels", "npy"), ("names", "json"), ("journal", "log"))}
+
+        _write_atomic(self._path(files["vectors"]), lambda f: np.save(f, vectors))
+        _write_atomic(self._path(files["norms"]), lambda f: np.save(f, norms_sq))
+        _write_atomic(self._path(files["labels"]), lambda f: np.save(f, labels))
+        _write_atomic(self._path(files["names"]), lambda f: f.write(json.dumps(list(names)).encode('utf-8')))
+        _write_atomic(self._path(files["journal"]), lambda f: None) # Journal vacío de la nueva generación
+
+        header = {
+            "version": STORE_VERSION, "model": self.model, "dim": self.dim,
+            "count": int(len(vectors)), "generation": generation,
+            "created": datetime.datetime.utcnow().isoformat() + "Z", **files,
+        }
+        _write_atomic(self.header_path, lambda f: f.write(json.dumps(header, indent=2).encode('utf-8')))
+        _fsync_dir(self.directory)
+
+        if previous: self._remove_generation(previous)
+        return header
+
+    def _remove_generation(self, header):
+        # En Linux los procesos que aún tienen mapeada la generación vieja siguen
+        # leyéndola sin problema aunque se borre el archivo.
+        for key in ("vectors", "norms", "labels", "names", "journal"):
+            try: os.remove(self._path(header[key]))
+            except (OSError, KeyError): pass
+
+    # --- Journal append-only ---
+    def _journal_path(self, header):
+        return self._path(header.get("journal") or f"journal-{header.get('generation', 0):06d}.log")
+
+    def append(self, cedula, vector):
+        """
+        Agrega UN embedding al journal de la generación actual con fsync.
+        Retorna la cantidad de registros en el journal (para decidir compactar).
+        """
+        return self.append_records([(JOURNAL_OP_ADD, cedula, vector)])
+
+    def append_remove(self, cedula):
+        """Tombstone: al reproducir el journal se eliminan todas las filas de `cedula`."""
+        return self.append_records([(JOURNAL_OP_REMOVE, cedula, None)])
+
+    def append_records(self, records):
+        """Agrega varios registros [(op, cedula, vector | None), ...] con UN solo fsync."""
+        payload = bytearray()
+        for op, cedula, vector in records:
+            encoded = cedula.encode('utf-8')
+            if len(encoded) > CEDULA_BYTES: raise ValueError(f"Cédula demasiado larga para el journal: {cedula}")
+            values = np.zeros(self.dim, dtype=np.float32) if vector is None else np.asarray(vector, dtype=np.float32).reshape(self.dim)
+            body = self._record.pack(op, encoded, *values)
+            payload += body + struct.pack("<I", zlib.crc32(body))
+        with self._journal_lock:
+            if not self.exists(): self.save(np.zeros((0, self.dim), dtype=np.float32), [], [])
+            path = self._journal_path(self.read_header())
+            # Descartar un registro final cortado (caída a mitad de escritura) para no desalinear
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size % self.record_size: os.truncate(path, size - size % self.record_size)
+            with open(path, 'ab') as f:
+                f.write(payload)
+                f.flush(); os.fsync(f.fileno())
+                return f.tell() // self.record_size
+
+    def read_journal(self, header, start=0):
+        """
+        Lee los registros válidos del journal de `header` a partir del registro
+        `start` (para seguir un journal ya aplicado en parte).
+        Retorna (operaciones, cédulas, vectores (M, D)). Un registro final
+        incompleto o con CRC inválido (escritura cortada) se ignora.
+        """
+        ops, cedulas, vectors = [], [], []
+        path = self._journal_path(header)
+        if not os.path.exists(path): return ops, cedulas, np.zeros((0, self.dim), dtype=np.float32)
+        with open(path, 'rb') as f:
+            f.seek(start * self.record_size)
+            data = f.read()
+        for offset in range(0, len(data) - self.record_size + 1, self.record_size):
+            body = data[offset:offset + self._record.size]
+            (crc,) = struct.unpack_from("<I", data, offset + self._record.size)
+            if zlib.crc32(body) != crc:
+                print(f"[EmbeddingStore] Registro corrupto en '{path}' (offset {offset}); se ignora el resto.")
+                break
+            op, raw_cedula, *vector = self._record.unpack(body)
+            ops.append(op); cedulas.append(raw_cedula.rstrip(b"\0").decode('utf-8')); vectors.append(vector)
+        return ops, cedulas, np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+
+    def journal_count(self):
+        if not self.exists(): return 0
+        path = self._journal_path(self.read_header())
+        return os.path.getsize(path) // self.record_size if os.path.exists(path) else 0
+
+    def compact(self, vectors, labels, names):
+        """
+        Vuelca el contenido completo (ya incluye el journal) a una generación
+        nueva con journal vacío. Bloquea solo a otros `append`, no las lecturas.
+        """
+        with self._journal_lock:
+            return self.save(vectors, labels, names)
+
+
+def apply_journal(index, ops, cedulas, vectors):
+    """Reproduce en orden los registros del journal sobre un EmbeddingIndex (agrupando los 'add' seguidos)."""
+    start = 0
+    for i in range(len(ops) + 1):
+        if i < len(ops) and ops[i] == JOURNAL_OP_ADD: continue
+        if i > start: index.add_many(vectors[start:i], cedulas[start:i])
+        if i < len(ops) and ops[i] == JOURNAL_OP_REMOVE: index.remove_label(cedulas[i])
+        start = i + 1
@@ -0,0 +1,209 @@
+import os
+import threading
+import cv2
+import numpy as np
+
+try:
+    import dlib
+except ImportError:
+    dlib = None
+
+DLIB_PREDICTOR_FILE = "shape_predictor_68_face_landmarks.dat"
+YUNET_MODEL_FILE = "face_detection_yunet_2023mar.onnx"
+SFACE_MODEL_FILE = "face_recognition_sface_2021dec.onnx"
+
+
+class FaceBox:
+    """Caja de una cara detectada (coordenadas en píxeles) + datos crudos del detector."""
+
+    def __init__(self, x, y, w, h, score=1.0, raw=None):
+        self.x, self.y, self.w, self.h = int(x), int(y), int(w), int(h)
+        self.score = float(score)
+        self.raw = raw # YuNet: fila de 15 valores (caja, 5 landmarks, score) para alinear en SFace
+
+    def to_dlib(self):
+        return dlib.rectangle(self.x, self.y, self.x + self.w, self.y + self.h)
+
+    def offset(self, dx, dy):
+        """Copia desplazada (dx, dy): pasa una caja detectada en un recorte a coordenadas del frame."""
+        raw = None
+        if self.raw is not None:
+            raw = self.raw.copy()
+            raw[[0, 4, 6, 8, 10, 12]] += dx # x de la caja y de los 5 landmarks
+            raw[[1, 5, 7, 9, 11, 13]] += dy # y
+        return FaceBox(self.x + dx, self.y + dy, self.w, self.h, self.score, raw)
+
+    def to_css(self):
+        """(top, right, bottom, left) como espera face_recognition."""
+        return (self.y, self.x + self.w, self.y + self.h, self.x)
+
+    def __repr__(self):
+        return f"FaceBox(x={self.x}, y={self.y}, w={self.w}, h={self.h}, score={self.score:.2f})"
+
+
+class FaceEngine:
+    """
+    Interfaz del motor facial: detector, landmarks y embedder.
+
+    - detect(bgr, gray)       -> [FaceBox, ...]
+    - landmarks(gray, box)    -> forma dlib de 68 puntos (la usa BlinkDetector para el EAR)
+    - embed(bgr, box)         -> vector float32 (DIM,)
+    - embed_batch([(bgr, box), ...]) -> lista de vectores (un forward por lotes si el motor lo soporta)
+    - embed_image(bgr)        -> vector de la cara principal de una foto, o None si no hay cara
+
+    MODEL_ID etiqueta los embeddings: el almacén y la caché no mezclan
+    vectores de motores distintos. TOLERANCE es la distancia euclidiana
+    máxima para aceptar un match con este motor.
+    """
+    NAME = None
+    MODEL_ID = None
+    DIM = 128
+    TOLERANCE = 0.6
+
+    def __init__(self, base_dir):
+        if dlib is None: raise RuntimeError("dlib no está instalado (necesario para los 68 landmarks)")
+        self.landmark_predictor = dlib.shape_predictor(os.path.join(base_dir, DLIB_PREDICTOR_FILE))
+
+    def detect(self, bgr, gray):
+        raise NotImplementedError
+
+    def landmarks(self, gray, box):
+        return self.landmark_predictor(gray, box.to_dlib())
+
+    def embed(self, bgr, box):
+        raise NotImplementedError
+
+    def embed_batch(self, items):
+        return [self.embed(bgr, box) for bgr, box in items]
+
+    def embed_image(self, bgr):
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        boxes = self.detect(bgr, gray)
+        if not boxes: return None
+        return self.embed(bgr, boxes[0])
+
+
+class DlibEngine(FaceEngine):
+    """
+    Motor clásico: detector HOG de dlib + ResNet de face_recognition (128-d).
+
+    El detector y la red son objetos compartidos que no admiten llamadas
+    concurrentes: el trabajo de dlib queda serializado dentro del proceso
+    (para usar más núcleos hacen falta más procesos, o el motor 'yunet').
+    """
+    NAME = "dlib"
+    MODEL_ID = "dlib_resnet_v1"
+    DIM = 128
+    TOLERANCE = 0.6
+
+    def __init__(self, base_dir):
+        super().__init__(base_dir)
+        import face_recognition
+        self._face_recognition = face_recognition
+        self.detector = dlib.get_frontal_face_detector()
+        self._detect_lock = threading.Lock()
+        self._embed_lock = threading.Lock() # face_encodings: predictor de 5 puntos + ResNet (globales de face_recognition)
+
+    def detect(self, bgr, gray, upsample=0):
+        with self._detect_lock: rects = self.detector(gray, upsample)
+        return [FaceBox(r.left(), r.top(), r.width(), r.height()) for r in rects]
+
+    def embed(self, bgr, box):
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        with self._embed_lock: encodings = self._face_recognition.face_encodings(rgb, [box.to_css()])
+        return np.asarray(encodings[0], dtype=np.float32) if encodings else None
+
+    def embed_batch(self, items):
+        # Mismo preprocesado que face_encodings (5 landmarks, chip 150x150, padding 0.25),
+        # pero con UNA llamada de la red para todos los chips
+        if not items: return []
+        api = self._face_recognition.api
+        chips = []
+        rgbs = [cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB) for bgr, _ in items]
+        with self._embed_lock:
+            for rgb, (_, box) in zip(rgbs, items):
+                chips.append(dlib.get_face_chip(rgb, api.pose_predictor_5_point(rgb, box.to_dlib()), size=150, padding=0.25))
+            descriptors = api.face_encoder.compute_face_descriptor(chips)
+        return [np.asarray(d, dtype=np.float32) for d in descriptors]
+
+    def embed_image(self, bgr):
+        # Igual que el entrenamiento original: HOG con 1 upsample sobre RGB
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        with self._detect_lock: boxes = self._face_recognition.face_locations(rgb, model='hog')
+        if len(boxes) == 0: return None
+        with self._embed_lock: encodings = self._face_recognition.face_encodings(rgb, boxes[:1])
+        return np.asarray(encodings[0], dtype=np.float32) if encodings else None
+
+
+class YuNetSFaceEngine(FaceEngine):
+    """
+    Motor OpenCV (CPU): detector YuNet + embeddings SFace (128-d, normalizados L2).
+    Los landmarks de 68 puntos para el reto de parpadeo siguen viniendo de dlib.
+
+    Umbral: OpenCV recomienda similitud coseno >= 0.363 para SFace; con vectores
+    unitarios eso equivale a distancia euclidiana <= sqrt(2 - 2*0.363) ~= 1.128.
+    """
+    NAME = "yunet"
+    MODEL_ID = "sface_2021dec"
+    DIM = 128
+    TOLERANCE = 1.128
+
+    def __init__(self, base_dir, score_threshold=0.8):
+        super().__init__(base_dir)
+        self.detector = cv2.FaceDetectorYN.create(os.path.join(base_dir, YUNET_MODEL_FILE), "", (320, 320), score_threshold, 0.3, 5000)
+        self.recognizer = cv2.FaceRecognizerSF.create(os.path.join(base_dir, SFACE_MODEL_FILE), "")
+        self.batch_net = cv2.dnn.readNetFromONNX(os.path.join(base_dir, SFACE_MODEL_FILE)) # Misma red, para lotes
+        self._batch_supported = True
+        # Los objetos DNN de OpenCV no son seguros para llamadas concurrentes
+        self._detect_lock = threading.Lock()
+        self._embed_lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+
+    def detect(self, bgr, gray):
+        h, w = bgr.shape[:2]
+        with self._detect_lock:
+            self.detector.setInputSize((w, h))
+            _, faces = self.detector.detect(bgr)
+        if faces is None: return []
+        faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True) # Cara más grande primero
+        return [FaceBox(f[0], f[1], f[2], f[3], f[14], raw=np.array(f, dtype=np.float32)) for f in faces]
+
+    def embed(self, bgr, box):
+        if box.raw is None: return None
+        with self._embed_lock:
+            aligned = self.recognizer.alignCrop(bgr, box.raw)
+            feature = self.recognizer.feature(aligned).reshape(-1).astype(np.float32)
+        return feature / max(np.linalg.norm(feature), 1e-12)
+
+    def embed_batch(self, items):
+        if not self._batch_supported or len(items) < 2: return super().embed_batch(items)
+        results = [None] * len(items)
+        valid = [i for i, (_, box) in enumerate(items) if box.raw is not None]
+        if not valid: return results
+        with self._embed_lock:
+            aligned = [self.recognizer.alignCrop(items[i][0], items[i][1].raw) for i in valid]
+        # Mismo preprocesado que FaceRecognizerSF::feature: 112x112, sin escala ni media, BGR->RGB
+        blob = cv2.dnn.blobFromImages(aligned, 1.0, (112, 112), (0, 0, 0), swapRB=True, crop=False)
+        try:
+            with self._batch_lock:
+                self.batch_net.setInput(blob)
+                features = self.batch_net.forward().reshape(len(valid), -1).astype(np.float32)
+        except cv2.error as e:
+            print(f"[YuNetSFaceEngine] El modelo no acepta lotes ({e}); se usa embedding individual.")
+            self._batch_supported = False
+            return super().embed_batch(items)
+        features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+        for i, feature in zip(valid, features): results[i] = feature
+        return results
+
+
+ENGINES = {DlibEngine.NAME: DlibEngine, YuNetSFaceEngine.NAME: YuNetSFaceEngine}
+
+
+def engine_class(name):
+    if name not in ENGINES: raise ValueError(f"Motor facial desconocido: '{name}' (opciones: {', '.join(ENGINES)})")
+    return ENGINES[name]
+
+
+def create_engine(name, base_dir):
+    return engine_class(name)(base_dir)
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def landmarks_agreement(box, shape):
+    """
+    Proxy de confianza de los 68 landmarks (dlib no da un score): IoU entre la
+    caja de la cara y la caja que encierra los landmarks. Si el predictor se
+    "sale" de la cara (caja desplazada o cara perdida) el IoU cae.
+    """
+    points = np.array([(shape.part(i).x, shape.part(i).y) for i in range(shape.num_parts)])
+    lx0, ly0 = points.min(axis=0); lx1, ly1 = points.max(axis=0)
+    ix = max(0, min(box.x + box.w, lx1) - max(box.x, lx0))
+    iy = max(0, min(box.y + box.h, ly1) - max(box.y, ly0))
+    inter = ix * iy
+    union = box.w * box.h + (lx1 - lx0) * (ly1 - ly0) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def box_iou(a, b):
+    ix = max(0, min(a.x + a.w, b.x + b.w) - max(a.x, b.x))
+    iy = max(0, min(a.y + a.h, b.y + b.h) - max(a.y, b.y))
+    inter = ix * iy
+    union = a.w * a.h + b.w * b.h - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """
+    Seguimiento de la cara entre frames de UN dispositivo durante el reto de parpadeo.
+
+    La cara casi no se mueve entre frames consecutivos, así que en vez de
+    detectar en el frame completo se detecta solo en una región alrededor de
+    la caja anterior (`roi_scale` veces su tamaño). Se vuelve a detectar en el
+    frame completo:
+      - en el primer frame y cada `redetect_every` frames,
+      - si la región no contiene cara,
+      - si los landmarks del frame anterior no coincidían con la caja
+        (`landmarks_agreement` < `min_agreement`).
+
+    `track` identifica la cara seguida: cambia cada vez que se (re)adquiere una
+    cara tras perderla o la caja salta respecto al frame anterior (IoU <
+    `min_continuity`). Dos frames con el mismo `track` son de la misma cara
+    sin interrupción; uno con otro `track` puede ser de otra persona.
+    """
+
+    def __init__(self, engine, redetect_every=10, roi_scale=1.8, min_agreement=0.4, min_continuity=0.3):
+        self.engine = engine
+        self.redetect_every = redetect_every
+        self.roi_scale = roi_scale
+        self.min_agreement = min_agreement
+        self.min_continuity = min_continuity
+        self.box = None # Semilla de la región de búsqueda (None = detección completa)
+        self.last_box = None # Caja del frame anterior (None = no había cara)
+        self.track = 0
+        self.frames_since_full = 0
+        self.full_detections = 0
+        self.roi_detections = 0
+
+    def reset(self):
+        self.box = None
+        self.last_box = None
+
+    def locate(self, bgr, gray):
+        """Retorna la FaceBox de la cara principal del frame, o None."""
+        box = None
+        if self.box is not None and self.frames_since_full < self.redetect_every:
+            box = self._detect_roi(bgr, gray)
+            self.frames_since_full += 1
+        if box is None:
+            faces = self.engine.detect(bgr, gray)
+            self.full_detections += 1
+            self.frames_since_full = 0
+            box = faces[0] if faces else None
+        if box is not None and (self.last_box is None or box_iou(self.last_box, box) < self.min_continuity):
+            self.track += 1 # Cara (re)adquirida o salto: puede ser otra persona
+        self.box = self.last_box = box
+        return box
+
+    def _detect_roi(self, bgr, gray):
+        h, w = gray.shape[:2]
+        cx, cy = self.box.x + self.box.w / 2.0, self.box.y + self.box.h / 2.0
+        half_w, half_h = self.box.w * self.roi_scale / 2.0, self.box.h * self.roi_scale / 2.0
+        x0, y0 = max(0, int(cx - half_w)), max(0, int(cy - half_h))
+        x1, y1 = min(w, int(cx + half_w)), min(h, int(cy + half_h))
+        if x1 - x0 < 32 or y1 - y0 < 32: return None
+        faces = self.engine.detect(np.ascontiguousarray(bgr[y0:y1, x0:x1]), np.ascontiguousarray(gray[y0:y1, x0:x1]))
+        self.roi_detections += 1
+        return faces[0].offset(x0, y0) if faces else None
+
+    def check_landmarks(self, box, shape):
+        """Si los landmarks no cuadran con la caja, fuerza detección completa en el siguiente frame."""
+        if landmarks_agreement(box, shape) < self.min_agreement:
+            self.box = None
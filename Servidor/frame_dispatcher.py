@@ -0,0 +1,93 @@
+import queue
+import threading
+import traceback
+from collections import deque
+
+
+class FrameDispatcher:
+    """
+    Reparte los frames de los dispositivos entre un pool de hilos, fuera del
+    hilo de red de MQTT (paho `loop_start`).
+
+    - Cada dispositivo tiene una cola acotada de `per_device` frames: si llega
+      uno nuevo con la cola llena se descarta el más viejo (gana el último
+      frame), así un dispositivo lento no acumula frames obsoletos.
+    - Un dispositivo tiene como máximo UN frame en proceso: sus frames se
+      atienden en orden (lo necesita el reto de parpadeo), mientras que
+      dispositivos distintos se procesan en paralelo en `workers` hilos.
+
+    `handler(device_id, payload)` se llama desde los hilos del pool.
+    """
+
+    def __init__(self, handler, workers=4, per_device=2, name="frame-worker"):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.per_device = max(1, per_device)
+        self.name = name
+        self.dropped = 0 # Frames descartados por cola llena o por STOP
+        self._queues = {} # device_id -> deque(maxlen=per_device)
+        self._scheduled = set() # Dispositivos en la cola de listos o en proceso
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        if self._threads: return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, device_id, payload):
+        """Encola un frame (no bloquea). Retorna False si se descartó un frame viejo."""
+        with self._lock:
+            frames = self._queues.get(device_id)
+            if frames is None: frames = self._queues[device_id] = deque(maxlen=self.per_device)
+            full = len(frames) == frames.maxlen
+            if full: self.dropped += 1
+            frames.append(payload)
+            if device_id not in self._scheduled:
+                self._scheduled.add(device_id)
+                self._ready.put(device_id)
+        return not full
+
+    def discard(self, device_id):
+        """Descarta los frames pendientes de un dispositivo (el que está en proceso termina)."""
+        with self._lock:
+            frames = self._queues.get(device_id)
+            if frames:
+                self.dropped += len(frames)
+                frames.clear()
+
+    def pending(self):
+        with self._lock:
+            return sum(len(frames) for frames in self._queues.values())
+
+    def stop(self):
+        for _ in self._threads: self._ready.put(None)
+        for thread in self._threads: thread.join()
+        self._threads = []
+
+    def _run(self):
+        while True:
+            device_id = self._ready.get()
+            if device_id is None: return
+            with self._lock:
+                frames = self._queues.get(device_id)
+                payload = frames.popleft() if frames else None
+                if payload is None:
+                    # Cola vaciada por `discard`: liberar el dispositivo y su cola
+                    self._scheduled.discard(device_id)
+                    self._queues.pop(device_id, None)
+                    continue
+            try:
+                self.handler(device_id, payload)
+            except Exception:
+                print(f"[FrameDispatcher] Error procesando frame de {device_id}\n{traceback.format_exc()}")
+            with self._lock:
+                frames = self._queues.get(device_id)
+                if frames:
+                    self._ready.put(device_id) # Siguiente frame del mismo dispositivo, en orden
+                else:
+                    self._scheduled.discard(device_id)
+                    self._queues.pop(device_id, None)
@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+
+# Umbrales por defecto (el RPi envía 320x240 en JPEG calidad 60)
+MIN_SHARPNESS = 25.0 # Varianza del Laplaciano en la cara; menos = movida/desenfocada
+MIN_FACE_SIZE = 64 # Lado mínimo de la caja de la cara en píxeles (el HOG de dlib ya exige ~80)
+DARK_LEVEL, BRIGHT_LEVEL = 25, 235 # Niveles de gris considerados sub/sobre-expuestos
+MAX_CLIPPED_FRACTION = 0.6 # Fracción máxima de píxeles sub/sobre-expuestos
+
+
+class FrameQuality:
+    """Resultado del control de calidad: ok, motivo (status + mensaje para el cliente) y puntaje."""
+
+    def __init__(self, ok, status=None, message=None, score=0.0):
+        self.ok = ok
+        self.status = status
+        self.message = message
+        self.score = score
+
+    def __repr__(self):
+        return f"FrameQuality(ok={self.ok}, status={self.status}, score={self.score:.1f})"
+
+
+GOOD = FrameQuality(True)
+
+
+def _clip(gray, box):
+    h, w = gray.shape[:2]
+    x0, y0 = max(0, box.x), max(0, box.y)
+    x1, y1 = min(w, box.x + box.w), min(h, box.y + box.h)
+    return gray[y0:y1, x0:x1]
+
+
+def sharpness(gray):
+    """Varianza del Laplaciano (alta = bordes nítidos)."""
+    if gray.size == 0: return 0.0
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def exposure(gray, step=4):
+    """Fracciones (oscuros, quemados) sobre una sub-muestra 1 de cada `step` píxeles."""
+    sample = gray[::step, ::step]
+    if sample.size == 0: return 0.0, 0.0
+    hist = np.bincount(sample.ravel(), minlength=256)
+    return hist[:DARK_LEVEL].sum() / sample.size, hist[BRIGHT_LEVEL + 1:].sum() / sample.size
+
+
+def check_exposure(gray):
+    """Control barato del frame completo, antes de detectar."""
+    dark, bright = exposure(gray)
+    if dark > MAX_CLIPPED_FRACTION: return FrameQuality(False, "verifying_quality", "Poca luz, acérquese a la luz")
+    if bright > MAX_CLIPPED_FRACTION: return FrameQuality(False, "verifying_quality", "Demasiada luz")
+    return GOOD
+
+
+def check_face(gray, box, min_sharpness=MIN_SHARPNESS, min_face_size=MIN_FACE_SIZE):
+    """
+    Control de la región de la cara: tamaño y nitidez. El puntaje (nitidez x
+    tamaño) ordena los frames buenos de una sesión para elegir el mejor.
+    """
+    if min(box.w, box.h) < min_face_size: return FrameQuality(False, "verifying_quality", "Acérquese a la cámara")
+    face = _clip(gray, box)
+    value = sharpness(face)
+    if value < min_sharpness: return FrameQuality(False, "verifying_quality", "Quédese quieto...", value)
+    return FrameQuality(True, score=value * np.sqrt(face.shape[0] * face.shape[1]))
@@ -0,0 +1,36 @@
+import bisect
+import hashlib
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Hashing consistente: asigna cada clave (rpi_client_id) a un nodo (worker).
+
+    Cada nodo aparece `replicas` veces en el anillo para repartir parejo. Al
+    agregar o quitar un worker solo cambian de dueño ~1/N de los dispositivos;
+    el resto conserva su worker (y su sesión de prueba de vida).
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.replicas = replicas
+        self._ring = [] # [(hash, nodo)] ordenado
+        for node in nodes: self.add(node)
+
+    @property
+    def nodes(self):
+        return sorted({node for _, node in self._ring})
+
+    def add(self, node):
+        for i in range(self.replicas): bisect.insort(self._ring, (_hash(f"{node}#{i}"), node))
+
+    def remove(self, node):
+        self._ring = [(h, n) for h, n in self._ring if n != node]
+
+    def owner(self, key):
+        if not self._ring: return None
+        i = bisect.bisect(self._ring, (_hash(key), ""))
+        return self._ring[i % len(self._ring)][1]
@@ -0,0 +1,107 @@
+import time
+import threading
+import traceback
+from collections import OrderedDict
+
+
+class LivenessSession:
+    """Estado del reto de parpadeo de UN dispositivo."""
+
+    def __init__(self, detector, blinks_required, tracker=None, speculation=None, now=None):
+        self.detector = detector
+        self.tracker = tracker # FaceTracker: caja de la cara del frame anterior
+        self.speculation = speculation # SpeculativeEmbedding: match del mejor frame, calculado en segundo plano
+        self.blinks_required = blinks_required
+        self.blinks_detected = 0
+        self.track = None # FaceTracker.track de la cara que está haciendo el reto
+        self.start_time = time.time() if now is None else now
+        self.last_seen = self.start_time
+
+    def elapsed(self, now=None):
+        return (time.time() if now is None else now) - self.start_time
+
+
+class LivenessSessionStore:
+    """
+    Sesiones de prueba de vida por dispositivo, seguras entre hilos.
+
+    - Búsqueda O(1) (OrderedDict) con orden LRU: `get` mueve la sesión al final.
+    - Capacidad acotada: al superar `capacity` se descarta la sesión usada
+      hace más tiempo, así la memoria no crece con cientos de dispositivos.
+    - Un hilo barredor expira las sesiones con más de `timeout` segundos y
+      llama a `on_expire(device_id, session)` (p. ej. para publicar el
+      timeout) sin esperar al siguiente frame del dispositivo.
+
+    `pop(device_id, expected=session)` solo elimina si la sesión sigue siendo
+    la misma: quien la elimina es el único que decide (frame o barredor).
+    """
+
+    def __init__(self, timeout, capacity=512, on_expire=None, sweep_interval=1.0):
+        self.timeout = timeout
+        self.capacity = capacity
+        self.on_expire = on_expire
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, device_id):
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is not None:
+                self._sessions.move_to_end(device_id)
+                session.last_seen = time.time()
+            return session
+
+    def get_or_create(self, device_id, factory):
+        """Retorna (sesión, creada). `factory()` construye la sesión nueva bajo el lock."""
+        evicted = []
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is not None:
+                self._sessions.move_to_end(device_id)
+                session.last_seen = time.time()
+                return session, False
+            session = self._sessions[device_id] = factory()
+            while len(self._sessions) > self.capacity:
+                evicted.append(self._sessions.popitem(last=False)[0])
+        for old_id in evicted: print(f"[Liveness] Capacidad ({self.capacity}) superada: se descarta la sesión de {old_id}")
+        return session, True
+
+    def pop(self, device_id, expected=None):
+        """Elimina y retorna la sesión (o None). Con `expected`, solo si sigue siendo esa sesión."""
+        with self._lock:
+            session = self._sessions.get(device_id)
+            if session is None or (expected is not None and session is not expected): return None
+            return self._sessions.pop(device_id)
+
+    def expire(self, now=None):
+        """Quita y retorna [(device_id, sesión)] de las sesiones vencidas."""
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [(device_id, s) for device_id, s in self._sessions.items() if s.elapsed(now) > self.timeout]
+            for device_id, _ in expired: del self._sessions[device_id]
+        return expired
+
+    # --- Barredor en segundo plano ---
+    def start_sweeper(self):
+        if self._sweeper is not None: return
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="liveness-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+        if self._sweeper is not None: self._sweeper.join()
+        self._sweeper = None
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.sweep_interval):
+            for device_id, session in self.expire():
+                try:
+                    if self.on_expire: self.on_expire(device_id, session)
+                except Exception:
+                    print(f"[Liveness] Error expirando sesión de {device_id}\n{traceback.format_exc()}")
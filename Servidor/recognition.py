@@ -0,0 +1,387 @@
+"""
+Núcleo del reconocimiento facial por stream: motor facial, índice de
+embeddings, reto de parpadeo y decisión de acceso.
+
+Lo usan el proceso Flask (app.py, con FACIAL_STREAM_IN_PROCESS=1) y los
+procesos recognition_worker.py. Solo LEE el almacén de embeddings: no
+enrola, no re-entrena, no toca la caché de embeddings ni escribe en la BBDD.
+Quien arranca el pipeline (`start_pipeline`) le pasa el cliente MQTT de las
+respuestas, la caché de autorización y cómo registrar cada decisión.
+"""
+import os
+import time
+import json
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# --- IMPORTAR TU SCRIPT DE ANTI-SPOOFING ---
+try:
+    # Importará la nueva versión con ear_thresh=0.25
+    from anti_spoofing import BlinkDetector
+    print("Módulo Anti-Spoofing (BlinkDetector) cargado.")
+except ImportError:
+    print("ERROR: No se encontró el archivo 'anti_spoofing.py'.")
+    BlinkDetector = None
+
+from embedding_index import EmbeddingIndex
+from embedding_store import EmbeddingStore, apply_journal
+from face_engine import create_engine, engine_class
+from frame_dispatcher import FrameDispatcher
+from liveness_sessions import LivenessSession, LivenessSessionStore
+from face_tracker import FaceTracker
+from speculative_embedding import SpeculativeEmbedding
+import frame_quality
+from embed_batcher import EmbedBatcher
+from metrics import Counter, Gauge, Histogram
+
+# --- Configuración ---
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+# Workers en otras máquinas: apuntar a una copia / montaje de solo lectura de los datos del servidor
+EMBEDDINGS_DIR = os.environ.get("EMBEDDINGS_DIR", os.path.join(BASE_DIR, "embeddings")) # Almacén binario versionado (mmap)
+DATABASE_PATH = os.environ.get("DATABASE_PATH", os.path.join(BASE_DIR, "database.db")) # BBDD de usuarios: la escribe app.py, los workers solo la leen
+# Motor facial (detector + landmarks + embedder): 'dlib' (HOG + ResNet) o 'yunet' (OpenCV YuNet + SFace).
+# Los embeddings quedan etiquetados con el MODEL_ID del motor: al cambiar de motor hay que re-entrenar.
+FACE_ENGINE = os.environ.get("FACE_ENGINE", "dlib")
+EMBEDDING_MODEL = engine_class(FACE_ENGINE).MODEL_ID # Modelo con el que se generan los embeddings
+EMBEDDING_DIM = engine_class(FACE_ENGINE).DIM
+DLIB_PREDICTOR_PATH = os.path.join(BASE_DIR, "shape_predictor_68_face_landmarks.dat")
+
+# ==================================================================
+# AJUSTE #5: Reto de 2 parpadeos y Timeout de 12s
+# ==================================================================
+LIVENESS_TIMEOUT = 12.0 # <-- Aumentado a 12s para dar tiempo a 2 parpadeos
+LIVENESS_MAX_SESSIONS = 512 # Sesiones de parpadeo simultáneas (se descarta la menos reciente)
+LIVENESS_SWEEP_INTERVAL = 1.0 # Cada cuántos segundos se buscan sesiones vencidas
+TRACKER_REDETECT_EVERY = 10 # Durante el reto se detecta en la región de la cara anterior; cada N frames, en el frame completo
+TRACKER_ROI_SCALE = 1.8 # Tamaño de la región de búsqueda respecto a la caja anterior
+QUALITY_MIN_SHARPNESS = frame_quality.MIN_SHARPNESS # Varianza del Laplaciano mínima en la cara
+QUALITY_MIN_FACE_SIZE = frame_quality.MIN_FACE_SIZE # Lado mínimo (px) de la cara
+SPECULATIVE_WORKERS = 2 # Hilos que calculan embedding + match del mejor frame durante el reto
+SPECULATIVE_WAIT = 1.0 # Segundos máximos esperando el cálculo especulativo en curso al confirmar el reto
+EMBED_BATCH_WINDOW = 0.008 # Ventana (s) para juntar caras de distintos dispositivos en un mismo lote
+EMBED_BATCH_MAX = 8 # Tamaño máximo de lote del embedder
+EMBED_BATCH_WORKERS = 2 # Hilos que arman y procesan lotes
+MATCH_TOLERANCE = engine_class(FACE_ENGINE).TOLERANCE # Distancia máxima (euclidiana) para aceptar un match
+MATCH_TOP_K = 5 # Candidatos más cercanos que devuelve el índice por consulta
+# Modo de identificación 1:N:
+#   'exact'    -> distancia contra TODAS las plantillas (usuarios x fotos)
+#   'centroid' -> prefiltro con un centroide por usuario + re-ranking de plantillas
+#   'ivf'      -> índice aproximado IVF (opcional PQ) + re-ranking exacto (galerías grandes)
+IDENTIFICATION_MODE = 'centroid'
+CENTROID_CANDIDATES = 5 # Usuarios que pasan del prefiltro de centroides al re-ranking
+ANN_MIN_GALLERY = 20000 # En modo 'ivf', tamaño mínimo de galería para construir el IVF
+ANN_NLIST = None # Listas IVF (None = ~4*sqrt(N))
+ANN_NPROBE = 8 # Listas sondeadas por consulta (más = mejor recall, más latencia)
+ANN_PQ_SUBVECTORS = 0 # 0 = IVF-flat; >0 comprime residuos con PQ (menos memoria, más lento en NumPy)
+ANN_RERANK = 64 # Candidatos PQ que se re-ordenan con distancia exacta
+# Pool de reconocimiento (fuera del hilo de red de MQTT)
+RECOGNITION_WORKERS = max(2, os.cpu_count() or 2) # Hilos que procesan frames de distintos dispositivos en paralelo
+FRAME_QUEUE_PER_DEVICE = 2 # Frames pendientes por dispositivo; con la cola llena se descarta el más viejo
+
+# --- MQTT (stream facial) ---
+MQTT_BROKER_IP = "127.0.0.1"; MQTT_PORT = 1883
+TOPIC_REQ_FACIAL_STREAM = "acceso/request/facial/stream"; TOPIC_REQ_FACIAL_STOP = "acceso/request/facial/stop"
+TOPIC_RESPONSE_BASE = "acceso/response"
+TOPIC_LOG_FACIAL = "acceso/log/facial" # Decisiones de los workers: las registra app.py (único que escribe AccessLog)
+TOPIC_AUTH_INVALIDATE = "acceso/auth/invalidate" # Cédulas / huellas modificadas en app.py: los workers las olvidan de su AuthCache
+
+# --- Lock para Encodings ---
+# Reentrante: el re-entrenamiento compacta y recarga face_index dentro del mismo bloque
+encoding_lock = threading.RLock()
+
+# --- Métricas (formato Prometheus en /metrics) ---
+STAGE_SECONDS = Histogram("facial_stage_seconds", "Duración de cada etapa del pipeline facial (embed y match: por lote)", ["stage"])
+EMBED_BATCH_SIZE = Histogram("facial_embed_batch_size", "Caras por lote del embedder", buckets=(1, 2, 4, 8, 16, 32))
+FRAMES_RECEIVED = Counter("facial_frames_received_total", "Frames del stream facial recibidos por dispositivo", ["device"])
+DECISIONS = Counter("access_decisions_total", "Decisiones de acceso enviadas a los dispositivos", ["method", "status"])
+Counter("facial_frames_dropped_total", "Frames descartados (cola llena por dispositivo o STOP)", fn=lambda: frame_dispatcher.dropped)
+Gauge("facial_frame_queue_depth", "Frames encolados esperando al pool de reconocimiento", fn=lambda: frame_dispatcher.pending())
+Gauge("liveness_sessions_active", "Sesiones de prueba de vida activas", fn=lambda: len(liveness_sessions))
+Gauge("gallery_embeddings", "Embeddings en el índice de reconocimiento", fn=lambda: len(face_index))
+
+# --- Cargar Modelos Pesados (Motor facial) ---
+face_engine = None
+
+def load_face_engine():
+    global face_engine
+    try:
+        face_engine = create_engine(FACE_ENGINE, BASE_DIR)
+        print(f"Motor facial '{FACE_ENGINE}' cargado (embeddings '{EMBEDDING_MODEL}', tolerancia {MATCH_TOLERANCE}).")
+    except Exception as e:
+        print(f"Error al cargar el motor facial '{FACE_ENGINE}': {e}")
+        face_engine = None
+
+# --- GESTOR DE ESTADO DE ANTI-SPOOFING ---
+# Una LivenessSession por dispositivo; el barredor publica el timeout (ver expire_liveness_session)
+speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+liveness_sessions = LivenessSessionStore(LIVENESS_TIMEOUT, capacity=LIVENESS_MAX_SESSIONS, sweep_interval=LIVENESS_SWEEP_INTERVAL)
+
+# --- Cargar Encodings Faciales ---
+# Índice 1:N en memoria (matriz float32 contigua). Se reemplaza completo al recargar.
+embedding_store = EmbeddingStore(EMBEDDINGS_DIR, model=EMBEDDING_MODEL, dim=EMBEDDING_DIM)
+face_index = EmbeddingIndex(dim=EMBEDDING_DIM)
+face_index_source = (None, 0) # (generación, registros del journal aplicados) de face_index
+
+def load_encodings():
+    """
+    Abre la generación actual del almacén con mmap (sin copiar) y la publica como face_index.
+    Corre bajo encoding_lock: un enrolamiento o revocación no puede caer entre la
+    lectura del journal y el reemplazo del índice (se perdería en memoria).
+    """
+    with encoding_lock: _load_encodings()
+
+def _load_encodings():
+    global face_index, face_index_source
+    source = (None, 0)
+    index = EmbeddingIndex(dim=EMBEDDING_DIM)
+    try:
+        loaded = embedding_store.load()
+        if loaded is not None:
+            vectors, norms_sq, labels, names, header = loaded
+            index = EmbeddingIndex.from_arrays(vectors, labels, names, norms_sq=norms_sq)
+            journal_ops, journal_cedulas, journal_vectors = embedding_store.read_journal(header)
+            apply_journal(index, journal_ops, journal_cedulas, journal_vectors) # Cambios posteriores a la generación
+            source = (header['generation'], len(journal_ops))
+            print(f"Encodings cargados desde '{EMBEDDINGS_DIR}' (generación {header['generation']}, "
+                  f"{len(index)} rostros, {len(journal_cedulas)} desde el journal).")
+        elif not embedding_store.exists():
+            print(f"Advertencia: No se encontró '{EMBEDDINGS_DIR}'. ¡Necesita re-entrenar!")
+    except Exception as e: print(f"Error al cargar encodings: {e}")
+    if IDENTIFICATION_MODE == 'ivf' and len(index) >= ANN_MIN_GALLERY:
+        index.build_ann(nlist=ANN_NLIST, pq_subvectors=ANN_PQ_SUBVECTORS)
+    face_index = index # Reemplazo atómico de la referencia: las consultas en curso usan el índice anterior
+    face_index_source = source
+
+def refresh_encodings():
+    """
+    Para procesos que solo LEEN el almacén (recognition_worker.py): si el
+    proceso Flask publicó una generación nueva la recarga; si solo creció el journal
+    aplica los registros nuevos sobre face_index. Retorna True si hubo cambios.
+    """
+    global face_index_source
+    with encoding_lock:
+        if not embedding_store.exists(): return False
+        header = embedding_store.read_header()
+        generation, applied = face_index_source
+        if header.get('generation') != generation:
+            _load_encodings(); return True
+        journal_ops, journal_cedulas, journal_vectors = embedding_store.read_journal(header, start=applied)
+        if not journal_ops: return False
+        apply_journal(face_index, journal_ops, journal_cedulas, journal_vectors)
+        face_index_source = (generation, applied + len(journal_ops))
+    print(f"Journal: {len(journal_ops)} registros nuevos aplicados (generación {generation}, {len(face_index)} rostros).")
+    return True
+
+def identify(index, encoding):
+    """Identificación 1:N según IDENTIFICATION_MODE. Retorna (cedula|None, distancia, top_k)."""
+    if IDENTIFICATION_MODE == 'centroid':
+        return index.search_two_stage(encoding, k=MATCH_TOP_K, tolerance=MATCH_TOLERANCE, candidates=CENTROID_CANDIDATES)
+    if IDENTIFICATION_MODE == 'ivf':
+        return index.search_ann(encoding, k=MATCH_TOP_K, tolerance=MATCH_TOLERANCE, nprobe=ANN_NPROBE, rerank=ANN_RERANK)
+    return index.search(encoding, k=MATCH_TOP_K, tolerance=MATCH_TOLERANCE)
+
+def identify_many(index, encodings):
+    """Como `identify` para varias sondas (B, D): la búsqueda exacta / de centroides es una sola GEMM."""
+    if IDENTIFICATION_MODE == 'centroid':
+        return index.search_two_stage_many(encodings, k=MATCH_TOP_K, tolerance=MATCH_TOLERANCE, candidates=CENTROID_CANDIDATES)
+    if IDENTIFICATION_MODE == 'ivf':
+        return [identify(index, encoding) for encoding in encodings]
+    return index.search_many(encodings, k=MATCH_TOP_K, tolerance=MATCH_TOLERANCE)
+
+def timed_embed_batch(items):
+    EMBED_BATCH_SIZE.observe(len(items))
+    with STAGE_SECONDS.time(stage="embed"): return face_engine.embed_batch(items)
+
+def timed_identify_many(index, encodings):
+    with STAGE_SECONDS.time(stage="match"): return identify_many(index, encodings)
+
+embed_batcher = EmbedBatcher(timed_embed_batch, timed_identify_many,
+                             window=EMBED_BATCH_WINDOW, max_batch=EMBED_BATCH_MAX, workers=EMBED_BATCH_WORKERS)
+
+# --- Lógica de Procesamiento Pesado ---
+# Los asigna start_pipeline(): cliente MQTT de las respuestas, caché de autorización
+# y log_decision(cedula, nombres, status) para registrar cada decisión final
+mqtt_client = None
+auth_cache = None
+log_decision = None
+
+def process_facial_liveness_and_recognition(image_bytes, rpi_client_id):
+    """
+    Procesa un frame del reto de parpadeo + reconocimiento. Retorna (status, nombres, cedula);
+    status None significa que la sesión ya fue decidida por otro camino (p. ej. el barredor
+    publicó el timeout) y no hay nada que responder.
+    """
+    current_time = time.time()
+
+    # 1. --- OBTENER O INICIALIZAR ESTADO ---
+    if BlinkDetector is None: return "denied_error", "AntiSpoofing no cargado", None
+    # AJUSTE: Reto fijo de 2 parpadeos (SEGURO y USABLE); BlinkDetector con ear_thresh=0.25
+    info, created = liveness_sessions.get_or_create(rpi_client_id, lambda: LivenessSession(
+        BlinkDetector(), blinks_required=2, tracker=FaceTracker(face_engine, TRACKER_REDETECT_EVERY, TRACKER_ROI_SCALE),
+        speculation=SpeculativeEmbedding(speculative_executor), now=current_time))
+    if created: print(f"Nueva prueba de vida para {rpi_client_id}: Se requieren {info.blinks_required} parpadeos.")
+
+    # 2. --- OBTENER ESTADO ACTUAL ---
+    blink_detector = info.detector
+    blinks_required = info.blinks_required
+    blinks_detected = info.blinks_detected
+
+    try:
+        # 3. --- PROCESAR IMAGEN ---
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        with STAGE_SECONDS.time(stage="decode"): frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if frame is None: return "denied_error", "Error decodificando frame", None
+        
+        # Corrección del typo de la versión anterior
+        with STAGE_SECONDS.time(stage="color"): gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) 
+        
+        if face_engine is None: return "denied_error", "Motor facial no cargado", None
+        
+        # Control de calidad barato: un frame oscuro/quemado no pasa ni a la detección
+        with STAGE_SECONDS.time(stage="quality"): quality = frame_quality.check_exposure(gray)
+        if not quality.ok: return quality.status, quality.message, None
+
+        with STAGE_SECONDS.time(stage="detect"): face = info.tracker.locate(frame, gray) # Región de la cara anterior o frame completo
+        if face is None:
+            if blink_detector: blink_detector.reset() # Resetear contador de frames si se pierde cara
+            info.speculation.invalidate() # La cara que vuelva puede ser de otra persona
+            return "verifying_no_face", "Buscando cara...", None
+        if info.tracker.track != info.track:
+            # Cara nueva (re-adquirida o salto de caja): los parpadeos y el embedding especulativo
+            # previos pueden ser de otra persona; el reto vuelve a empezar con ESTA cara
+            if info.track is not None and (info.blinks_detected or info.speculation.future is not None):
+                print(f"Cara distinta en {rpi_client_id} (track {info.track} -> {info.tracker.track}): se reinicia el reto.")
+            info.track = info.tracker.track
+            info.blinks_detected = blinks_detected = 0
+            blink_detector.reset(); info.speculation.invalidate()
+
+        # Cara pequeña o movida: se salta landmarks, parpadeo y embedding de este frame
+        with STAGE_SECONDS.time(stage="quality"): quality = frame_quality.check_face(gray, face, QUALITY_MIN_SHARPNESS, QUALITY_MIN_FACE_SIZE)
+        if not quality.ok: return quality.status, quality.message, None
+
+        with STAGE_SECONDS.time(stage="landmarks"): landmarks = face_engine.landmarks(gray, face)
+        info.tracker.check_landmarks(face, landmarks)
+        
+        # 4. --- COMPROBAR ESTADO DE LIVENESS ---
+        with STAGE_SECONDS.time(stage="liveness"): liveness_status = blink_detector.check_liveness(gray, landmarks)
+        elapsed_time = info.elapsed(current_time)
+
+        # Mientras se cuentan parpadeos: embedding + match del mejor frame con ojos abiertos, en segundo plano
+        if blink_detector.state == BlinkDetector.STATE_EYES_OPEN and len(face_index) > 0:
+            info.speculation.offer(quality.score, embed_batcher.match, frame, face, face_index, track=info.track)
+        
+        # 5. --- MANEJAR TIMEOUT ---
+        if elapsed_time > LIVENESS_TIMEOUT:
+            if liveness_sessions.pop(rpi_client_id, expected=info) is None: return None, None, None # Ya la expiró el barredor
+            print(f"Timeout Liveness para {rpi_client_id} ({blinks_detected}/{blinks_required} parpadeos)")
+            return "denied_spoofing", "Timeout Parpadeo", None
+
+        # 6. --- MANEJAR PARPADEO DETECTADO ("VIVO") ---
+        if blink_detector.state == BlinkDetector.STATE_BLINK:
+            blinks_detected += 1
+            info.blinks_detected = blinks_detected
+            print(f"Parpadeo {blinks_detected}/{blinks_required} detectado para {rpi_client_id}!")
+            
+            # Comprobar si ya se cumplió
+            if blinks_detected >= blinks_required:
+                 # --- ¡ÉXITO! ---
+                if liveness_sessions.pop(rpi_client_id, expected=info) is None: return None, None, None # Expiró mientras tanto
+                print(f"Liveness VIVO ({blinks_required} parpadeos) confirmado!")
+                # --- AHORA, CONTINUAR CON RECONOCIMIENTO ---
+                pass
+            
+            else:
+                # --- Aún faltan parpadeos ---
+                msg = f"Parpadee 1 vez más..."
+                return "verifying_liveness", msg, None
+
+        # 7. --- MANEJAR "AÚN VERIFICANDO" (No-VIVO, No-Timeout, No-Exito) ---
+        elif blinks_detected < blinks_required:
+            # El detector aún no dice "VIVO"
+            msg = liveness_status # (ej: "Mire al frente...")
+            if blinks_detected == 0:
+                 msg = f"Parpadee {blinks_required} veces..."
+            elif blinks_detected > 0:
+                 msg = f"Parpadee 1 vez más..."
+            
+            return "verifying_liveness", msg, None
+        
+        # 8. --- SI SE LLEGA AQUÍ, SIGNIFICA QUE blinks_detected >= blinks_required ---
+        # (El código de reconocimiento facial va aquí)
+
+        index = face_index # Referencia local: un re-entrenamiento puede reemplazar el índice global
+        if len(index) == 0:
+             print("ERROR CRÍTICO: Modelo no entrenado o vacío. ¡Re-entrene!")
+             return "denied_error", "Modelo no entrenado", None
+
+        # Solo se acepta el especulativo de la MISMA cara seguida (mismo track) que hizo los parpadeos
+        # y está en este frame "VIVO"; si no, se calcula sobre el frame actual
+        computed = info.speculation.take(SPECULATIVE_WAIT, track=info.track)
+        if computed is not None:
+            print(f"Procesando reconocimiento. Encoding especulativo (mejor frame del reto, misma cara).")
+        else:
+            computed = embed_batcher.match(frame, face, index) # Lote compartido con otros dispositivos
+            print(f"Procesando reconocimiento. Encoding {'calculado' if computed is not None else 'no disponible'}.")
+
+        if computed is not None:
+            encoding, matched_index, match = computed
+            # Mejor match + top-k del lote; se repite la búsqueda solo si el índice cambió (re-entrenamiento)
+            if matched_index is index: cedula, distance, top_k = match
+            else:
+                with STAGE_SECONDS.time(stage="match"): cedula, distance, top_k = identify(index, encoding)
+
+            if cedula is not None:
+                print(f"Match: {cedula} (Dist: {distance:.4f})")
+            elif top_k: # Vacío si el índice quedó sin filas (p. ej. todas las cédulas revocadas) o el IVF no halló candidatos
+                closest_cedula, closest_distance = top_k[0][0], top_k[0][1]
+                print(f"No match (Tolerancia {MATCH_TOLERANCE}). Más cercano: {closest_cedula} (Dist: {closest_distance:.4f})")
+            else:
+                print("No match: el índice no devolvió candidatos.")
+            
+            if cedula is not None:
+                user = auth_cache.user(cedula)
+                if user and (user.access_type == 'facial' or user.access_type == 'ambos'): return "authenticated", user.nombres, user.cedula
+                else: return "denied_no_access", "Acceso Facial No Permitido", cedula
+            else: return "denied_unknown", "Usuario Desconocido", None
+        else: return "denied_unknown", "Cara no reconocida (sin encoding)", None
+    
+    except Exception as e:
+        print(f"[Error Procesamiento Facial]\n{traceback.format_exc()}")
+        if liveness_sessions.pop(rpi_client_id, expected=info) is None: return None, None, None
+        return "denied_error", "Error del Servidor", None
+
+def handle_facial_frame(rpi_client_id, image_bytes):
+    """Procesa UN frame del stream facial (hilo del pool) y publica la respuesta al dispositivo."""
+    response_topic = f"{TOPIC_RESPONSE_BASE}/{rpi_client_id}"
+    status, nombres, cedula = process_facial_liveness_and_recognition(image_bytes, rpi_client_id)
+    if status is None: return # Sesión ya decidida (timeout del barredor)
+    response_payload = {"status": status, "nombres": nombres}
+    mqtt_client.publish(response_topic, json.dumps(response_payload))
+    if not status.startswith("verifying"):
+        DECISIONS.inc(method="facial", status=status)
+        liveness_sessions.pop(rpi_client_id)
+        frame_dispatcher.discard(rpi_client_id) # Frames encolados tras la decisión ya no sirven
+        if status != "denied_error": log_decision(cedula, nombres, status)
+        print(f"Respuesta facial enviada: {response_payload}")
+
+def expire_liveness_session(rpi_client_id, session):
+    """Llamado por el barredor: la sesión venció sin frames nuevos (p. ej. el RPi se desconectó)."""
+    print(f"Timeout Liveness para {rpi_client_id} ({session.blinks_detected}/{session.blinks_required} parpadeos, barredor)")
+    frame_dispatcher.discard(rpi_client_id)
+    response_payload = {"status": "denied_spoofing", "nombres": "Timeout Parpadeo"}
+    mqtt_client.publish(f"{TOPIC_RESPONSE_BASE}/{rpi_client_id}", json.dumps(response_payload))
+    DECISIONS.inc(method="facial", status="denied_spoofing")
+    log_decision(None, "Timeout Parpadeo", "denied_spoofing")
+
+liveness_sessions.on_expire = expire_liveness_session
+
+frame_dispatcher = FrameDispatcher(handle_facial_frame, workers=RECOGNITION_WORKERS, per_device=FRAME_QUEUE_PER_DEVICE)
+
+def start_pipeline(client, cache, decision_logger):
+    """Arranca el pool de frames y el barredor de sesiones de prueba de vida."""
+    global mqtt_client, auth_cache, log_decision
+    mqtt_client, auth_cache, log_decision = client, cache, decision_logger
+    frame_dispatcher.start(); liveness_sessions.start_sweeper()
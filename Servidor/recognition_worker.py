@@ -0,0 +1,221 @@
+"""
+Worker de reconocimiento facial independiente (escala horizontal).
+
+Varios procesos (en una o más máquinas) atienden el stream facial de los
+RPi. Cada worker:
+  - anuncia que está vivo con un latido retenido en acceso/workers/<id>
+    (Last Will vacío: si muere, el broker lo borra). Con los latidos arma
+    el anillo de hashing consistente, así al caer un worker sus
+    dispositivos pasan a los demás sin reiniciar el grupo;
+  - recibe los frames que el RPi le envía DIRECTO a su topic
+    (acceso/worker/<id>/facial/{stream,stop}/<rpi_client_id>): el RPi sigue
+    los mismos latidos, elige el dueño con el mismo anillo y lo mantiene
+    toda la sesión. Un solo publicador y un solo suscriptor por dispositivo:
+    el broker entrega sus frames en orden;
+  - se suscribe además con una suscripción COMPARTIDA de MQTT v5
+    ($share/reconocimiento/acceso/request/facial/{stream,stop}/+) para los
+    RPi que aún no conocen el anillo: el broker entrega cada frame a UN
+    worker; el dueño lo procesa y los demás lo descartan sin reenviarlo
+    (el dueño ve un subconjunto en orden, nunca frames desordenados).
+    Solo el STOP se reenvía al dueño;
+  - importa solo recognition.py (motor, índice, reto de parpadeo), no app.py:
+    abre el almacén de embeddings en solo lectura (mmap) y sigue los cambios
+    del proceso Flask: generación nueva = recarga, journal más largo = aplica
+    solo los registros nuevos;
+  - lee los usuarios de la BBDD en modo solo lectura (caché con TTL corto que
+    app.py invalida por acceso/auth/invalidate al editar / borrar usuarios o
+    enrolar huellas) y publica cada decisión en acceso/log/facial: el
+    proceso Flask es el único que escribe AccessLog (y la muestra en el
+    dashboard en vivo).
+
+El proceso Flask sigue atendiendo enrolamiento, huella y la web; arrancarlo
+con FACIAL_STREAM_IN_PROCESS=0 para que no procese también el stream.
+En otras máquinas, EMBEDDINGS_DIR y DATABASE_PATH apuntan a un montaje de
+solo lectura (o copia sincronizada) del directorio de datos del servidor.
+
+Uso (3 workers contra un mosquitto local):
+    FACIAL_STREAM_IN_PROCESS=0 python app.py
+    python recognition_worker.py --id w0
+    python recognition_worker.py --id w1
+    python recognition_worker.py --id w2
+
+Con --metrics-port cada worker expone sus métricas Prometheus en /metrics.
+"""
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import traceback
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import paho.mqtt.client as mqtt
+
+import recognition
+from recognition import DATABASE_PATH, MQTT_BROKER_IP, MQTT_PORT, TOPIC_REQ_FACIAL_STREAM, TOPIC_REQ_FACIAL_STOP, TOPIC_LOG_FACIAL, TOPIC_AUTH_INVALIDATE
+from auth_cache import AuthCache, AuthEntry
+from hash_ring import HashRing
+from metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge
+
+SHARE_GROUP = "reconocimiento"
+TOPIC_WORKER_MEMBERS = "acceso/workers" # acceso/workers/<worker>: latido retenido (vacío = el worker salió)
+TOPIC_WORKER_BASE = "acceso/worker" # acceso/worker/<worker>/facial/{stream|stop}/<rpi_client_id>
+STORE_REFRESH_INTERVAL = 2.0 # Segundos entre revisiones del almacén de embeddings (y entre latidos)
+WORKER_TIMEOUT = 3 * STORE_REFRESH_INTERVAL # Sin latido en este tiempo el worker sale del anillo (respaldo del Last Will)
+# Respaldo de las invalidaciones de app.py (TOPIC_AUTH_INVALIDATE): si una se pierde (worker desconectado,
+# Flask sin broker) un usuario editado / borrado puede seguir autorizado en este worker hasta AUTH_CACHE_TTL segundos
+AUTH_CACHE_TTL = 5.0
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics": self.send_error(404); return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE); self.send_header("Content-Length", str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Sin una línea por cada scrape
+
+
+def serve_metrics(port):
+    httpd = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Métricas en http://0.0.0.0:{port}/metrics")
+
+
+# --- Usuarios (BBDD en solo lectura; tabla 'user' de app.py) ---
+def _query_users(where="", params=()):
+    with closing(sqlite3.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True)) as conn:
+        return conn.execute(f"SELECT cedula, nombres, access_type, fingerprint_id FROM user {where}", params).fetchall()
+
+def load_auth_by_cedula(cedula):
+    rows = _query_users("WHERE cedula = ?", (cedula,))
+    return AuthEntry(*rows[0][:3]) if rows else None
+
+def load_auth_by_fingerprint(fingerprint_id):
+    rows = _query_users("WHERE fingerprint_id = ?", (fingerprint_id,))
+    return AuthEntry(*rows[0][:3]) if rows else None
+
+
+class RecognitionWorker:
+    def __init__(self, worker_id, broker, port):
+        self.worker_id = worker_id
+        self.broker, self.port = broker, port
+        self.member_topic = f"{TOPIC_WORKER_MEMBERS}/{worker_id}"
+        self.members = {worker_id: time.monotonic()} # worker -> último latido visto
+        self.members_lock = threading.Lock()
+        self.ring = HashRing([worker_id]) # Se reemplaza completo al cambiar los miembros
+        self.ignored = 0 # Frames de la suscripción compartida cuyo dueño es otro worker
+        self.auth_cache = AuthCache(load_auth_by_cedula, load_auth_by_fingerprint, ttl=AUTH_CACHE_TTL)
+        Counter("auth_cache_misses_total", "Consultas de autorización que fueron a la BBDD", fn=lambda: self.auth_cache.misses)
+        Counter("frames_ignored_total", "Frames compartidos descartados por ser de otro worker", fn=lambda: self.ignored)
+        Gauge("ring_workers", "Workers vivos en el anillo de hashing consistente", fn=lambda: len(self.ring.nodes))
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"recognition_worker_{worker_id}", protocol=mqtt.MQTTv5)
+        self.client.will_set(self.member_topic, b"", qos=1, retain=True)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+
+    # --- Miembros del anillo ---
+    def heartbeat(self):
+        self.client.publish(self.member_topic, json.dumps({"id": self.worker_id}), qos=1, retain=True)
+
+    def update_members(self, alive=(), gone=()):
+        """Registra latidos / salidas, expira a los workers sin latido y reconstruye el anillo si cambió."""
+        now = time.monotonic()
+        with self.members_lock:
+            before = set(self.members)
+            for worker in alive: self.members[worker] = now
+            for worker in gone:
+                if worker != self.worker_id: self.members.pop(worker, None)
+            for worker, seen in list(self.members.items()):
+                if worker != self.worker_id and now - seen > WORKER_TIMEOUT: del self.members[worker]
+            if set(self.members) == before: return
+            self.ring = HashRing(self.members)
+        print(f"[Worker {self.worker_id}] Anillo: {self.ring.nodes}.")
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code != 0:
+            print(f"[Worker {self.worker_id}] Fallo al conectar a MQTT, código {reason_code}"); return
+        # Recarga completa: las invalidaciones publicadas mientras estaba desconectado se perdieron
+        count = self.auth_cache.warm(_query_users())
+        print(f"[Worker {self.worker_id}] Caché de autorización: {count} usuarios precargados.")
+        client.subscribe(TOPIC_AUTH_INVALIDATE, qos=1)
+        client.subscribe(f"{TOPIC_WORKER_MEMBERS}/+", qos=1)
+        client.subscribe(f"{TOPIC_WORKER_BASE}/{self.worker_id}/facial/#") # Frames enrutados por el RPi (o STOP reenviado)
+        client.subscribe(f"$share/{SHARE_GROUP}/{TOPIC_REQ_FACIAL_STREAM}/+")
+        client.subscribe(f"$share/{SHARE_GROUP}/{TOPIC_REQ_FACIAL_STOP}/+")
+        self.heartbeat()
+        print(f"[Worker {self.worker_id}] Conectado; grupo '{SHARE_GROUP}'.")
+
+    def on_message(self, client, userdata, msg):
+        # Solo enruta y encola: el procesamiento corre en el pool de recognition.frame_dispatcher
+        try:
+            if msg.topic == TOPIC_AUTH_INVALIDATE:
+                data = json.loads(msg.payload.decode('utf-8'))
+                self.auth_cache.invalidate(cedulas=data.get("cedulas", ()), fingerprint_ids=data.get("fingerprint_ids", ())); return
+            parts = msg.topic.split('/')
+            if msg.topic.startswith(f"{TOPIC_WORKER_MEMBERS}/"):
+                if msg.payload: self.update_members(alive=[parts[-1]])
+                else: self.update_members(gone=[parts[-1]])
+                return
+            rpi_client_id = parts[-1]
+            routed = msg.topic.startswith(f"{TOPIC_WORKER_BASE}/")
+            kind = parts[-2] if routed else ("stream" if msg.topic.startswith(TOPIC_REQ_FACIAL_STREAM) else "stop")
+            if not routed:
+                # Suscripción compartida: el RPi no eligió worker. Solo el dueño procesa; los frames no se reenvían
+                owner = self.ring.owner(rpi_client_id)
+                if owner != self.worker_id:
+                    if kind == "stop": client.publish(f"{TOPIC_WORKER_BASE}/{owner}/facial/stop/{rpi_client_id}", msg.payload)
+                    else: self.ignored += 1
+                    return
+            if kind == "stream":
+                recognition.FRAMES_RECEIVED.inc(device=rpi_client_id)
+                recognition.frame_dispatcher.submit(rpi_client_id, msg.payload)
+            else:
+                print(f"[Worker {self.worker_id}] RPi {rpi_client_id} detuvo stream.")
+                recognition.frame_dispatcher.discard(rpi_client_id)
+                recognition.liveness_sessions.pop(rpi_client_id)
+        except Exception:
+            print(f"[Worker {self.worker_id}] Error en on_message\n{traceback.format_exc()}")
+
+    def log_decision(self, cedula, nombres, status):
+        """El registro lo escribe el proceso Flask (TOPIC_LOG_FACIAL): este proceso no escribe la BBDD."""
+        self.client.publish(TOPIC_LOG_FACIAL, json.dumps({"cedula": cedula, "nombres": nombres, "status": status}), qos=1)
+
+    def run(self):
+        recognition.load_face_engine(); recognition.load_encodings()
+        recognition.start_pipeline(self.client, self.auth_cache, self.log_decision)
+        self.client.connect(self.broker, self.port, 60)
+        self.client.loop_start()
+        try:
+            while True:
+                time.sleep(STORE_REFRESH_INTERVAL)
+                self.heartbeat(); self.update_members() # Expira a los workers sin latido
+                try: recognition.refresh_encodings()
+                except Exception as e: print(f"[Worker {self.worker_id}] Error refrescando encodings: {e}")
+        except KeyboardInterrupt:
+            print(f"[Worker {self.worker_id}] Deteniendo ({self.ignored} frames de otros workers ignorados, "
+                  f"{recognition.frame_dispatcher.dropped} descartados).")
+        finally:
+            # Salida ordenada: el Last Will solo se publica si la conexión se corta
+            try: self.client.publish(self.member_topic, b"", qos=1, retain=True).wait_for_publish(timeout=2.0)
+            except Exception as e: print(f"[Worker {self.worker_id}] Error anunciando la salida: {e}")
+            self.client.disconnect(); self.client.loop_stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--id', required=True, help='Identificador único de este worker en el grupo')
+    parser.add_argument('--broker', default=MQTT_BROKER_IP)
+    parser.add_argument('--port', type=int, default=MQTT_PORT)
+    parser.add_argument('--metrics-port', type=int, default=None, help='Puerto HTTP para /metrics (Prometheus)')
+    args = parser.parse_args()
+    if any(c in args.id for c in '/+#'): parser.error("--id no puede contener '/', '+' ni '#'")
+    if args.metrics_port: serve_metrics(args.metrics_port)
+    RecognitionWorker(args.id, args.broker, args.port).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import time
+import itertools
+import threading
+import traceback
+
+
+class RetrainCancelled(Exception):
+    """La corrida fue cancelada (o reemplazada por un pedido más nuevo)."""
+
+
+class RetrainJob:
+    """Una corrida de re-entrenamiento: estado, avance y cancelación cooperativa."""
+
+    def __init__(self, job_id, reason):
+        self.id = job_id
+        self.reasons = [reason]
+        self.state = "pending" # pending -> running -> done | failed | cancelled
+        self.phase = None
+        self.message = None
+        self.done = 0
+        self.total = None
+        self.eta = None
+        self.requested_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    def cancel(self): self._cancel.set()
+
+    def cancelled(self): return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """La tarea lo llama por cada imagen: lanza RetrainCancelled si hay que abandonar la corrida."""
+        if self._cancel.is_set(): raise RetrainCancelled()
+
+    def progress(self, done, total, eta=None):
+        self.done, self.total, self.eta = done, total, eta
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {"id": self.id, "state": self.state, "phase": self.phase, "message": self.message, "reasons": self.reasons,
+                "done": self.done, "total": self.total, "eta_seconds": None if self.eta is None else round(self.eta, 1),
+                "requested_at": self.requested_at, "started_at": self.started_at, "finished_at": self.finished_at,
+                "elapsed_seconds": round(end - self.started_at, 1) if self.started_at else None}
+
+
+class RetrainScheduler:
+    """
+    Planificador del re-entrenamiento completo: UNA corrida a la vez, en un
+    único hilo de fondo.
+
+    - Coalescencia: los pedidos que llegan mientras hay uno pendiente se suman
+      a ese mismo pendiente (N clics = 1 corrida).
+    - Reemplazo: si llega un pedido mientras una corrida está en curso (con
+      `supersede=True`), esa corrida se cancela -- ya no refleja el dataset
+      actual -- y el pendiente arranca apenas termine de abandonar. Gracias a
+      la caché de embeddings, la corrida nueva no repite el trabajo hecho.
+    - Cancelación cooperativa: `task(job)` llama a `job.check_cancelled()` por
+      imagen y reporta avance con `job.progress(...)`. Debe retornar False si
+      falló (True/None = terminó bien).
+    """
+
+    def __init__(self, task, name="retrain-scheduler"):
+        self.task = task
+        self.name = name
+        self.running = None
+        self.pending = None
+        self.last = None
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def request(self, reason, supersede=True):
+        """Pide una corrida; retorna (job, coalesced) donde coalesced=True si se sumó a un pedido pendiente."""
+        with self._cond:
+            self._ensure_started()
+            if self.running is not None and supersede and not self.running.cancelled():
+                print(f"[Retrain] Corrida #{self.running.id} reemplazada por un pedido nuevo ({reason}).")
+                self.running.cancel()
+            if self.pending is not None:
+                self.pending.reasons.append(reason)
+                return self.pending, True
+            self.pending = RetrainJob(next(self._ids), reason)
+            self._cond.notify()
+            return self.pending, False
+
+    def cancel(self):
+        """Cancela el pendiente y la corrida en curso. Retorna True si había algo que cancelar."""
+        with self._cond:
+            cancelled = False
+            if self.pending is not None:
+                self.pending.state = "cancelled"; self.pending.finished_at = time.time()
+                self.last, self.pending, cancelled = self.pending, None, True
+            if self.running is not None:
+                self.running.cancel(); cancelled = True
+            return cancelled
+
+    def status(self):
+        with self._cond:
+            return {"running": self.running.to_dict() if self.running else None,
+                    "pending": self.pending.to_dict() if self.pending else None,
+                    "last": self.last.to_dict() if self.last else None}
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self.pending is None: self._cond.wait()
+                job, self.pending = self.pending, None
+                job.state, job.started_at = "running", time.time()
+                self.running = job
+            try:
+                ok = self.task(job)
+                job.state = "failed" if ok is False else "done"
+            except RetrainCancelled:
+                job.state = "cancelled"
+                print(f"[Retrain] Corrida #{job.id} cancelada ({job.done}/{job.total or '?'} imágenes).")
+            except Exception:
+                job.state, job.message = "failed", "Error inesperado"
+                print(f"[Retrain] Error en la corrida #{job.id}\n{traceback.format_exc()}")
+            with self._cond:
+                job.finished_at = time.time(); job.eta = None
+                self.running, self.last = None, job
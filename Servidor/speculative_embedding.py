@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import CancelledError
+
+
+class SpeculativeEmbedding:
+    """
+    Embedding + match calculados en segundo plano mientras se cuentan los parpadeos.
+
+    Cada frame con ojos abiertos se ofrece con su puntaje de calidad
+    (frame_quality.check_face); si mejora en al menos `min_gain` al mejor
+    visto, se lanza `compute(*args)` en el executor (y se cancela el anterior
+    si aún no empezó). Al confirmar la
+    prueba de vida, `take` entrega el último resultado sin recalcular.
+    `invalidate` descarta todo (p. ej. se perdió la cara: puede ser otra persona).
+
+    Cada cálculo queda asociado al `track` de la cara (FaceTracker.track):
+    `take(track=...)` solo entrega un resultado de esa misma cara seguida sin
+    interrupción; si no coincide, hay que calcular sobre el frame actual.
+    """
+
+    def __init__(self, executor, min_gain=1.15):
+        self.executor = executor
+        self.min_gain = min_gain
+        self.quality = 0.0
+        self.future = None
+        self.track = None
+        self._lock = threading.Lock()
+
+    def offer(self, quality, compute, *args, track=None):
+        """Retorna True si este frame pasó a ser el candidato (se lanzó el cálculo)."""
+        with self._lock:
+            if self.future is not None and track != self.track: self.future.cancel(); self.future = None # Otra cara
+            if self.future is not None and quality < self.quality * self.min_gain: return False
+            if self.future is not None: self.future.cancel()
+            self.quality, self.track = quality, track
+            self.future = self.executor.submit(compute, *args)
+            return True
+
+    def invalidate(self):
+        with self._lock:
+            if self.future is not None: self.future.cancel()
+            self.future = None
+            self.quality = 0.0
+            self.track = None
+
+    def take(self, timeout=1.0, track=None):
+        """
+        Resultado del mejor frame de la cara `track`, o None si no hay, es de
+        otra cara o aún no empezó (entonces conviene calcular sobre el frame
+        actual). Si está en curso, espera.
+        """
+        with self._lock:
+            future, self.future, self.quality = self.future, None, 0.0
+            same_face, self.track = future is not None and self.track == track, None
+        if future is None: return None
+        if not same_face: future.cancel(); return None
+        if future.cancel(): return None
+        try: return future.result(timeout=timeout)
+        except (CancelledError, Exception): return None
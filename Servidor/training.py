@@ -0,0 +1,130 @@
+import os
+import time
+import functools
+import multiprocessing
+import cv2
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+
+
+def list_dataset_images(dataset_path, allowed_cedulas):
+    """
+    Recorre dataset/<cedula>/ y retorna (tareas, omitidos):
+      - tareas: lista [(cedula, ruta_imagen), ...] de usuarios permitidos
+      - omitidos: carpetas de usuarios que no existen o no tienen acceso facial
+    """
+    tasks, skipped = [], []
+    for cedula_dir in sorted(os.listdir(dataset_path)):
+        user_folder = os.path.join(dataset_path, cedula_dir)
+        if not os.path.isdir(user_folder): continue
+        if cedula_dir not in allowed_cedulas:
+            skipped.append(cedula_dir); continue
+        for filename in sorted(os.listdir(user_folder)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                tasks.append((cedula_dir, os.path.join(user_folder, filename)))
+    return tasks, skipped
+
+
+def all_image_paths(dataset_path):
+    """Todas las imágenes del dataset (de cualquier usuario), para podar la caché."""
+    paths = []
+    for root, _, files in os.walk(dataset_path):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+
+_worker_engines = {} # Motor facial por proceso (se crea una vez por worker)
+
+
+def _get_engine(engine_name, base_dir):
+    key = (engine_name, base_dir)
+    if key not in _worker_engines:
+        from face_engine import create_engine
+        _worker_engines[key] = create_engine(engine_name, base_dir)
+    return _worker_engines[key]
+
+
+def encode_image_file(img_path, engine_name, base_dir):
+    """
+    Trabajo de UN proceso del pool: decodifica la imagen, detecta y calcula
+    el embedding con el motor `engine_name`. Retorna (encoding | None, error | None).
+    Se ejecuta en otro proceso: solo viajan la ruta y el vector (128 floats).
+    """
+    try:
+        image = cv2.imread(img_path, cv2.IMREAD_COLOR)
+        if image is None: return None, "No se pudo decodificar la imagen"
+        return _get_engine(engine_name, base_dir).embed_image(image), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _pool_context():
+    # 'forkserver' evita hacer fork de un proceso con hilos (MQTT, Flask);
+    # en Windows solo existe 'spawn'. Ambos re-importan el script principal
+    # como '__mp_main__' (app.py lo detecta y no levanta el servidor).
+    try: return multiprocessing.get_context('forkserver')
+    except ValueError: return multiprocessing.get_context('spawn')
+
+
+class ProgressReporter:
+    """Imprime avance (imágenes, img/s, ETA) cada `every` segundos y lo pasa a un callback opcional."""
+
+    def __init__(self, total, callback=None, every=2.0):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self.every = every
+        self.start = time.time()
+        self._last_print = 0.0
+
+    @property
+    def eta(self):
+        elapsed = time.time() - self.start
+        if self.done == 0: return None
+        return elapsed / self.done * (self.total - self.done)
+
+    def step(self):
+        self.done += 1
+        if self.callback: self.callback(self.done, self.total, self.eta)
+        now = time.time()
+        if now - self._last_print >= self.every or self.done == self.total:
+            self._last_print = now
+            rate = self.done / max(now - self.start, 1e-6)
+            eta = self.eta
+            eta_text = f", ETA {eta:.0f}s" if eta is not None else ""
+            print(f"  Progreso: {self.done}/{self.total} ({100.0 * self.done / max(self.total, 1):.0f}%), {rate:.1f} img/s{eta_text}")
+
+
+def encode_dataset(tasks, workers, engine_name, base_dir, progress=None):
+    """
+    Reparte decodificación + detección + embedding de `tasks` [(cedula, ruta)]
+    en un pool de `workers` procesos (cada uno con su motor `engine_name`) y va entregando los resultados a medida
+    que terminan: genera (cedula, ruta, encoding | None, error | None).
+
+    Memoria acotada: como máximo `workers * 4` imágenes en vuelo; cada
+    proceso abre su propia imagen desde disco.
+    """
+    if not tasks: return
+    reporter = ProgressReporter(len(tasks), callback=progress)
+    max_pending = max(1, workers) * 4
+    pending = {}
+    remaining = iter(tasks)
+    work = functools.partial(encode_image_file, engine_name=engine_name, base_dir=base_dir)
+
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=_pool_context()) as pool:
+        def submit_next():
+            task = next(remaining, None)
+            if task is None: return False
+            pending[pool.submit(work, task[1])] = task
+            return True
+
+        while len(pending) < max_pending and submit_next(): pass
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                cedula, img_path = pending.pop(future)
+                encoding, error = future.result()
+                reporter.step()
+                yield cedula, img_path, encoding, error
+                submit_next()